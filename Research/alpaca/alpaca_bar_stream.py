@@ -0,0 +1,257 @@
+import asyncio
+import collections
+import json
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+import websockets
+from alpaca_bars_client import ALPACA_DATA_FEED, BAR_FIELDS
+from ingestion.rate_limit import backoff_seconds
+
+# Alpaca real-time market data stream of the feed; point APCA_API_STREAM_URL at a local replay server to run offline
+ALPACA_STREAM_URL = os.environ.get("APCA_API_STREAM_URL", f"wss://stream.data.alpaca.markets/v2/{ALPACA_DATA_FEED or 'iex'}")
+# Bars received are stored together once the oldest has waited this long, or once this many are waiting.
+# The bars of every symbol arrive in a burst just after the minute closes, so a short wait collects the burst
+STREAM_BATCH_SECONDS = float(os.environ.get("ALPACA_STREAM_BATCH_SECONDS", "0.25"))
+STREAM_BATCH_ROWS = int(os.environ.get("ALPACA_STREAM_BATCH_ROWS", "5000"))
+# The latency is summarized over this many of the latest stored bars
+STREAM_LATENCY_WINDOW = 100_000
+# Error codes of the stream worth reconnecting after: connection limit exceeded, and internal error
+STREAM_RETRY_CODES = {406, 500}
+# Stream messages carrying bars: minute bars, and minute bars corrected by late trades
+BAR_MESSAGE_TYPES = {'b', 'u'}
+# Bar timestamps become seconds since the epoch to compare with time.time()
+EPOCH = pd.Timestamp(0, tz='UTC')
+LATENCY_COLUMNS = ['bars', 'batches', 'received_to_stored_p50', 'received_to_stored_p99',
+                   'bar_close_to_stored_p50', 'bar_close_to_stored_p99', 'bar_close_to_stored_max']
+
+
+class StreamError(Exception):
+    """An error message of the stream, like failed authentication or too many connections."""
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+class AlpacaBarStream:
+    """
+    Minute bars of some symbols from the Alpaca real-time stream, stored in micro-batches.
+
+    Bars are buffered as they arrive and stored together by `store` on a worker thread, at most
+    `batch_seconds` after the first of them arrived, while the stream keeps receiving. A dropped connection
+    is reopened with backoff and subscribed again; after every subscription `catch_up` runs on a thread of
+    its own, so a REST pass can fill in the bars missed while disconnected. The stream keeps the latency
+    from receiving a bar, and from the close of its minute, to the bar being stored. With `deferred`, the store
+    hands the bars on, e.g. to the spool, as store(data, stored) and calls stored() from any thread once they
+    are committed to the database, and the bar is stored then; otherwise it is stored when store returns.
+    """
+
+    source = 'alpaca'
+
+    def __init__(self, key_id, secret_key, symbols, store, stream_url=ALPACA_STREAM_URL, catch_up=None,
+                 batch_seconds=STREAM_BATCH_SECONDS, batch_rows=STREAM_BATCH_ROWS, deferred=False):
+        self.key_id = key_id
+        self.secret_key = secret_key
+        self.symbols = list(symbols)
+        self.store = store
+        self.stream_url = stream_url
+        self.catch_up = catch_up
+        self.batch_seconds = batch_seconds
+        self.batch_rows = batch_rows
+        self.deferred = deferred
+        self.connections = 0
+        self.bars_received = 0
+        self.bars_stored = 0
+        self.batches = 0
+        self.store_failures = 0
+        # Per stored bar: when it was received and when it was stored, both time.time(), and its minute; stored()
+        # of a deferred store runs on another thread
+        self._stored_lock = threading.Lock()
+        self.received_at = collections.deque(maxlen=STREAM_LATENCY_WINDOW)
+        self.stored_at = collections.deque(maxlen=STREAM_LATENCY_WINDOW)
+        self.bar_times = collections.deque(maxlen=STREAM_LATENCY_WINDOW)
+        self._pending = []
+        self._first_pending = None
+        self._bars_waiting = None
+        self._stopping = None
+        self._catch_up_task = None
+
+    async def run(self, duration=None):
+        """
+        Receive and store bars until stop is called or `duration` seconds have passed.
+
+        Bars still buffered when the stream stops are stored before it returns.
+        """
+        self._stopping = asyncio.Event()
+        self._bars_waiting = asyncio.Event()
+        if duration is not None:
+            asyncio.get_running_loop().call_later(duration, self.stop)
+        flusher = asyncio.create_task(self._flush_batches())
+        try:
+            await self._receive()
+        finally:
+            self._stopping.set()
+            self._bars_waiting.set()
+            await flusher
+            if self._catch_up_task is not None:
+                await self._catch_up_task
+
+    def stop(self):
+        """Close the stream; buffered bars are still stored."""
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def _receive(self):
+        attempt = 0
+        while not self._stopping.is_set():
+            try:
+                async with websockets.connect(self.stream_url) as websocket:
+                    await self._subscribe(websocket)
+                    attempt = 0
+                    stopping = asyncio.create_task(self._stopping.wait())
+                    try:
+                        while True:
+                            message = asyncio.create_task(websocket.recv())
+                            await asyncio.wait([message, stopping], return_when=asyncio.FIRST_COMPLETED)
+                            if not message.done():
+                                message.cancel()
+                                return
+                            self._handle(json.loads(message.result()), time.time())
+                    finally:
+                        stopping.cancel()
+            except StreamError as e:
+                if e.code not in STREAM_RETRY_CODES:
+                    raise
+                delay = backoff_seconds(attempt)
+                print(f"Stream error {e}, reconnecting in {delay:.1f}s")
+            except (websockets.WebSocketException, OSError, asyncio.TimeoutError) as e:
+                # Dropped connections, handshakes refused with e.g. HTTP 429 or 503, and connections timing out
+                delay = backoff_seconds(attempt)
+                print(f"Stream connection lost ({type(e).__name__}: {e}), reconnecting in {delay:.1f}s")
+            attempt += 1
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _subscribe(self, websocket):
+        """Authenticate and subscribe to the bars of the symbols, then start the catch-up."""
+        await self._expect(websocket, 'connected')
+        await websocket.send(json.dumps({'action': 'auth', 'key': self.key_id, 'secret': self.secret_key}))
+        await self._expect(websocket, 'authenticated')
+        await websocket.send(json.dumps({'action': 'subscribe', 'bars': self.symbols, 'updatedBars': self.symbols}))
+        await self._expect(websocket, 'subscription')
+        self.connections += 1
+        if self.catch_up is not None and (self._catch_up_task is None or self._catch_up_task.done()):
+            self._catch_up_task = asyncio.create_task(self._run_catch_up())
+
+    async def _expect(self, websocket, expected):
+        """Read control messages until the expected one, raising StreamError on an error message."""
+        while True:
+            for message in json.loads(await websocket.recv()):
+                if message['T'] == 'error':
+                    raise StreamError(message.get('code'), message.get('msg'))
+                if message['T'] == expected or message.get('msg') == expected:
+                    return
+
+    async def _run_catch_up(self):
+        try:
+            await asyncio.to_thread(self.catch_up)
+        except Exception as e:
+            print(f"Stream catch-up failed: {e}")
+
+    def _handle(self, messages, received):
+        """Buffer the bars of a stream message, raising StreamError on an error message."""
+        bars = 0
+        for message in messages:
+            kind = message['T']
+            if kind in BAR_MESSAGE_TYPES:
+                self._pending.append((message, received))
+                bars += 1
+            elif kind == 'error':
+                raise StreamError(message.get('code'), message.get('msg'))
+        if bars:
+            self.bars_received += bars
+            if self._first_pending is None:
+                self._first_pending = received
+            self._bars_waiting.set()
+
+    async def _flush_batches(self):
+        """Store the buffered bars a batch at a time, until the stream stops and nothing is left."""
+        while True:
+            await self._bars_waiting.wait()
+            # Wait for the rest of the burst, unless the batch is full or the stream stops
+            while (self._pending and len(self._pending) < self.batch_rows and not self._stopping.is_set()
+                   and time.time() < self._first_pending + self.batch_seconds):
+                await asyncio.sleep(min(0.01, self._first_pending + self.batch_seconds - time.time()))
+            batch, self._pending, self._first_pending = self._pending, [], None
+            self._bars_waiting.clear()
+            if batch:
+                await self._store_batch(batch)
+            if self._stopping.is_set() and not self._pending:
+                return
+
+    async def _store_batch(self, batch):
+        data = stream_bars_frame([message for message, _ in batch])
+        received_at = [received for _, received in batch]
+        bar_times = (data.index - EPOCH).total_seconds()
+        try:
+            if self.deferred:
+                await asyncio.to_thread(self.store, data, lambda: self._stored(received_at, bar_times))
+            else:
+                await asyncio.to_thread(self.store, data)
+        except Exception as e:
+            self.store_failures += 1
+            print(f"Storing {len(batch)} streamed bars failed: {e}")
+            return
+        if not self.deferred:
+            self._stored(received_at, bar_times)
+
+    def _stored(self, received_at, bar_times):
+        """Count a batch as stored now."""
+        stored = time.time()
+        with self._stored_lock:
+            self.batches += 1
+            self.bars_stored += len(received_at)
+            self.received_at.extend(received_at)
+            self.stored_at.extend([stored] * len(received_at))
+            self.bar_times.extend(bar_times)
+
+    def latency(self):
+        """
+        Summarize how long the latest stored bars took to reach the database.
+
+        Returns:
+        pd.Series: LATENCY_COLUMNS, in seconds for the latencies: from receiving a bar to it being stored, and from
+                   the close of its minute to it being stored, the end-to-end delay of the data.
+        """
+        with self._stored_lock:
+            received = np.asarray(self.received_at)
+            stored = np.asarray(self.stored_at)
+            # A bar's timestamp is the start of its minute
+            closed = np.asarray(self.bar_times) + 60
+        if not len(stored):
+            return pd.Series([self.bars_stored, self.batches] + [np.nan] * 5, index=LATENCY_COLUMNS)
+        after_receive = stored - received
+        after_close = stored - closed
+        return pd.Series([self.bars_stored, self.batches, np.percentile(after_receive, 50), np.percentile(after_receive, 99),
+                          np.percentile(after_close, 50), np.percentile(after_close, 99), after_close.max()], index=LATENCY_COLUMNS)
+
+
+def stream_bars_frame(messages):
+    """
+    Turn bar messages of the stream into one DataFrame across symbols.
+
+    Parameters:
+    messages (list): Bar messages, dicts with 'S', 't' and the BAR_FIELDS keys.
+
+    Returns:
+    pd.DataFrame: Indexed by the UTC bar timestamp, with the columns of AlpacaBarsClient.get_bars.
+    """
+    data = pd.DataFrame.from_records(messages, columns=['S', 't', *BAR_FIELDS]).rename(columns=BAR_FIELDS)
+    data.index = pd.DatetimeIndex(pd.to_datetime(data.pop('t'), utc=True), name='timestamp')
+    data['ticker'] = data.pop('S')
+    return data
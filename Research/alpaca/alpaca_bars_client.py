@@ -0,0 +1,122 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+from ingestion.rate_limit import call_with_retry, rate_limiter
+
+# Alpaca Market Data API; point APCA_API_DATA_URL at a local stub server to replay recorded responses offline
+ALPACA_DATA_URL = os.environ.get("APCA_API_DATA_URL", "https://data.alpaca.markets")
+# The bars endpoint accepts many symbols per request; each page holds at most ALPACA_PAGE_LIMIT bars across them
+ALPACA_SYMBOLS_PER_REQUEST = int(os.environ.get("ALPACA_SYMBOLS_PER_REQUEST", "50"))
+ALPACA_PAGE_LIMIT = int(os.environ.get("ALPACA_PAGE_LIMIT", "10000"))
+# 'iex' or 'sip'; the account's default feed when unset
+ALPACA_DATA_FEED = os.environ.get("APCA_DATA_FEED") or None
+ALPACA_REQUEST_TIMEOUT_SECONDS = float(os.environ.get("ALPACA_REQUEST_TIMEOUT_SECONDS", "30"))
+# Short field names of a bar in the API response and the columns of the frames returned, as alpaca_trade_api's .df names them
+BAR_FIELDS = {'o': 'open', 'h': 'high', 'l': 'low', 'c': 'close', 'v': 'volume', 'n': 'trade_count', 'vw': 'vwap'}
+
+
+class AlpacaBarsClient:
+    """
+    Historical bars from the Alpaca Market Data API for many symbols per request, over one HTTP session.
+
+    The session keeps its connections open between requests, so a pass over the universe pays the TLS
+    handshake once per connection instead of once per ticker. It can be shared by the ingestion threads.
+    """
+
+    def __init__(self, key_id, secret_key, data_url=ALPACA_DATA_URL, feed=ALPACA_DATA_FEED, max_connections=10):
+        self.data_url = data_url.rstrip('/')
+        self.feed = feed
+        self.session = requests.Session()
+        self.session.headers.update({'APCA-API-KEY-ID': key_id, 'APCA-API-SECRET-KEY': secret_key})
+        # One pooled connection per concurrent request
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.requests_sent = 0
+        self._requests_sent_lock = threading.Lock()
+
+    def iter_bar_pages(self, symbols, timeframe, start, end):
+        """
+        Request the bars of some symbols page by page, following the page tokens.
+
+        Parameters:
+        symbols (list): The symbols of one request.
+        timeframe (str): The bar size, e.g. '1Min' or '1Day'.
+        start (str): The first date or RFC 3339 datetime to include.
+        end (str): The last date or RFC 3339 datetime to include.
+
+        Yields:
+        dict: The 'bars' of each page, mapping symbol to its list of bars; a symbol may continue on the next page.
+        """
+        params = {'symbols': ','.join(symbols), 'timeframe': timeframe, 'start': start, 'end': end, 'limit': ALPACA_PAGE_LIMIT}
+        if self.feed:
+            params['feed'] = self.feed
+        while True:
+            # Every page is a request of its own against the source's quota, retried when throttled or failing
+            page = call_with_retry(rate_limiter('alpaca', 'bars'), lambda: self._get_page(params))
+            yield page.get('bars') or {}
+            if not page.get('next_page_token'):
+                return
+            params['page_token'] = page['next_page_token']
+
+    def _get_page(self, params):
+        """Send one bars request and return its JSON body, raising requests.HTTPError on an error status."""
+        response = self.session.get(f"{self.data_url}/v2/stocks/bars", params=params, timeout=ALPACA_REQUEST_TIMEOUT_SECONDS)
+        with self._requests_sent_lock:
+            self.requests_sent += 1
+        response.raise_for_status()
+        return response.json()
+
+    def get_bars(self, symbols, timeframe, start, end):
+        """
+        Fetch the bars of some symbols in one paginated request and split them per ticker.
+
+        Parameters:
+        symbols (list): The symbols to fetch together, at most ALPACA_SYMBOLS_PER_REQUEST for short URLs.
+        timeframe (str): The bar size, e.g. '1Min' or '1Day'.
+        start (str): The first date or RFC 3339 datetime to include.
+        end (str): The last date or RFC 3339 datetime to include.
+
+        Returns:
+        dict: Mapping of symbol to a DataFrame indexed by the UTC bar timestamp with columns
+              ['open', 'high', 'low', 'close', 'volume', 'trade_count', 'vwap', 'ticker'].
+              Symbols without bars are left out.
+        """
+        # Collect the bars of every page as flat lists first, and build a single frame from them
+        tickers = []
+        bars = []
+        for page in self.iter_bar_pages(symbols, timeframe, start, end):
+            for symbol, symbol_bars in page.items():
+                tickers.extend([symbol] * len(symbol_bars))
+                bars.extend(symbol_bars)
+        return split_bars(tickers, bars)
+
+
+def split_bars(tickers, bars):
+    """
+    Turn the bars of a multi-symbol response into one DataFrame per ticker.
+
+    Parameters:
+    tickers (list): The symbol of every bar.
+    bars (list): The bars as returned by the API, dicts with 't' and the BAR_FIELDS keys.
+
+    Returns:
+    dict: Mapping of symbol to its bars, see AlpacaBarsClient.get_bars.
+    """
+    if not bars:
+        return {}
+    data = pd.DataFrame.from_records(bars, columns=['t', *BAR_FIELDS]).rename(columns=BAR_FIELDS)
+    data.index = pd.DatetimeIndex(pd.to_datetime(data.pop('t'), utc=True), name='timestamp')
+    data['ticker'] = tickers
+    # Pages are ordered by symbol, so each symbol's bars are contiguous even across pages; sort only if not
+    ticker_values = data['ticker'].to_numpy()
+    if (ticker_values[1:] < ticker_values[:-1]).any():
+        data = data.iloc[np.argsort(ticker_values, kind='stable')]
+        ticker_values = data['ticker'].to_numpy()
+    boundaries = np.flatnonzero(ticker_values[1:] != ticker_values[:-1]) + 1
+    starts = np.concatenate([[0], boundaries])
+    ends = np.concatenate([boundaries, [len(data)]])
+    return {ticker_values[first]: data.iloc[first:last] for first, last in zip(starts, ends)}
@@ -1,110 +1,128 @@
-import alpaca_trade_api as tradeapi
-from alpaca_trade_api.rest import TimeFrame 
-
+import argparse
+import os
 import pandas as pd
 from datetime import datetime, timedelta
 
 import psycopg2
-from psycopg2 import sql, extras
+from psycopg2 import sql
+from db.connection import transaction
+from db.schema import DAILY_BARS_HYPERTABLE, PRICE_COLUMNS, ensure_float_columns, ensure_hypertable
+from ingestion.incremental import DAILY_BARS_OVERLAP, fetch_start_times
+from ingestion.runner import INGESTION_WORKERS, SOURCE_CONCURRENCY, run_ingestion_pass
+from ingestion.spool import get_spool
+from alpaca_bars_client import ALPACA_SYMBOLS_PER_REQUEST, AlpacaBarsClient
 
 
 # Alpaca API credentials
-APCA_API_BASE_URL = "https://paper-api.alpaca.markets/v2"
 APCA_API_KEY_ID = "removed"
 APCA_API_SECRET_KEY = "removed"
 
-# Database connection parameters
-DB_HOST = "postgres"
-DB_PORT = "5432"
-DB_NAME = "research"
-DB_USER = "myuser"
-DB_PASSWORD = "mypassword"
+# Tickers to ingest, read from next to this script wherever it runs from
+TICKERS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tickers.csv')
+
+# Database tables; the connection parameters come from the POSTGRES_* environment variables
 TABLE_NAME = "alpaca_daily"
+# Bars tables whose schema setup has run in this process; a failed setup is tried again by the next pass
+_prepared_tables = set()
 
-def fetch_daily_data_from_alpaca(ticker_symbol):
-    """Fetch daily data for a given ticker symbol from Alpaca Market Data API."""
-    api = tradeapi.REST(APCA_API_KEY_ID, APCA_API_SECRET_KEY, APCA_API_BASE_URL, api_version='v2')
-    
-    # Define the time range for the data
-    end_date = datetime.now()- timedelta(days=1)
-    start_date = end_date - timedelta(days=365)
-    
-    # Convert dates to the required format (YYYY-MM-DD)
-    start_date_str = start_date.strftime('%Y-%m-%d')
-    end_date_str = end_date.strftime('%Y-%m-%d')
+def fetch_daily_data_from_alpaca(ticker_symbols, client, start_times):
+    """Fetch daily data for some ticker symbols from Alpaca Market Data API in one multi-symbol request, from each ticker's start time."""
+    # The group starts at its earliest ticker and ends yesterday
+    start = min(start_times[ticker_symbol] for ticker_symbol in ticker_symbols)
+    end_date = datetime.now() - timedelta(days=1)
     
-    # Fetch daily data
-    barset = api.get_bars(ticker_symbol, TimeFrame.Day, start=start_date_str, end=end_date_str).df
+    # Fetch the daily bars of every symbol, following the page tokens, and split them per ticker
+    bars = client.get_bars(ticker_symbols, '1Day', start.strftime('%Y-%m-%dT%H:%M:%SZ'), end_date.strftime('%Y-%m-%d'))
     
-    # Add ticker column
-    barset['ticker'] = ticker_symbol
-    
-    return barset
+    # Drop the bars before a ticker's own start time, which it got from sharing the request with an earlier ticker
+    return {ticker_symbol: data[data.index >= start_times[ticker_symbol]] for ticker_symbol, data in bars.items()}
 
-def store_data_in_db(data, table_name):
-    """Store the fetched data into a PostgreSQL database."""
+def ensure_bars_table(table_name):
+    """Create the bars table if needed and bring its schema up to date, once per process; later calls return at once."""
+    if table_name in _prepared_tables:
+        return
     try:
-        # Connect to the PostgreSQL database
-        connection = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        
-        # Create a cursor object
-        cursor = connection.cursor()
-        
-        # Create table if it doesn't exist
-        create_table_query = sql.SQL("""
-            CREATE TABLE IF NOT EXISTS {table} (
-                datetime TIMESTAMP,
-                ticker VARCHAR(10),
-                open NUMERIC,
-                high NUMERIC,
-                low NUMERIC,
-                close NUMERIC,
-                volume BIGINT,
-                PRIMARY KEY (datetime, ticker)
-            );
-        """).format(table=sql.Identifier(table_name))
-        
-        cursor.execute(create_table_query)
-        connection.commit()
-        
-        # Use execute_batch for faster inserts
-        insert_query = sql.SQL("""
-            INSERT INTO {table} (datetime, ticker, open, high, low, close, volume)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (datetime, ticker) DO NOTHING;
-        """).format(table=sql.Identifier(table_name))
-        
-        psycopg2.extras.execute_batch(cursor, insert_query, 
-            [(index, row['ticker'], row['open'], row['high'], row['low'], row['close'], row['volume']) for index, row in data.iterrows()])
-        
-        connection.commit()
+        with transaction() as cursor:
+            # Create table if it doesn't exist
+            create_table_query = sql.SQL("""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    datetime TIMESTAMP,
+                    ticker VARCHAR(10),
+                    open DOUBLE PRECISION,
+                    high DOUBLE PRECISION,
+                    low DOUBLE PRECISION,
+                    close DOUBLE PRECISION,
+                    volume BIGINT,
+                    PRIMARY KEY (ticker, datetime)
+                );
+            """).format(table=sql.Identifier(table_name))
+            
+            cursor.execute(create_table_query)
+            # Tables created before the prices were float8 store them as NUMERIC
+            ensure_float_columns(cursor, table_name, PRICE_COLUMNS)
+            # Chunk the bars on datetime and compress old chunks per ticker
+            ensure_hypertable(cursor, table_name, **DAILY_BARS_HYPERTABLE)
+        _prepared_tables.add(table_name)
 
     except psycopg2.Error as e:
-        print(f"Error storing data in PostgreSQL database: {e}")
-    finally:
-        # Close the cursor and connection
-        if 'cursor' in locals():
-            cursor.close()
-        if 'connection' in locals():
-            connection.close()
+        print(f"Error preparing {table_name} in PostgreSQL database: {e}")
+
+def store_data_in_db(data, table_name):
+    """Spool the fetched data for the PostgreSQL database; bars fetched again in the overlap replace the stored ones once loaded."""
+    # The table stores UTC datetimes without a time zone
+    bars = pd.DataFrame({
+        'datetime': data.index.tz_convert('UTC').tz_localize(None),
+        'ticker': data['ticker'].to_numpy(),
+        'open': data['open'].to_numpy(),
+        'high': data['high'].to_numpy(),
+        'low': data['low'].to_numpy(),
+        'close': data['close'].to_numpy(),
+        'volume': data['volume'].to_numpy(dtype='int64'),
+    })
+    
+    # Acknowledge the bars once they are on local disk; the spool's flusher bulk loads them with COPY as soon as the database takes them
+    get_spool().append(table_name, bars)
 
 def get_tickers_from_csv(file_path):
     """Read tickers from a CSV file."""
     tickers = pd.read_csv(file_path, header=None).squeeze().tolist()
     return [ticker.strip().strip('"') for ticker in tickers]
 
+def run_pass(workers=INGESTION_WORKERS, symbols_per_request=ALPACA_SYMBOLS_PER_REQUEST, client=None):
+    """
+    Fetch the daily bars of every ticker in tickers.csv and store them in the database.
+
+    Parameters:
+    workers (int): Requests sent concurrently.
+    symbols_per_request (int): Tickers fetched together in one multi-symbol bars request.
+    client (AlpacaBarsClient): A client to keep across passes; one for this pass when omitted.
+
+    Returns:
+    pd.DataFrame: The report of the pass, see run_ingestion_pass.
+    """
+    tickers = get_tickers_from_csv(TICKERS_PATH)
+    ensure_bars_table(TABLE_NAME)
+    # Request only the bars after each ticker's latest stored bar, less a small overlap; tickers without
+    # bars get the last 365 days up to yesterday
+    initial_start = (pd.Timestamp.now(tz='UTC') - timedelta(days=366)).normalize()
+    start_times = fetch_start_times(TABLE_NAME, tickers, initial_start, DAILY_BARS_OVERLAP)
+    # Group tickers with similar start times into the same requests
+    tickers = sorted(tickers, key=start_times.get)
+    if client is None:
+        # One HTTP session for the pass, with a pooled connection per concurrent request
+        client = AlpacaBarsClient(APCA_API_KEY_ID, APCA_API_SECRET_KEY, max_connections=SOURCE_CONCURRENCY['alpaca'])
+    # Fetch groups of tickers concurrently while a writer thread stores the ones already downloaded
+    return run_ingestion_pass(tickers, lambda ticker_symbols: fetch_daily_data_from_alpaca(ticker_symbols, client, start_times),
+                              lambda ticker_symbol, daily_data: store_data_in_db(daily_data, TABLE_NAME),
+                              'alpaca', workers=workers, batch_size=symbols_per_request)
+
 # Example usage
 if __name__ == "__main__":
-    tickers = get_tickers_from_csv('tickers.csv')
-    for ticker_symbol in tickers:
-        daily_data = fetch_daily_data_from_alpaca(ticker_symbol)
-        if not daily_data.empty:
-            store_data_in_db(daily_data, TABLE_NAME)
-        else:
-            print(f"No data to display for {ticker_symbol}.")
+    parser = argparse.ArgumentParser(description="Fetch the daily bars of every ticker in tickers.csv and store them in the database.")
+    parser.add_argument('--workers', type=int, default=INGESTION_WORKERS,
+                        help="Requests sent concurrently; requests to alpaca are also capped by INGESTION_ALPACA_CONCURRENCY")
+    parser.add_argument('--symbols-per-request', type=int, default=ALPACA_SYMBOLS_PER_REQUEST,
+                        help="Tickers fetched together in one multi-symbol bars request")
+    args = parser.parse_args()
+    
+    run_pass(args.workers, args.symbols_per_request)
@@ -0,0 +1,49 @@
+import argparse
+import asyncio
+import pandas as pd
+
+from ingestion.runner import SOURCE_CONCURRENCY
+from alpaca_bar_stream import STREAM_BATCH_SECONDS, AlpacaBarStream
+from alpaca_bars_client import AlpacaBarsClient
+from alpaca_minute_data_initialize import (APCA_API_KEY_ID, APCA_API_SECRET_KEY, TABLE_NAME, TICKERS_PATH, ensure_bars_table,
+                                           get_tickers_from_csv, run_pass, store_data_in_db)
+
+def catch_up(client):
+    """Fetch the minute bars of every ticker from its latest stored bar up to now over REST, filling in what the stream missed."""
+    run_pass(client=client, end=pd.Timestamp.now(tz='UTC').strftime('%Y-%m-%dT%H:%M:%SZ'))
+
+def build_stream(client=None, batch_seconds=STREAM_BATCH_SECONDS):
+    """
+    Build a stream of the minute bars of every ticker in tickers.csv into the minute table.
+
+    Parameters:
+    client (AlpacaBarsClient): The REST client of the catch-up passes; one for the stream when omitted.
+    batch_seconds (float): The longest a received bar waits to be stored with the bars after it.
+
+    Returns:
+    AlpacaBarStream: The stream, to run in an event loop.
+    """
+    tickers = get_tickers_from_csv(TICKERS_PATH)
+    ensure_bars_table(TABLE_NAME)
+    if client is None:
+        client = AlpacaBarsClient(APCA_API_KEY_ID, APCA_API_SECRET_KEY, max_connections=SOURCE_CONCURRENCY['alpaca'])
+    # Every (re)connection runs a REST pass up to now, for the bars sent while the stream was down. The bars are
+    # spooled, and count as stored once the spool has loaded them into the table
+    return AlpacaBarStream(APCA_API_KEY_ID, APCA_API_SECRET_KEY, tickers,
+                           lambda data, stored: store_data_in_db(data, TABLE_NAME, on_loaded=stored),
+                           catch_up=lambda: catch_up(client), batch_seconds=batch_seconds, deferred=True)
+
+# Example usage
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream the minute bars of every ticker in tickers.csv into the database as they close.")
+    parser.add_argument('--batch-seconds', type=float, default=STREAM_BATCH_SECONDS,
+                        help="The longest a received bar waits to be stored with the bars after it")
+    parser.add_argument('--duration', type=float, help="Stop after this many seconds; runs until interrupted when omitted")
+    args = parser.parse_args()
+
+    stream = build_stream(batch_seconds=args.batch_seconds)
+    try:
+        asyncio.run(stream.run(args.duration))
+    except KeyboardInterrupt:
+        pass
+    print(stream.latency().to_string())
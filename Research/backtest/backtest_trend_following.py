@@ -1,49 +1,30 @@
+import argparse
 import psycopg2
-import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+from db.fetch import DEFAULT_CHUNK_SIZE, bars_query, iter_ticker_frames
+from db.copy_reader import iter_copy_dataframes
+from local_store.bar_store import iter_bar_store_frames
+from local_store.parquet_cache import iter_cache_ticker_frames, sync_cache
 
-# Database connection parameters
-DB_HOST = "postgres"
-DB_PORT = "5432"
-DB_NAME = "research"
-DB_USER = "myuser"
-DB_PASSWORD = "mypassword"
+# Database tables; the connection parameters come from the POSTGRES_* environment variables
 TICKER_MINUTE_INDICATORS_TABLE_NAME = "ticker_minute_indicators"
 
-def fetch_minute_indicator_data():
-    """Fetch ticker minute indicator data from the PostgreSQL database."""
-    try:
-        # Connect to the PostgreSQL database
-        connection = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        
-        # Create a cursor object
-        cursor = connection.cursor()
-        
-        # Query to fetch all data from the ticker minute indicators table
-        minute_query = f"SELECT * FROM {TICKER_MINUTE_INDICATORS_TABLE_NAME};"
-        cursor.execute(minute_query)
-        minute_results = cursor.fetchall()
-        minute_colnames = [desc[0] for desc in cursor.description]
-        minute_df = pd.DataFrame(minute_results, columns=minute_colnames)
-        
-        return minute_df
-
-    except psycopg2.Error as e:
-        print(f"Error fetching ticker minute indicator data from PostgreSQL database: {e}")
-        return None
-    finally:
-        # Close the cursor and connection
-        if 'cursor' in locals():
-            cursor.close()
-        if 'connection' in locals():
-            connection.close()
+def stream_minute_indicator_data(tickers=None, start=None, end=None, chunk_size=DEFAULT_CHUNK_SIZE, use_cache=False, use_bar_store=False):
+    """Stream the ticker minute indicator data, optionally for some tickers and a time range, one ticker at a time.
+
+    With use_cache=True the new rows are synced into the local Parquet cache first and the data is read from disk.
+    With use_bar_store=True the data is read from the memory-mapped files exported by local_store/bar_store.py.
+    """
+    # Read only the columns the backtest uses, ordered by ticker so each ticker's bars arrive together and in time order
+    columns = ['datetime', 'ticker', 'close', 'trend']
+    if use_bar_store:
+        return iter_bar_store_frames(TICKER_MINUTE_INDICATORS_TABLE_NAME, tickers, start, end, columns)
+    if use_cache:
+        sync_cache(TICKER_MINUTE_INDICATORS_TABLE_NAME, tickers, chunk_size=chunk_size)
+        return iter_cache_ticker_frames(TICKER_MINUTE_INDICATORS_TABLE_NAME, tickers, start, end, columns)
+    minute_query, params = bars_query(TICKER_MINUTE_INDICATORS_TABLE_NAME, columns, tickers, start, end)
+    return iter_ticker_frames(minute_query, params, chunk_size=chunk_size, reader=iter_copy_dataframes)
 
 def backtrade_with_trend(minute_df):
     """Perform backtrading using the trend column in the DataFrame and compute backtesting metrics."""
@@ -180,9 +161,18 @@ def backtrade_with_trend(minute_df):
     plt.show()
 
 # Example usage
-ticker_minute_data = fetch_minute_indicator_data()
-
-if ticker_minute_data is not None:
-    print("Ticker Minute Indicator Data:")
-    print(ticker_minute_data)
-    backtrade_with_trend(ticker_minute_data)
+parser = argparse.ArgumentParser(description="Backtest the minute indicators of every ticker.")
+parser.add_argument('--use-cache', action='store_true',
+                    help="Sync the indicators into the local Parquet cache and read them from disk, see PARQUET_CACHE_DIR")
+parser.add_argument('--bar-store', action='store_true',
+                    help="Read the indicators from the memory-mapped bar store, see BAR_STORE_DIR")
+args = parser.parse_args()
+
+try:
+    # Backtest one ticker at a time so memory stays bounded by the largest ticker
+    for ticker, ticker_minute_data in stream_minute_indicator_data(use_cache=args.use_cache, use_bar_store=args.bar_store):
+        print(f"Ticker Minute Indicator Data for {ticker}:")
+        print(ticker_minute_data)
+        backtrade_with_trend(ticker_minute_data)
+except psycopg2.Error as e:
+    print(f"Error fetching ticker minute indicator data from PostgreSQL database: {e}")
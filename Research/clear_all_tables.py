@@ -1,56 +1,34 @@
 import psycopg2
+from db.connection import transaction
 
-
-# Database connection parameters
-DB_HOST = "localhost"
-DB_PORT = "5432"
-DB_NAME = "research"
-DB_USER = "myuser"
-DB_PASSWORD = "mypassword"
+# The connection parameters come from the POSTGRES_* environment variables; set POSTGRES_HOST=localhost
+# when running this outside the compose network
 
 def clear_all_tables():
     """Delete all tables in the PostgreSQL database."""
     try:
-        # Connect to the PostgreSQL database
-        connection = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        
-        # Create a cursor object
-        cursor = connection.cursor()
-        
-        # Fetch all table names
-        cursor.execute("""
-            SELECT table_name FROM information_schema.tables
-            WHERE table_schema = 'public';
-        """)
-        tables = cursor.fetchall()
-        
-        # Disable foreign key checks
-        cursor.execute("SET session_replication_role = 'replica';")
-        
-        # Drop each table
-        for table in tables:
-            cursor.execute(f"DROP TABLE IF EXISTS {table[0]} CASCADE;")
-        
-        # Re-enable foreign key checks
-        cursor.execute("SET session_replication_role = 'origin';")
+        with transaction() as cursor:
+            # Fetch all table names; views such as the continuous aggregates are dropped with their tables
+            cursor.execute("""
+                SELECT table_name FROM information_schema.tables
+                WHERE table_schema = 'public' AND table_type = 'BASE TABLE';
+            """)
+            tables = cursor.fetchall()
+            
+            # Disable foreign key checks
+            cursor.execute("SET session_replication_role = 'replica';")
+            
+            # Drop each table
+            for table in tables:
+                cursor.execute(f"DROP TABLE IF EXISTS {table[0]} CASCADE;")
+            
+            # Re-enable foreign key checks
+            cursor.execute("SET session_replication_role = 'origin';")
         
-        connection.commit()
         print("All tables deleted successfully!")
 
     except psycopg2.Error as e:
         print(f"Error deleting tables in PostgreSQL database: {e}")
-    finally:
-        # Close the cursor and connection
-        if 'cursor' in locals():
-            cursor.close()
-        if 'connection' in locals():
-            connection.close()
 
 # Example usage
 if __name__ == "__main__":
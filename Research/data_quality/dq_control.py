@@ -1,81 +1,44 @@
 import psycopg2
 import pandas as pd
 import matplotlib.pyplot as plt
+from db.fetch import DEFAULT_CHUNK_SIZE, iter_ticker_frames
+from db.copy_reader import iter_copy_dataframes
 
-# Database connection parameters
-DB_HOST = "postgres"
-DB_PORT = "5432"
-DB_NAME = "research"
-DB_USER = "myuser"
-DB_PASSWORD = "mypassword"
+# Database tables; the connection parameters come from the POSTGRES_* environment variables
 YFINANCE_DAILY_TABLE_NAME = "yfinance_daily"
 YFINANCE_MINUTE_TABLE_NAME = "yfinance_minute"
 ALPACA_DAILY_TABLE_NAME = "alpaca_daily"
 ALPACA_MINUTE_TABLE_NAME = "alpaca_minute"
 
-def fetch_data_from_db(table_name):
-    """Fetch data from the PostgreSQL database for the specified table."""
-    try:
-        # Connect to the PostgreSQL database
-        connection = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        
-        # Create a cursor object
-        cursor = connection.cursor()
-        
-        # Query to fetch all data from the specified table
-        query = f"SELECT * FROM {table_name};"
-        
-        # Execute the query
-        cursor.execute(query)
-        
-        # Fetch all results
-        results = cursor.fetchall()
-        
-        # Get column names
-        colnames = [desc[0] for desc in cursor.description]
-        
-        # Create a DataFrame
-        df = pd.DataFrame(results, columns=colnames)
-        
-        return df
+def stream_ticker_data(table_name, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Stream the specified table from the PostgreSQL database one ticker at a time, in ticker order."""
+    # Byte-wise collation so the database orders tickers the same way Python compares them
+    query = f'SELECT * FROM {table_name} ORDER BY ticker COLLATE "C", datetime;'
+    return iter_ticker_frames(query, chunk_size=chunk_size, reader=iter_copy_dataframes)
 
-    except psycopg2.Error as e:
-        print(f"Error fetching data from PostgreSQL database: {e}")
-        return None
-    finally:
-        # Close the cursor and connection
-        if 'cursor' in locals():
-            cursor.close()
-        if 'connection' in locals():
-            connection.close()
+def common_ticker_frames(yfinance_frames, alpaca_frames):
+    """Pair up the per-ticker frames of two ticker-ordered streams, yielding only tickers present in both."""
+    yfinance_ticker, yfinance_ticker_data = next(yfinance_frames, (None, None))
+    alpaca_ticker, alpaca_ticker_data = next(alpaca_frames, (None, None))
+    while yfinance_ticker is not None and alpaca_ticker is not None:
+        if yfinance_ticker == alpaca_ticker:
+            yield yfinance_ticker, yfinance_ticker_data, alpaca_ticker_data
+            yfinance_ticker, yfinance_ticker_data = next(yfinance_frames, (None, None))
+            alpaca_ticker, alpaca_ticker_data = next(alpaca_frames, (None, None))
+        elif yfinance_ticker < alpaca_ticker:
+            yfinance_ticker, yfinance_ticker_data = next(yfinance_frames, (None, None))
+        else:
+            alpaca_ticker, alpaca_ticker_data = next(alpaca_frames, (None, None))
 
-def data_quality_assessment(yfinance_df, alpaca_df):
-    """Perform data quality assessment and comparison between yfinance and alpaca data for each ticker."""
-    if yfinance_df is None or alpaca_df is None:
-        print("Data not available for quality assessment.")
-        return
+def data_quality_assessment(yfinance_frames, alpaca_frames):
+    """Perform data quality assessment and comparison between yfinance and alpaca data for each ticker.
 
-    # Get unique tickers from both datasets
-    yfinance_tickers = yfinance_df['ticker'].unique()
-    alpaca_tickers = alpaca_df['ticker'].unique()
-    
-    # Find common tickers
-    common_tickers = set(yfinance_tickers).intersection(set(alpaca_tickers))
-    
+    Both inputs are (ticker, DataFrame) streams in ticker order, so only one ticker per source is in memory.
+    """
     # Initialize a list to collect results
     results_list = []
     
-    for ticker in common_tickers:
-        # Filter data for the current ticker
-        yfinance_ticker_data = yfinance_df[yfinance_df['ticker'] == ticker]
-        alpaca_ticker_data = alpaca_df[alpaca_df['ticker'] == ticker]
-        
+    for ticker, yfinance_ticker_data, alpaca_ticker_data in common_ticker_frames(yfinance_frames, alpaca_frames):
         # Collect missing values
         missing_values_yfinance = yfinance_ticker_data.isnull().sum()
         missing_values_alpaca = alpaca_ticker_data.isnull().sum()
@@ -95,10 +58,13 @@ def data_quality_assessment(yfinance_df, alpaca_df):
         # Collect data consistency
         consistency_results = {}
         common_columns = set(yfinance_ticker_data.columns).intersection(set(alpaca_ticker_data.columns))
+        # Compare the sources bar by bar, matched on datetime
+        yfinance_by_datetime = yfinance_ticker_data.set_index('datetime')
+        alpaca_by_datetime = alpaca_ticker_data.set_index('datetime')
         for column in common_columns:
             if pd.api.types.is_numeric_dtype(yfinance_ticker_data[column]) and pd.api.types.is_numeric_dtype(alpaca_ticker_data[column]):
-                mean_diff = (yfinance_ticker_data[column] - alpaca_ticker_data[column]).mean()
-                correlation = yfinance_ticker_data[column].corr(alpaca_ticker_data[column])
+                mean_diff = (yfinance_by_datetime[column] - alpaca_by_datetime[column]).mean()
+                correlation = yfinance_by_datetime[column].corr(alpaca_by_datetime[column])
                 consistency_results[column] = {'mean_diff': mean_diff, 'correlation': correlation}
 
         # Append results to the list
@@ -119,9 +85,13 @@ def data_quality_assessment(yfinance_df, alpaca_df):
     results_df = pd.DataFrame(results_list)
     print(results_df)
 
+    if results_df.empty:
+        print("Data not available for quality assessment.")
+        return
+
     # Plotting missing values for all tickers in a single plot
     plt.figure(figsize=(15, 7))
-    for ticker in common_tickers:
+    for ticker in results_df['ticker']:
         yfinance_missing = results_df.loc[results_df['ticker'] == ticker, 'missing_values_yfinance'].values[0]
         alpaca_missing = results_df.loc[results_df['ticker'] == ticker, 'missing_values_alpaca'].values[0]
         
@@ -134,15 +104,12 @@ def data_quality_assessment(yfinance_df, alpaca_df):
     plt.legend()
     plt.show()
 
-# Fetch data from the database
-yfinance_daily_data = fetch_data_from_db(YFINANCE_DAILY_TABLE_NAME)
-yfinance_minute_data = fetch_data_from_db(YFINANCE_MINUTE_TABLE_NAME)
-alpaca_daily_data = fetch_data_from_db(ALPACA_DAILY_TABLE_NAME)
-alpaca_minute_data = fetch_data_from_db(ALPACA_MINUTE_TABLE_NAME)
-
-# Perform data quality assessment
-print("Daily Data Quality Assessment:")
-data_quality_assessment(yfinance_daily_data, alpaca_daily_data)
+# Stream the tables from the database and perform data quality assessment, one ticker at a time
+try:
+    print("Daily Data Quality Assessment:")
+    data_quality_assessment(stream_ticker_data(YFINANCE_DAILY_TABLE_NAME), stream_ticker_data(ALPACA_DAILY_TABLE_NAME))
 
-print("\nMinute Data Quality Assessment:")
-data_quality_assessment(yfinance_minute_data, alpaca_minute_data)
+    print("\nMinute Data Quality Assessment:")
+    data_quality_assessment(stream_ticker_data(YFINANCE_MINUTE_TABLE_NAME), stream_ticker_data(ALPACA_MINUTE_TABLE_NAME))
+except psycopg2.Error as e:
+    print(f"Error fetching data from PostgreSQL database: {e}")
@@ -0,0 +1 @@
+"""Database access helpers shared by the research services."""
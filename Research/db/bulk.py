@@ -0,0 +1,67 @@
+import io
+
+
+def frame_to_csv_buffer(df, columns):
+    """
+    Serialize the given DataFrame columns into an in-memory CSV buffer that COPY ... WITH (FORMAT csv) accepts.
+
+    Parameters:
+    df (pd.DataFrame): The rows to serialize.
+    columns (list): The columns to write, in order.
+
+    Returns:
+    io.StringIO: The CSV rows without a header, rewound to the start. Missing values become NULL.
+    """
+    buffer = io.StringIO()
+    df.to_csv(buffer, columns=columns, header=False, index=False, na_rep='')
+    buffer.seek(0)
+    return buffer
+
+
+def copy_upsert(cursor, df, table_name, columns, key_columns=('ticker', 'datetime')):
+    """
+    Bulk upsert a DataFrame into a table through COPY FROM STDIN and a single set-based merge.
+
+    The rows are streamed into a temporary staging table shaped like the target, then merged with one
+    INSERT ... SELECT ... ON CONFLICT statement. Target columns that are not listed keep their current
+    values on conflicting rows. The caller owns the transaction; the staging table is dropped on commit.
+
+    Parameters:
+    cursor (psycopg2.extensions.cursor): Cursor of the connection that should perform the write.
+    df (pd.DataFrame): The rows to write, with one column per entry of `columns`.
+    table_name (str): The target table, which must have a unique constraint on `key_columns`.
+    columns (list): The table columns to write, named as in both the DataFrame and the table.
+    key_columns (tuple): The conflict target of the upsert.
+
+    Returns:
+    int: The number of rows inserted or updated.
+    """
+    columns = list(columns)
+    key_columns = list(key_columns)
+
+    # ON CONFLICT cannot touch the same row twice in one statement, so keep the last row per key
+    df = df.drop_duplicates(subset=key_columns, keep='last')
+    if df.empty:
+        return 0
+
+    # Stage the rows in a temporary copy of the target's columns. The name is qualified with pg_temp, so the
+    # staging table left by an earlier upsert to the same table in this transaction is dropped, and never a
+    # permanent table of the same name
+    staging_table = f"pg_temp.{table_name.rsplit('.', 1)[-1]}_staging"
+    cursor.execute(f"DROP TABLE IF EXISTS {staging_table};")
+    cursor.execute(f"CREATE TEMP TABLE {staging_table} (LIKE {table_name} INCLUDING DEFAULTS) ON COMMIT DROP;")
+    column_list = ", ".join(columns)
+    cursor.copy_expert(f"COPY {staging_table} ({column_list}) FROM STDIN WITH (FORMAT csv)", frame_to_csv_buffer(df, columns))
+
+    # Merge the staged rows into the target in one statement
+    update_columns = [column for column in columns if column not in key_columns]
+    if update_columns:
+        conflict_action = "DO UPDATE SET " + ", ".join(f"{column} = EXCLUDED.{column}" for column in update_columns)
+    else:
+        conflict_action = "DO NOTHING"
+    cursor.execute(f"""
+    INSERT INTO {table_name} ({column_list})
+    SELECT {column_list} FROM {staging_table}
+    ON CONFLICT ({", ".join(key_columns)}) {conflict_action};
+    """)
+    return cursor.rowcount
@@ -0,0 +1,96 @@
+import atexit
+import os
+import threading
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import pool
+from db.types import register_float_typecasters
+
+# Database connection parameters, overridable through the environment of each service
+DB_HOST = os.environ.get("POSTGRES_HOST", "postgres")
+DB_PORT = os.environ.get("POSTGRES_PORT", "5432")
+DB_NAME = os.environ.get("POSTGRES_DB", "research")
+DB_USER = os.environ.get("POSTGRES_USER", "myuser")
+DB_PASSWORD = os.environ.get("POSTGRES_PASSWORD", "mypassword")
+POOL_MIN_CONNECTIONS = int(os.environ.get("POSTGRES_POOL_MIN_CONNECTIONS", "1"))
+POOL_MAX_CONNECTIONS = int(os.environ.get("POSTGRES_POOL_MAX_CONNECTIONS", "8"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide connection pool, opening it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Every connection of the process decodes NUMERIC as float
+            register_float_typecasters()
+            _pool = pool.ThreadedConnectionPool(
+                POOL_MIN_CONNECTIONS,
+                POOL_MAX_CONNECTIONS,
+                host=DB_HOST,
+                port=DB_PORT,
+                database=DB_NAME,
+                user=DB_USER,
+                password=DB_PASSWORD
+            )
+        return _pool
+
+
+def close_pool():
+    """Close every pooled connection; the next call to get_pool opens a new pool."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+atexit.register(close_pool)
+
+
+@contextmanager
+def connection():
+    """
+    Borrow a connection from the pool for the duration of a with block.
+
+    The connection goes back to the pool afterwards. Work left uncommitted is rolled back so the
+    next borrower starts from a clean session. Connections the server has closed, or that fail to roll
+    back, are closed by the pool instead of reused; either way the connection is handed back.
+
+    Yields:
+    psycopg2.extensions.connection: A pooled connection.
+    """
+    connection_pool = get_pool()
+    conn = connection_pool.getconn()
+    try:
+        yield conn
+    finally:
+        discard = bool(conn.closed)
+        if not discard:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                # E.g. the server dropped the session; the connection cannot be reused
+                discard = True
+        connection_pool.putconn(conn, close=discard)
+
+
+@contextmanager
+def transaction():
+    """
+    Run the body of a with block as one transaction on a pooled connection.
+
+    The transaction is committed when the block exits normally and rolled back when it raises.
+
+    Yields:
+    psycopg2.extensions.cursor: A cursor on the pooled connection.
+    """
+    with connection() as conn:
+        cursor = conn.cursor()
+        try:
+            yield cursor
+            conn.commit()
+        finally:
+            cursor.close()
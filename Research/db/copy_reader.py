@@ -0,0 +1,138 @@
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from db.connection import connection
+from db.fetch import DEFAULT_CHUNK_SIZE
+
+# COPY output kept in memory up to this size before it is spooled to a temporary file
+COPY_SPOOL_MAX_BYTES = int(os.environ.get("POSTGRES_COPY_SPOOL_MAX_BYTES", str(64 * 2**20)))
+
+# Postgres type OIDs of the result columns, used to decode the CSV text into typed columns
+FLOAT_OIDS = {700, 701, 1700}  # real, double precision, numeric
+INTEGER_OIDS = {20, 21, 23}  # bigint, smallint, integer
+BOOLEAN_OIDS = {16}
+DATETIME_OIDS = {1082, 1114, 1184}  # date, timestamp, timestamptz
+
+
+def copy_dataframe(query, params=None, dtypes=None, parse_dates=('datetime',), categories=('ticker',)):
+    """
+    Run a query through COPY ... TO STDOUT and decode the result straight into typed columns.
+
+    A drop-in replacement for fetch_dataframe on large reads: the rows travel as one CSV stream and are
+    parsed by pandas' C reader into NumPy arrays, without building a Python tuple per row or a Decimal
+    per NUMERIC value. NUMERIC and floating point columns become float64, integer columns int64 (the
+    nullable Int64 when they contain NULLs), date and timestamp columns datetime64.
+
+    Parameters:
+    query (str): The SELECT query, with %s placeholders for `params`.
+    params (tuple): Values bound to the placeholders.
+    dtypes (dict): Optional mapping of column name to dtype to cast the result columns to.
+    parse_dates (tuple): Columns converted to datetime64 when present in the result, in addition to the
+                         date and timestamp columns.
+    categories (tuple): Text columns decoded as pd.Categorical, e.g. the ticker of a bar table.
+
+    Returns:
+    pd.DataFrame: The result rows, with one column per selected column.
+    """
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            description = _describe_query(cursor, query, params)
+            with tempfile.SpooledTemporaryFile(max_size=COPY_SPOOL_MAX_BYTES, mode='w+b') as buffer:
+                _copy_query(cursor, query, params, buffer)
+                return _read_copy_csv(buffer, description, dtypes, parse_dates, categories)
+
+
+def iter_copy_dataframes(query, params=None, chunk_size=DEFAULT_CHUNK_SIZE, dtypes=None, parse_dates=('datetime',), categories=()):
+    """
+    Stream the result of a query as DataFrame chunks decoded from one COPY ... TO STDOUT.
+
+    A drop-in replacement for iter_dataframes. The COPY output is spooled to a temporary file, which
+    stays in memory up to POSTGRES_COPY_SPOOL_MAX_BYTES, and parsed `chunk_size` rows at a time, so
+    memory is bounded by the chunk while the rows still travel and decode in bulk. The pooled connection
+    is returned before the first chunk is yielded.
+
+    Parameters:
+    query (str): The SELECT query, with %s placeholders for `params`.
+    params (tuple): Values bound to the placeholders.
+    chunk_size (int): The number of rows per chunk.
+    dtypes (dict): Optional mapping of column name to dtype to cast the result columns to.
+    parse_dates (tuple): Columns converted to datetime64 when present in the result, in addition to the
+                         date and timestamp columns.
+    categories (tuple): Text columns decoded as pd.Categorical. Each chunk has its own categories, so
+                        leave this empty when chunks are concatenated again.
+
+    Yields:
+    pd.DataFrame: Consecutive chunks of at most `chunk_size` rows, in query order.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=COPY_SPOOL_MAX_BYTES, mode='w+b') as buffer:
+        with connection() as conn:
+            with conn.cursor() as cursor:
+                description = _describe_query(cursor, query, params)
+                _copy_query(cursor, query, params, buffer)
+        yield from _read_copy_csv(buffer, description, dtypes, parse_dates, categories, chunk_size)
+
+
+def _describe_query(cursor, query, params):
+    """Return (name, type OID) for each result column of a query without fetching any rows."""
+    cursor.execute(f"SELECT * FROM ({_strip_query(query)}) AS copy_source LIMIT 0;", params)
+    return [(column.name, column.type_code) for column in cursor.description]
+
+
+def _copy_query(cursor, query, params, buffer):
+    """Write the CSV result of a query, with a header row, into a binary file and rewind it."""
+    sql = cursor.mogrify(_strip_query(query), params).decode()
+    cursor.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER true)", buffer)
+    buffer.seek(0)
+
+
+def _strip_query(query):
+    """Drop the trailing semicolon of a query so it can be embedded in another statement."""
+    return query.strip().rstrip(';')
+
+
+def _read_copy_csv(buffer, description, dtypes, parse_dates, categories, chunk_size=None):
+    """Parse COPY CSV output into a DataFrame, or an iterator of DataFrames when `chunk_size` is given."""
+    read_dtypes = {}
+    integer_columns = [name for name, type_code in description if type_code in INTEGER_OIDS]
+    date_columns = [name for name, type_code in description if type_code in DATETIME_OIDS or name in (parse_dates or ())]
+    for name, type_code in description:
+        if name in date_columns:
+            read_dtypes[name] = object
+        elif type_code in FLOAT_OIDS:
+            read_dtypes[name] = np.float64
+        elif type_code in BOOLEAN_OIDS:
+            read_dtypes[name] = 'boolean'
+        elif type_code not in INTEGER_OIDS:
+            # Integer columns are left to the parser, which picks int64 when there are no NULLs
+            read_dtypes[name] = object
+
+    # Only empty fields are NULL; strings like 'NA' or 'NULL' are real values, e.g. tickers
+    reader = pd.read_csv(
+        buffer,
+        dtype=read_dtypes,
+        keep_default_na=False,
+        na_values=[''],
+        true_values=['t'],
+        false_values=['f'],
+        chunksize=chunk_size,
+    )
+
+    def finish(df):
+        for column in date_columns:
+            df[column] = pd.to_datetime(df[column], format='ISO8601').dt.as_unit('us')
+        for column in integer_columns:
+            # The parser turns integer columns with NULLs into float64; keep them integral so they
+            # round-trip through copy_upsert into BIGINT columns
+            if df[column].dtype != np.int64:
+                df[column] = df[column].astype('Int64')
+        for column in categories or ():
+            if column in df.columns:
+                df[column] = df[column].astype('category')
+        if dtypes:
+            df = df.astype({column: dtype for column, dtype in dtypes.items() if column in df.columns})
+        return df
+
+    if chunk_size is None:
+        return finish(reader)
+    return (finish(chunk) for chunk in reader if not chunk.empty)
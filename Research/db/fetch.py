@@ -0,0 +1,174 @@
+import itertools
+import os
+import numpy as np
+import pandas as pd
+from db.connection import connection
+
+# Rows per chunk fetched from a server-side cursor
+DEFAULT_CHUNK_SIZE = int(os.environ.get("POSTGRES_FETCH_CHUNK_SIZE", "50000"))
+
+_cursor_names = itertools.count()
+
+
+def bars_query(table_name, columns=None, tickers=None, start=None, end=None):
+    """
+    Build a parameterized query for the rows of some tickers in a time range, ordered by ticker and datetime.
+
+    The predicates follow the (ticker, datetime) primary key, so the database reads just the key range of
+    each requested ticker instead of scanning the table, and only the projected columns leave the server.
+
+    Parameters:
+    table_name (str): A table or view with 'ticker' and 'datetime' columns.
+    columns (list): The columns to select; all columns when omitted. Keep 'ticker' for iter_ticker_frames.
+    tickers (list): Only these tickers, or a single ticker as a string; all tickers when omitted.
+    start (datetime): Only rows at or after this datetime.
+    end (datetime): Only rows before this datetime.
+
+    Returns:
+    tuple: (query, params) to pass to fetch_dataframe, iter_ticker_frames or the db.copy_reader readers.
+    """
+    conditions = []
+    params = []
+    if tickers is not None:
+        conditions.append("ticker = ANY(%s)")
+        params.append([tickers] if isinstance(tickers, str) else list(tickers))
+    if start is not None:
+        conditions.append("datetime >= %s")
+        params.append(start)
+    if end is not None:
+        conditions.append("datetime < %s")
+        params.append(end)
+    select_list = ", ".join(columns) if columns else "*"
+    where_clause = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+    return f"SELECT {select_list} FROM {table_name} {where_clause}ORDER BY ticker, datetime;", tuple(params) or None
+
+
+def fetch_rows(query, params=None):
+    """
+    Run a query on a pooled connection and return every row.
+
+    Parameters:
+    query (str): The SQL query, with %s placeholders for `params`.
+    params (tuple): Values bound to the placeholders.
+
+    Returns:
+    list: The result rows as tuples.
+    """
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(query, params)
+            return cursor.fetchall()
+
+
+def fetch_value(query, params=None):
+    """
+    Run a query on a pooled connection and return the first column of the first row.
+
+    Parameters:
+    query (str): The SQL query, with %s placeholders for `params`.
+    params (tuple): Values bound to the placeholders.
+
+    Returns:
+    object: The value, or None when the query returns no rows.
+    """
+    rows = fetch_rows(query, params)
+    return rows[0][0] if rows else None
+
+
+def fetch_dataframe(query, params=None, dtypes=None, parse_dates=('datetime',)):
+    """
+    Run a query on a pooled connection and return the result as a DataFrame.
+
+    Parameters:
+    query (str): The SQL query, with %s placeholders for `params`.
+    params (tuple): Values bound to the placeholders.
+    dtypes (dict): Optional mapping of column name to dtype to cast the result columns to.
+    parse_dates (tuple): Columns converted to datetime64 when present in the result.
+
+    Returns:
+    pd.DataFrame: The result rows, with one column per selected column.
+    """
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(query, params)
+            results = cursor.fetchall()
+            colnames = [desc[0] for desc in cursor.description]
+
+    return _to_dataframe(results, colnames, dtypes, parse_dates)
+
+
+def iter_dataframes(query, params=None, chunk_size=DEFAULT_CHUNK_SIZE, dtypes=None, parse_dates=('datetime',)):
+    """
+    Stream the result of a query as DataFrame chunks through a named server-side cursor.
+
+    The server keeps the result set and only `chunk_size` rows travel to the client at a time, so
+    memory stays bounded by the chunk instead of the table. The pooled connection is held until the
+    iteration finishes or the generator is closed.
+
+    Parameters:
+    query (str): The SQL query, with %s placeholders for `params`.
+    params (tuple): Values bound to the placeholders.
+    chunk_size (int): The number of rows per chunk.
+    dtypes (dict): Optional mapping of column name to dtype to cast the result columns to.
+    parse_dates (tuple): Columns converted to datetime64 when present in the result.
+
+    Yields:
+    pd.DataFrame: Consecutive chunks of at most `chunk_size` rows, in query order.
+    """
+    with connection() as conn:
+        with conn.cursor(name=f"stream_{os.getpid()}_{next(_cursor_names)}") as cursor:
+            cursor.itersize = chunk_size
+            cursor.execute(query, params)
+            while True:
+                results = cursor.fetchmany(chunk_size)
+                if not results:
+                    break
+                colnames = [desc[0] for desc in cursor.description]
+                yield _to_dataframe(results, colnames, dtypes, parse_dates)
+
+
+def iter_ticker_frames(query, params=None, chunk_size=DEFAULT_CHUNK_SIZE, dtypes=None, parse_dates=('datetime',), reader=None):
+    """
+    Stream the result of a query ordered by ticker as one complete DataFrame per ticker.
+
+    Chunks from iter_dataframes are cut at ticker boundaries; the rows of a ticker that spans a chunk
+    boundary are carried over to the next chunk, so memory is bounded by the chunk size plus the largest
+    ticker.
+
+    Parameters:
+    query (str): The SQL query, with %s placeholders for `params`. It must return a 'ticker' column and
+                 order the rows by ticker first, e.g. ORDER BY ticker, datetime.
+    params (tuple): Values bound to the placeholders.
+    chunk_size (int): The number of rows fetched from the server at a time.
+    dtypes (dict): Optional mapping of column name to dtype to cast the result columns to.
+    parse_dates (tuple): Columns converted to datetime64 when present in the result.
+    reader (callable): The chunked reader, iter_dataframes by default; db.copy_reader.iter_copy_dataframes
+                       decodes the rows from COPY output instead.
+
+    Yields:
+    tuple: (ticker, pd.DataFrame) with the ticker's rows in query order and a fresh RangeIndex.
+    """
+    # Pieces of the current ticker, which may continue in the next chunk
+    pending = []
+    for chunk in (reader or iter_dataframes)(query, params, chunk_size, dtypes, parse_dates):
+        tickers = chunk['ticker'].to_numpy()
+        starts = np.r_[0, np.flatnonzero(tickers[1:] != tickers[:-1]) + 1]
+        ends = np.r_[starts[1:], len(chunk)]
+        for start, end in zip(starts, ends):
+            if pending and pending[0]['ticker'].iat[0] != tickers[start]:
+                yield pending[0]['ticker'].iat[0], pd.concat(pending, ignore_index=True)
+                pending = []
+            pending.append(chunk.iloc[start:end])
+    if pending:
+        yield pending[0]['ticker'].iat[0], pd.concat(pending, ignore_index=True)
+
+
+def _to_dataframe(results, colnames, dtypes, parse_dates):
+    """Build a DataFrame from fetched rows and apply the requested date parsing and dtypes."""
+    df = pd.DataFrame(results, columns=colnames)
+    for column in parse_dates or ():
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column])
+    if dtypes:
+        df = df.astype({column: dtype for column, dtype in dtypes.items() if column in df.columns})
+    return df
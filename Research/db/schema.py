@@ -0,0 +1,256 @@
+import os
+
+# TimescaleDB layout of the bar tables, overridable through the environment. Intervals use Postgres
+# interval syntax; leave a COMPRESS_AFTER or RETAIN_FOR variable empty to disable that policy.
+MINUTE_BARS_HYPERTABLE = {
+    'chunk_interval': os.environ.get("TIMESCALE_MINUTE_CHUNK_INTERVAL", "1 day"),
+    'compress_after': os.environ.get("TIMESCALE_MINUTE_COMPRESS_AFTER", "7 days") or None,
+    'retain_for': os.environ.get("TIMESCALE_MINUTE_RETAIN_FOR", "") or None,
+}
+DAILY_BARS_HYPERTABLE = {
+    'chunk_interval': os.environ.get("TIMESCALE_DAILY_CHUNK_INTERVAL", "365 days"),
+    'compress_after': os.environ.get("TIMESCALE_DAILY_COMPRESS_AFTER", "90 days") or None,
+    'retain_for': os.environ.get("TIMESCALE_DAILY_RETAIN_FOR", "") or None,
+}
+# Bar table columns stored as DOUBLE PRECISION
+PRICE_COLUMNS = ['open', 'high', 'low', 'close']
+# Bar frequencies derived from the minute tables by continuous aggregates, with their bucket width
+ROLLUP_INTERVALS = {'5m': '5 minutes', '15m': '15 minutes', '1h': '1 hour', '1d': '1 day'}
+
+
+def ensure_table(cursor, table_name, column_types, key_columns=('ticker', 'datetime'), rebuild=False, rebuild_columns=None):
+    """
+    Make sure a permanent table exists and has at least the given columns.
+
+    Tables shared by several writers end up with the union of their columns: the first writer creates
+    the table and later writers add their own columns with ADD COLUMN IF NOT EXISTS. Existing rows are
+    never touched unless `rebuild` is set.
+
+    Parameters:
+    cursor (psycopg2.extensions.cursor): Cursor of the connection that should perform the change.
+    table_name (str): The table to create or extend.
+    column_types (dict): Mapping of column name to SQL type, in table order.
+    key_columns (tuple): The primary key, used when the table is created. Ticker first, so the per-ticker
+                         time-range reads are one range scan of the key.
+    rebuild (bool): Drop the table first, e.g. after a schema change.
+    rebuild_columns (list): With `rebuild`, drop only these columns instead of the whole table. Writers
+                            that add their columns to a table created by another writer use this so a
+                            rebuild does not discard the other writer's data.
+    """
+    if rebuild and rebuild_columns:
+        for column in rebuild_columns:
+            cursor.execute(f"ALTER TABLE IF EXISTS {table_name} DROP COLUMN IF EXISTS {column};")
+    elif rebuild:
+        cursor.execute(f"DROP TABLE IF EXISTS {table_name};")
+
+    column_definitions = ",\n        ".join(f"{column} {sql_type}" for column, sql_type in column_types.items())
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {table_name} (
+        {column_definitions},
+        PRIMARY KEY ({", ".join(key_columns)})
+    );
+    """)
+
+    # A table created by another writer may lack some of this writer's columns
+    for column, sql_type in column_types.items():
+        if column not in key_columns:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {column} {sql_type};")
+
+    if 'ticker' in key_columns:
+        ensure_ticker_index(cursor, table_name)
+
+
+def ensure_ticker_index(cursor, table_name):
+    """
+    Give a table whose primary key starts with datetime a (ticker, datetime) index.
+
+    Tables created before the keys were ticker first have a (datetime, ticker) primary key, which cannot
+    serve WHERE ticker = ... AND datetime ... without scanning every time entry. Rebuilding their key would
+    rewrite the table, so they get a secondary index in the key order of new tables instead.
+
+    Parameters:
+    cursor (psycopg2.extensions.cursor): Cursor of the connection that should perform the change.
+    table_name (str): An existing table with 'ticker' and 'datetime' columns.
+    """
+    cursor.execute("""
+    SELECT attribute.attname
+    FROM pg_index AS primary_key
+    JOIN pg_attribute AS attribute ON attribute.attrelid = primary_key.indrelid AND attribute.attnum = primary_key.indkey[0]
+    WHERE primary_key.indrelid = %s::regclass AND primary_key.indisprimary;
+    """, (table_name,))
+    first_key_column = cursor.fetchone()
+    if first_key_column is not None and first_key_column[0] != 'ticker':
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {table_name}_ticker_datetime_idx ON {table_name} (ticker, datetime);")
+
+
+def ensure_float_columns(cursor, table_name, columns):
+    """
+    Migrate NUMERIC columns of an existing table to DOUBLE PRECISION.
+
+    Tables created before the prices were stored as float8 decode every price into a Decimal. The
+    migration rewrites the table once; afterwards the call is a catalog lookup. TimescaleDB cannot change
+    a column type while compression is enabled or a continuous aggregate reads the column, so on a
+    hypertable the chunks are decompressed, compression is switched off and the continuous aggregates
+    are dropped first. ensure_hypertable and ensure_bar_rollups put them back; aggregated bars whose minute
+    bars a retention policy has already dropped are not rebuilt.
+
+    Parameters:
+    cursor (psycopg2.extensions.cursor): Cursor of the connection that should perform the change.
+    table_name (str): The table to migrate; missing tables and columns are skipped.
+    columns (list): The columns to store as DOUBLE PRECISION.
+    """
+    cursor.execute("""
+    SELECT column_name FROM information_schema.columns
+    WHERE table_schema = current_schema() AND table_name = %s AND column_name = ANY(%s) AND data_type = 'numeric';
+    """, (table_name, list(columns)))
+    numeric_columns = [row[0] for row in cursor.fetchall()]
+    if not numeric_columns:
+        return
+
+    cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'timescaledb';")
+    if cursor.fetchone() is not None:
+        cursor.execute("SELECT compression_enabled FROM timescaledb_information.hypertables WHERE hypertable_name = %s;", (table_name,))
+        hypertable = cursor.fetchone()
+        if hypertable is not None:
+            cursor.execute("SELECT view_name FROM timescaledb_information.continuous_aggregates WHERE hypertable_name = %s;", (table_name,))
+            for (view_name,) in cursor.fetchall():
+                cursor.execute(f"DROP MATERIALIZED VIEW IF EXISTS {view_name};")
+            if hypertable[0]:
+                cursor.execute("SELECT remove_compression_policy(%s, if_exists => TRUE);", (table_name,))
+                cursor.execute("SELECT decompress_chunk(chunk, if_compressed => TRUE) FROM show_chunks(%s) AS chunk;", (table_name,))
+                cursor.execute(f"ALTER TABLE {table_name} SET (timescaledb.compress = false);")
+
+    alterations = ", ".join(f"ALTER COLUMN {column} TYPE DOUBLE PRECISION" for column in numeric_columns)
+    cursor.execute(f"ALTER TABLE {table_name} {alterations};")
+
+
+def ensure_hypertable(cursor, table_name, chunk_interval, compress_after=None, retain_for=None, time_column='datetime', segment_by='ticker'):
+    """
+    Turn a table into a TimescaleDB hypertable chunked on its time column, with native compression.
+
+    Existing plain tables are migrated in place, so time-range scans only touch the chunks they need.
+    Compressed chunks are segmented by `segment_by` and ordered by time, which keeps each ticker's bars
+    together. The compression and retention policies follow the arguments on every call: a changed
+    interval replaces the policy and None removes it. Without the timescaledb extension the table is
+    left as a plain table.
+
+    Parameters:
+    cursor (psycopg2.extensions.cursor): Cursor of the connection that should perform the change.
+    table_name (str): An existing table whose unique constraints include `time_column`.
+    chunk_interval (str): The time range of each chunk, e.g. '1 day'. Applies to chunks created from now on.
+    compress_after (str): Compress chunks older than this interval, e.g. '7 days'; None for no compression policy.
+    retain_for (str): Drop chunks older than this interval; None to keep every bar.
+    time_column (str): The partitioning column.
+    segment_by (str): The column compressed rows are grouped by.
+    """
+    ensure_ticker_index(cursor, table_name)
+
+    cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'timescaledb';")
+    if cursor.fetchone() is None:
+        return
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS timescaledb;")
+
+    cursor.execute(
+        "SELECT create_hypertable(%s, by_range(%s, %s::interval), if_not_exists => TRUE, migrate_data => TRUE);",
+        (table_name, time_column, chunk_interval)
+    )
+    cursor.execute("SELECT set_chunk_time_interval(%s, %s::interval);", (table_name, chunk_interval))
+
+    cursor.execute("SELECT compression_enabled FROM timescaledb_information.hypertables WHERE hypertable_name = %s;", (table_name,))
+    if not cursor.fetchone()[0]:
+        cursor.execute(f"""
+        ALTER TABLE {table_name} SET (
+            timescaledb.compress,
+            timescaledb.compress_segmentby = '{segment_by}',
+            timescaledb.compress_orderby = '{time_column} DESC'
+        );
+        """)
+
+    _ensure_policy(cursor, table_name, 'policy_compression', 'compress_after', compress_after,
+                   "remove_compression_policy", "add_compression_policy")
+    _ensure_policy(cursor, table_name, 'policy_retention', 'drop_after', retain_for,
+                   "remove_retention_policy", "add_retention_policy")
+
+
+def _ensure_policy(cursor, table_name, proc_name, config_key, interval, remove_function, add_function):
+    """Make the background policy job of a hypertable match `interval`, or remove it when that is None."""
+    cursor.execute(f"""
+    SELECT (config->>'{config_key}')::interval = %s::interval
+    FROM timescaledb_information.jobs
+    WHERE proc_name = %s AND hypertable_name = %s;
+    """, (interval, proc_name, table_name))
+    current = cursor.fetchone()
+    if current is not None and current[0]:
+        return
+    if current is not None:
+        cursor.execute(f"SELECT {remove_function}(%s, if_exists => TRUE);", (table_name,))
+    if interval is not None:
+        cursor.execute(f"SELECT {add_function}(%s, %s::interval);", (table_name, interval))
+
+
+def rollup_table_name(minute_table_name, frequency):
+    """
+    Return the name of the table or view holding the bars of a minute table at another frequency.
+
+    Parameters:
+    minute_table_name (str): A minute bar table, e.g. 'alpaca_minute'.
+    frequency (str): '1m' for the minute table itself, or one of ROLLUP_INTERVALS.
+
+    Returns:
+    str: The minute table for '1m', otherwise its continuous aggregate, e.g. 'alpaca_minute_5m'.
+    """
+    if frequency == '1m':
+        return minute_table_name
+    if frequency not in ROLLUP_INTERVALS:
+        raise ValueError(f"Unknown bar frequency {frequency!r}, expected '1m' or one of {list(ROLLUP_INTERVALS)}")
+    return f"{minute_table_name}_{frequency}"
+
+
+def ensure_bar_rollups(cursor, minute_table_name, retain_for=None, frequencies=tuple(ROLLUP_INTERVALS)):
+    """
+    Derive OHLCV bars at coarser frequencies from a minute bar hypertable through continuous aggregates.
+
+    Each frequency gets a continuous aggregate named by rollup_table_name with the columns of the minute
+    table. A refresh policy keeps it up to date. Real-time aggregation is on, so the bars newer than the
+    last refresh are aggregated at query time and reads always see every minute bar. The policy refreshes
+    from the oldest bar, which materializes an existing history on its first run and afterwards only
+    recomputes the buckets whose minute bars changed. Without the timescaledb extension nothing is created.
+
+    Parameters:
+    cursor (psycopg2.extensions.cursor): Cursor of the connection that should perform the change.
+    minute_table_name (str): A minute bar hypertable with the ingestion scripts' columns.
+    retain_for (str): The retention interval of the minute table, if any. Refreshes stop there so that
+                      aggregated bars outlive the minute bars they were built from.
+    frequencies (tuple): The keys of ROLLUP_INTERVALS to create.
+    """
+    cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'timescaledb';")
+    if cursor.fetchone() is None:
+        return
+
+    for frequency in frequencies:
+        view_name = rollup_table_name(minute_table_name, frequency)
+        bucket_width = ROLLUP_INTERVALS[frequency]
+        cursor.execute("SELECT 1 FROM timescaledb_information.continuous_aggregates WHERE view_name = %s;", (view_name,))
+        if cursor.fetchone() is not None:
+            continue
+
+        cursor.execute(f"""
+        CREATE MATERIALIZED VIEW {view_name}
+        WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+        SELECT time_bucket(INTERVAL '{bucket_width}', datetime) AS datetime,
+               ticker,
+               first(open, datetime) AS open,
+               max(high) AS high,
+               min(low) AS low,
+               last(close, datetime) AS close,
+               sum(volume)::BIGINT AS volume
+        FROM {minute_table_name}
+        GROUP BY time_bucket(INTERVAL '{bucket_width}', datetime), ticker
+        WITH NO DATA;
+        """)
+        # Leave the bucket still being filled to real-time aggregation; refresh the coarse ones less often
+        cursor.execute(
+            "SELECT add_continuous_aggregate_policy(%s, start_offset => %s::interval, end_offset => %s::interval, schedule_interval => %s::interval);",
+            (view_name, retain_for, bucket_width, '1 hour' if frequency == '1d' else bucket_width)
+        )
+
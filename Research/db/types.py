@@ -0,0 +1,30 @@
+import psycopg2.extensions
+
+# Type OIDs of NUMERIC and NUMERIC[]
+NUMERIC_OID = 1700
+NUMERIC_ARRAY_OID = 1231
+
+
+def _cast_numeric(value, cursor):
+    """Decode the text of a NUMERIC value as a float instead of a Decimal."""
+    return float(value) if value is not None else None
+
+
+NUMERIC_AS_FLOAT = psycopg2.extensions.new_type((NUMERIC_OID,), 'NUMERIC_AS_FLOAT', _cast_numeric)
+NUMERIC_ARRAY_AS_FLOAT = psycopg2.extensions.new_array_type((NUMERIC_ARRAY_OID,), 'NUMERIC_ARRAY_AS_FLOAT', NUMERIC_AS_FLOAT)
+
+
+def register_float_typecasters(scope=None):
+    """
+    Make psycopg2 decode NUMERIC columns to float instead of Decimal.
+
+    Prices are floats everywhere in the research code, so a NUMERIC column that has not been migrated yet,
+    or an expression such as SUM over a BIGINT, would otherwise reach pandas as an object column of
+    Decimals that has to be converted on every read.
+
+    Parameters:
+    scope (psycopg2.extensions.connection or cursor): Only register for this connection or cursor; for
+                                                       every connection of the process when omitted.
+    """
+    psycopg2.extensions.register_type(NUMERIC_AS_FLOAT, scope)
+    psycopg2.extensions.register_type(NUMERIC_ARRAY_AS_FLOAT, scope)
@@ -0,0 +1,42 @@
+import pandas as pd
+
+
+def fetch_high_water_marks(cursor, table_name, marker_column=None, tickers=None):
+    """
+    Fetch the latest datetime stored per ticker.
+
+    Parameters:
+    cursor (psycopg2.extensions.cursor): Cursor of the connection to read from.
+    table_name (str): The table with 'datetime' and 'ticker' columns.
+    marker_column (str): Only count rows where this column is set. Writers that share a table pass
+                         one of their own columns, so rows written by another writer do not count.
+    tickers (list): Only look up these tickers; all tickers when omitted.
+
+    Returns:
+    dict: Mapping of ticker to its latest datetime as a pd.Timestamp.
+    """
+    conditions = []
+    params = []
+    if marker_column:
+        conditions.append(f"{marker_column} IS NOT NULL")
+    if tickers is not None:
+        conditions.append("ticker = ANY(%s)")
+        params.append(list(tickers))
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor.execute(f"SELECT ticker, MAX(datetime) FROM {table_name} {where_clause} GROUP BY ticker;", params)
+    return {ticker: pd.Timestamp(latest) for ticker, latest in cursor.fetchall() if latest is not None}
+
+
+def rows_after_high_water_marks(df, high_water_marks):
+    """
+    Keep the rows that are newer than their ticker's high-water mark.
+
+    Parameters:
+    df (pd.DataFrame): DataFrame containing columns ['datetime', 'ticker'].
+    high_water_marks (dict): Mapping of ticker to its latest stored datetime, as returned by fetch_high_water_marks.
+
+    Returns:
+    pd.DataFrame: The rows of tickers without a mark, and the rows after the mark of the others.
+    """
+    marks = pd.to_datetime(df['ticker'].map(high_water_marks))
+    return df[marks.isna() | (pd.to_datetime(df['datetime']) > marks)]
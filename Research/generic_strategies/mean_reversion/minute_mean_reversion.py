@@ -1,66 +1,42 @@
+import argparse
 import psycopg2
 import pandas as pd
 import matplotlib.pyplot as plt
-from decimal import Decimal
 from technical_indicators.rolling_z_score import calculate_rolling_z_score
+from db.connection import transaction
+from db.fetch import iter_ticker_frames
+from db.copy_reader import iter_copy_dataframes
+from db.bulk import copy_upsert
+from db.schema import ROLLUP_INTERVALS, ensure_table, rollup_table_name
+from db.watermarks import fetch_high_water_marks, rows_after_high_water_marks
 
-# Database connection parameters
-DB_HOST = "postgres"
-DB_PORT = "5432"
-DB_NAME = "research"
-DB_USER = "myuser"
-DB_PASSWORD = "mypassword"
+# Database tables; the connection parameters come from the POSTGRES_* environment variables
 MINUTE_TABLE_NAME = "alpaca_minute"
 INDICATORS_TABLE_NAME = "ticker_minute_indicators"
 SIGNALS_TABLE_NAME = "ticker_minute_signals"
+INDICATOR_COLUMN_TYPES = {
+    'datetime': 'TIMESTAMP',
+    'ticker': 'VARCHAR(10)',
+    'close': 'FLOAT',
+    'z_score': 'FLOAT',
+    'signal': 'VARCHAR(10)',
+}
+SIGNAL_COLUMN_TYPES = {'datetime': 'TIMESTAMP', 'ticker': 'VARCHAR(10)', 'signal': 'VARCHAR(10)'}
+# Columns owned by this strategy in the tables it shares with the trend following strategy
+MEAN_REVERSION_COLUMNS = ['z_score', 'signal']
 
-def fetch_data_from_db(query):
-    """Fetch data from the PostgreSQL database based on the provided query."""
+def stream_data_from_db(query, params=None):
+    """Stream the result of a query ordered by ticker from the PostgreSQL database, one ticker at a time."""
     try:
-        # Connect to the PostgreSQL database
-        connection = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        
-        # Create a cursor object
-        cursor = connection.cursor()
-        
-        # Execute the query
-        cursor.execute(query)
-        
-        # Fetch all results
-        results = cursor.fetchall()
-        
-        # Get column names
-        colnames = [desc[0] for desc in cursor.description]
-        
-        # Create a DataFrame
-        df = pd.DataFrame(results, columns=colnames)
-        
-        return df
+        yield from iter_ticker_frames(query, params, reader=iter_copy_dataframes)
 
     except psycopg2.Error as e:
         print(f"Error fetching data from PostgreSQL database: {e}")
-        return None
-    finally:
-        # Close the cursor and connection
-        if 'cursor' in locals():
-            cursor.close()
-        if 'connection' in locals():
-            connection.close()
 
 def generate_mean_reversion_signals(df, window=10):
     """Generate mean reversion signals based on rolling z-score."""
     df['signal'] = 'neutral'
     
-    # Convert 'close' to float if it's of type Decimal
-    if df['close'].dtype == 'object' or isinstance(df['close'].iloc[0], Decimal):
-        df['close'] = df['close'].astype(float)
-    
     # Calculate rolling z-score using the imported function
     df = calculate_rolling_z_score(df, window=window)
     
@@ -100,124 +76,107 @@ def plot_data_with_signals(df, title):
     plt.grid(True)
     plt.show()
 
-def write_data_to_db(df, table_name):
-    """Write the DataFrame to the PostgreSQL database under the specified table name."""
+def write_data_to_db(df, table_name, full_rebuild=False):
+    """Upsert the bars newer than the table's per-ticker high-water mark into the specified table.
+
+    With full_rebuild=True the mean reversion columns are dropped and recreated first and every row is written.
+
+    Returns:
+    bool: Whether the rows were committed; a failed write is reported and leaves the table unchanged.
+    """
     try:
-        # Connect to the PostgreSQL database
-        connection = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        
-        # Create a cursor object
-        cursor = connection.cursor()
-        
-        # Drop table if it exists
-        drop_table_query = f"DROP TABLE IF EXISTS {table_name};"
-        cursor.execute(drop_table_query)
-        
-        # Create table with signal column
-        create_table_query = f"""
-        CREATE TABLE {table_name} (
-            datetime TIMESTAMP,
-            ticker VARCHAR(10),
-            close FLOAT,
-            z_score FLOAT,
-            signal VARCHAR(10),
-            PRIMARY KEY (datetime, ticker)
-        );
-        """
-        cursor.execute(create_table_query)
-        
-        # Insert data into the table
-        for _, row in df.iterrows():
-            insert_query = f"""
-            INSERT INTO {table_name} (datetime, ticker, close, z_score, signal)
-            VALUES (%s, %s, %s, %s, %s)
-            ON CONFLICT (datetime, ticker) DO UPDATE SET
-            close = EXCLUDED.close,
-            z_score = EXCLUDED.z_score,
-            signal = EXCLUDED.signal;
-            """
-            cursor.execute(insert_query, (row['datetime'], row['ticker'], row['close'], row['z_score'], row['signal']))
-        
-        # Commit the transaction
-        connection.commit()
+        with transaction() as cursor:
+            # Keep the table permanent; it is shared with the trend following strategy, so a full
+            # rebuild only recreates this strategy's columns
+            ensure_table(cursor, table_name, INDICATOR_COLUMN_TYPES, rebuild=full_rebuild, rebuild_columns=MEAN_REVERSION_COLUMNS)
+            
+            # Skip bars this strategy has already written
+            if not full_rebuild:
+                df = rows_after_high_water_marks(df, fetch_high_water_marks(cursor, table_name, marker_column='signal', tickers=df['ticker'].unique().tolist()))
+            
+            # Bulk load the rows through COPY and merge them in one upsert
+            copy_upsert(cursor, df, table_name, list(INDICATOR_COLUMN_TYPES))
+        return True
 
     except psycopg2.Error as e:
         print(f"Error writing data to PostgreSQL database: {e}")
-    finally:
-        # Close the cursor and connection
-        if 'cursor' in locals():
-            cursor.close()
-        if 'connection' in locals():
-            connection.close()
+        return False
 
-def write_signals_to_minute_signals_table(df):
-    """Write the signals to the minute signals table in the PostgreSQL database."""
+def write_signals_to_minute_signals_table(df, full_rebuild=False):
+    """Write the signals to the minute signals table in the PostgreSQL database, for bars newer than the signals already stored.
+
+    Returns:
+    bool: Whether the rows were committed; a failed write is reported and leaves the table unchanged.
+    """
     try:
-        # Connect to the PostgreSQL database
-        connection = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        
-        # Create a cursor object
-        cursor = connection.cursor()
-        
-        # Add new column for signal if it doesn't exist
-        add_columns_query = f"""
-        ALTER TABLE {SIGNALS_TABLE_NAME} 
-        ADD COLUMN IF NOT EXISTS signal VARCHAR(10);
-        """
-        cursor.execute(add_columns_query)
-        
-        # Insert signals into the minute signals table
-        for _, row in df.iterrows():
-            insert_query = f"""
-            INSERT INTO {SIGNALS_TABLE_NAME} (datetime, ticker, signal)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (datetime, ticker) DO UPDATE SET
-            signal = EXCLUDED.signal;
-            """
-            cursor.execute(insert_query, (row['datetime'], row['ticker'], row['signal']))
-        
-        # Commit the transaction
-        connection.commit()
+        with transaction() as cursor:
+            # Create the table if the trend following strategy has not, and add the signal column
+            ensure_table(cursor, SIGNALS_TABLE_NAME, SIGNAL_COLUMN_TYPES, rebuild=full_rebuild, rebuild_columns=['signal'])
+            
+            # Skip bars whose signal is already stored
+            if not full_rebuild:
+                df = rows_after_high_water_marks(df, fetch_high_water_marks(cursor, SIGNALS_TABLE_NAME, marker_column='signal', tickers=df['ticker'].unique().tolist()))
+            
+            # Bulk load the signals through COPY; the trend column written by the trend following strategy is kept
+            copy_upsert(cursor, df, SIGNALS_TABLE_NAME, list(SIGNAL_COLUMN_TYPES))
+        return True
 
     except psycopg2.Error as e:
         print(f"Error writing signals to PostgreSQL database: {e}")
-    finally:
-        # Close the cursor and connection
-        if 'cursor' in locals():
-            cursor.close()
-        if 'connection' in locals():
-            connection.close()
+        return False
 
 # Example usage
 if __name__ == "__main__":
-    # Query for a specific ticker, e.g., 'AAPL'
-    ticker = 'AAPL'
-    minute_query = f"SELECT * FROM {MINUTE_TABLE_NAME} WHERE ticker = '{ticker}';"
+    parser = argparse.ArgumentParser(description="Compute minute rolling z-score signals and upsert them into the database.")
+    parser.add_argument('--full-rebuild', action='store_true',
+                        help="Drop and recreate the mean reversion columns and rewrite every bar, e.g. after a schema change")
+    parser.add_argument('--tickers', nargs='+', default=['AAPL'],
+                        help="Tickers to process, e.g. --tickers AAPL MSFT")
+    parser.add_argument('--all-tickers', action='store_true',
+                        help="Process every ticker in the bars table instead of --tickers, without plots")
+    parser.add_argument('--frequency', choices=['1m', *ROLLUP_INTERVALS], default='1m',
+                        help="Bar frequency; anything but 1m reads the continuous aggregate of the minute bars")
+    args = parser.parse_args()
+    
+    bars_table_name = rollup_table_name(MINUTE_TABLE_NAME, args.frequency)
+    conditions = []
+    params = []
+    if args.frequency != '1m':
+        # Keep the results of rolled-up bars apart from the minute tables
+        INDICATORS_TABLE_NAME = f"ticker_{args.frequency}_indicators"
+        SIGNALS_TABLE_NAME = f"ticker_{args.frequency}_signals"
+        # Leave the bucket that is still being filled for a later run, the high-water marks would freeze it
+        conditions.append(f"datetime + INTERVAL '{ROLLUP_INTERVALS[args.frequency]}' <= (SELECT MAX(datetime) FROM {MINUTE_TABLE_NAME})")
+    if not args.all_tickers:
+        conditions.append("ticker = ANY(%s)")
+        params.append(args.tickers)
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
     
-    minute_data = fetch_data_from_db(minute_query)
+    # Stream the bars one ticker at a time so memory is bounded by the largest ticker, not the table
+    minute_query = f"SELECT * FROM {bars_table_name} {where_clause} ORDER BY ticker, datetime;"
+    # Only the first ticker rebuilds the columns, later tickers must keep the rows written before them
+    rebuild_indicators = rebuild_signals = args.full_rebuild
+    failed_tickers = []
     
-    if minute_data is not None:
+    for ticker, minute_data in stream_data_from_db(minute_query, params):
         print(f"Minute Data for {ticker}:")
         print(minute_data)
         # Generate mean reversion signals
         minute_data_with_signals = generate_mean_reversion_signals(minute_data)
         print(f"Minute Data with Rolling Z-Score and Signals for {ticker}:")
         print(minute_data_with_signals)
-        # Plot minute data with signals
-        plot_data_with_signals(minute_data_with_signals, f"Minute Data with Rolling Z-Score Signals for {ticker}")
+        if not args.all_tickers:
+            # Plot minute data with signals
+            plot_data_with_signals(minute_data_with_signals, f"Minute Data with Rolling Z-Score Signals for {ticker}")
         # Write the data with signals back to the database
-        write_data_to_db(minute_data_with_signals, INDICATORS_TABLE_NAME)
+        indicators_written = write_data_to_db(minute_data_with_signals, INDICATORS_TABLE_NAME, full_rebuild=rebuild_indicators)
         # Write the signals to the minute signals table
-        write_signals_to_minute_signals_table(minute_data_with_signals)
\ No newline at end of file
+        signals_written = write_signals_to_minute_signals_table(minute_data_with_signals, full_rebuild=rebuild_signals)
+        # A table is rebuilt by the first write that commits
+        rebuild_indicators = rebuild_indicators and not indicators_written
+        rebuild_signals = rebuild_signals and not signals_written
+        if not (indicators_written and signals_written):
+            failed_tickers.append(ticker)
+    
+    if failed_tickers:
+        print(f"Writing failed for {', '.join(failed_tickers)}; their bars are written by the next run.")
@@ -1,5 +1,83 @@
+import numpy as np
 import pandas as pd
 
+def calculate_rolling_z_scores(df, windows=(20,)):
+    """
+    Calculate rolling z-scores of the 'close' prices for several window sizes in one pass.
+
+    Each ticker is handled separately and in datetime order. Cumulative sums of the prices and
+    squared prices are built once per ticker; every window's mean and standard deviation is then a
+    difference of two cumulative sums, so adding windows does not add passes over the data.
+
+    Parameters:
+    - df: DataFrame containing at least the 'close' column, and optionally 'ticker' and 'datetime'.
+    - windows: The rolling window sizes for calculating the mean and standard deviation.
+
+    Returns:
+    - DataFrame with an additional 'z_score_<window>' column per window. Windows with missing
+      prices or zero variance yield NaN.
+    """
+    if 'close' not in df.columns:
+        raise ValueError("DataFrame must contain a 'close' column")
+
+    n_rows = len(df)
+    close = df['close'].to_numpy(dtype=float)
+
+    # Order rows by ticker, then by time, so every ticker forms one contiguous block
+    if 'ticker' in df.columns:
+        codes, _ = pd.factorize(df['ticker'].to_numpy())
+    else:
+        codes = np.zeros(n_rows, dtype=np.int64)
+    if 'datetime' in df.columns:
+        order = np.lexsort((pd.to_datetime(df['datetime']).to_numpy(), codes))
+    else:
+        order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    values = close[order]
+
+    # Position of each row inside its ticker block
+    block_starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]]) if n_rows else np.array([], dtype=np.int64)
+    block_lengths = np.diff(np.r_[block_starts, n_rows])
+    position_in_block = np.arange(n_rows) - np.repeat(block_starts, block_lengths)
+
+    # Center each ticker on its mean to keep the cumulative sums well conditioned
+    valid = ~np.isnan(values)
+    filled = np.where(valid, values, 0.)
+    if n_rows:
+        block_counts = np.add.reduceat(valid.astype(np.int64), block_starts)
+        block_means = np.add.reduceat(filled, block_starts) / np.maximum(block_counts, 1)
+        filled = np.where(valid, filled - np.repeat(block_means, block_lengths), 0.)
+
+    # Accumulate in extended precision where the platform has it; window sums are differences of these
+    extended = filled.astype(np.longdouble)
+    cumulative_sum = np.r_[0., np.cumsum(extended)]
+    cumulative_squares = np.r_[0., np.cumsum(extended * extended)]
+    cumulative_count = np.r_[0, np.cumsum(valid)]
+    noise_factor = 16 * np.finfo(np.longdouble).eps
+
+    for window in windows:
+        sorted_z_score = np.full(n_rows, np.nan)
+        if n_rows >= window:
+            # Sums over the window ending at each row from position window - 1 onwards
+            count = cumulative_count[window:] - cumulative_count[:-window]
+            total = (cumulative_sum[window:] - cumulative_sum[:-window]).astype(float)
+            squares = (cumulative_squares[window:] - cumulative_squares[:-window]).astype(float)
+            mean = total / window
+            deviation_sum = squares - total * mean
+            # Differences of cumulative sums leave rounding noise where the true variance is zero
+            noise_floor = (noise_factor * cumulative_squares[window:]).astype(float)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scores = (filled[window - 1:] - mean) / np.sqrt(deviation_sum / (window - 1))
+            scores[(deviation_sum <= noise_floor) | (count < window)] = np.nan
+            sorted_z_score[window - 1:] = scores
+            # Windows reaching back into the previous ticker's block are incomplete
+            sorted_z_score[position_in_block < window - 1] = np.nan
+        z_score = np.empty(n_rows)
+        z_score[order] = sorted_z_score
+        df[f'z_score_{window}'] = z_score
+
+    return df
+
 def calculate_rolling_z_score(df, window=20):
     """
     Calculate the rolling z-score for the 'close' prices in the given DataFrame.
@@ -11,17 +89,58 @@ def calculate_rolling_z_score(df, window=20):
     Returns:
     - DataFrame with an additional 'z_score' column.
     """
-    if 'close' not in df.columns:
-        raise ValueError("DataFrame must contain a 'close' column")
+    df = calculate_rolling_z_scores(df, windows=[window])
+    df['z_score'] = df.pop(f'z_score_{window}')
 
-    # Calculate rolling mean and standard deviation
-    rolling_mean = df['close'].rolling(window=window).mean()
-    rolling_std = df['close'].rolling(window=window).std()
+    return df
 
-    # Calculate z-score
-    df['z_score'] = (df['close'] - rolling_mean) / rolling_std
+def calculate_rolling_z_scores_panel(panel, windows=(20,)):
+    """
+    Calculate rolling z-scores of every ticker column of a panel for several window sizes in one pass.
 
-    return df
+    Parameters:
+    - panel: indicators.panel.Panel of bars pivoted into time x ticker arrays, with a 'close' field.
+    - windows: The rolling window sizes for calculating the mean and standard deviation.
+
+    Returns:
+    - dict of time x ticker arrays keyed 'z_score_<window>', NaN where the ticker has no bar, the
+      window is incomplete or has missing prices, or the variance is zero.
+    """
+    # Packed columns hold each ticker's bars from the top, so a row index is the bar's position
+    close = panel.pack(panel.fields['close'])
+    n_rows, n_columns = close.shape
+
+    # Center each ticker on its mean to keep the cumulative sums well conditioned
+    valid = ~np.isnan(close)
+    filled = np.where(valid, close, 0.)
+    column_means = filled.sum(axis=0) / np.maximum(valid.sum(axis=0), 1)
+    filled = np.where(valid, filled - column_means, 0.)
+
+    # Accumulate down every column at once, in extended precision where the platform has it
+    extended = filled.astype(np.longdouble)
+    first_row = np.zeros((1, n_columns))
+    cumulative_sum = np.vstack([first_row, np.cumsum(extended, axis=0)])
+    cumulative_squares = np.vstack([first_row, np.cumsum(extended * extended, axis=0)])
+    cumulative_count = np.vstack([first_row, np.cumsum(valid, axis=0)])
+    noise_factor = 16 * np.finfo(np.longdouble).eps
+
+    z_scores = {}
+    for window in windows:
+        packed_z_score = np.full(close.shape, np.nan)
+        if n_rows >= window:
+            count = cumulative_count[window:] - cumulative_count[:-window]
+            total = (cumulative_sum[window:] - cumulative_sum[:-window]).astype(float)
+            squares = (cumulative_squares[window:] - cumulative_squares[:-window]).astype(float)
+            mean = total / window
+            deviation_sum = squares - total * mean
+            noise_floor = (noise_factor * cumulative_squares[window:]).astype(float)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                scores = (filled[window - 1:] - mean) / np.sqrt(deviation_sum / (window - 1))
+            scores[(deviation_sum <= noise_floor) | (count < window)] = np.nan
+            packed_z_score[window - 1:] = scores
+        z_scores[f'z_score_{window}'] = panel.unpack(packed_z_score)
+
+    return z_scores
 
 # Example usage
 if __name__ == "__main__":
@@ -1,57 +1,48 @@
+import argparse
 import psycopg2
 import pandas as pd
 import matplotlib.pyplot as plt
-from technical_indicators.EMA import compute_ema
+from technical_indicators.EMA import compute_emas
 from technical_indicators.ADX import compute_adx
+from db.connection import transaction
+from db.fetch import bars_query, iter_ticker_frames
+from db.copy_reader import iter_copy_dataframes
+from db.bulk import copy_upsert
+from db.schema import ensure_table
+from db.watermarks import fetch_high_water_marks, rows_after_high_water_marks
 
-# Database connection parameters
-DB_HOST = "postgres"
-DB_PORT = "5432"
-DB_NAME = "research"
-DB_USER = "myuser"
-DB_PASSWORD = "mypassword"
+# Database tables; the connection parameters come from the POSTGRES_* environment variables
 MINUTE_TABLE_NAME = "alpaca_minute"
 DAILY_TABLE_NAME = "alpaca_daily"
 INDICATORS_TABLE_NAME = "ticker_daily_indicators"
+INDICATOR_COLUMN_TYPES = {
+    'datetime': 'TIMESTAMP',
+    'ticker': 'VARCHAR(10)',
+    'open': 'FLOAT',
+    'high': 'FLOAT',
+    'low': 'FLOAT',
+    'close': 'FLOAT',
+    'volume': 'BIGINT',
+    'ema_10': 'FLOAT',
+    'ema_20': 'FLOAT',
+    'ema_50': 'FLOAT',
+    'adx': 'FLOAT',
+    'plus_di': 'FLOAT',
+    'minus_di': 'FLOAT',
+    'trend': 'VARCHAR(10)',
+}
+# Columns owned by this strategy in the tables it shares with the mean reversion strategy
+TREND_COLUMNS = ['ema_10', 'ema_20', 'ema_50', 'adx', 'plus_di', 'minus_di', 'trend']
+# The indicator functions name the directional indicators '+di'/'-di'; the tables use plus_di/minus_di
+DI_COLUMN_NAMES = {'+di': 'plus_di', '-di': 'minus_di'}
 
-def fetch_data_from_db(query):
-    """Fetch data from the PostgreSQL database based on the provided query."""
+def stream_data_from_db(query, params=None):
+    """Stream the result of a query ordered by ticker from the PostgreSQL database, one ticker at a time."""
     try:
-        # Connect to the PostgreSQL database
-        connection = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        
-        # Create a cursor object
-        cursor = connection.cursor()
-        
-        # Execute the query
-        cursor.execute(query)
-        
-        # Fetch all results
-        results = cursor.fetchall()
-        
-        # Get column names
-        colnames = [desc[0] for desc in cursor.description]
-        
-        # Create a DataFrame
-        df = pd.DataFrame(results, columns=colnames)
-        
-        return df
+        yield from iter_ticker_frames(query, params, reader=iter_copy_dataframes)
 
     except psycopg2.Error as e:
         print(f"Error fetching data from PostgreSQL database: {e}")
-        return None
-    finally:
-        # Close the cursor and connection
-        if 'cursor' in locals():
-            cursor.close()
-        if 'connection' in locals():
-            connection.close()
 
 def generate_trend_signals(df):
     """Generate trend following signals based on EMA crossovers."""
@@ -127,105 +118,73 @@ def plot_adx(df, title):
     plt.grid(True)
     plt.show()
 
-def write_data_to_db(df, table_name):
-    """Write the DataFrame to the PostgreSQL database under the specified table name."""
+def write_data_to_db(df, table_name, columns=None, full_rebuild=False):
+    """Upsert the bars newer than the table's per-ticker high-water mark into the specified table.
+
+    With full_rebuild=True this strategy's columns are dropped and recreated first and every row is written.
+
+    Returns:
+    bool: Whether the rows were committed; a failed write is reported and leaves the table unchanged.
+    """
     try:
-        # Connect to the PostgreSQL database
-        connection = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        
-        # Create a cursor object
-        cursor = connection.cursor()
-        
-        # Drop table if it exists
-        drop_table_query = f"DROP TABLE IF EXISTS {table_name};"
-        cursor.execute(drop_table_query)
-        
-        # Create table with trend column
-        create_table_query = f"""
-        CREATE TABLE {table_name} (
-            datetime TIMESTAMP,
-            ticker VARCHAR(10),
-            open FLOAT,
-            high FLOAT,
-            low FLOAT,
-            close FLOAT,
-            volume BIGINT,
-            ema_10 FLOAT,
-            ema_20 FLOAT,
-            ema_50 FLOAT,
-            adx FLOAT,
-            plus_di FLOAT,
-            minus_di FLOAT,
-            trend VARCHAR(10),
-            PRIMARY KEY (datetime, ticker)
-        );
-        """
-        cursor.execute(create_table_query)
-        
-        # Insert data into the table
-        for _, row in df.iterrows():
-            insert_query = f"""
-            INSERT INTO {table_name} (datetime, ticker, open, high, low, close, volume, 
-                                    ema_10, ema_20, ema_50, adx, plus_di, minus_di, trend)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (datetime, ticker) DO UPDATE SET
-            open = EXCLUDED.open,
-            high = EXCLUDED.high,
-            low = EXCLUDED.low,
-            close = EXCLUDED.close,
-            volume = EXCLUDED.volume,
-            ema_10 = EXCLUDED.ema_10,
-            ema_20 = EXCLUDED.ema_20,
-            ema_50 = EXCLUDED.ema_50,
-            adx = EXCLUDED.adx,
-            plus_di = EXCLUDED.plus_di,
-            minus_di = EXCLUDED.minus_di,
-            trend = EXCLUDED.trend;
-            """
-            cursor.execute(insert_query, tuple(row))
-        
-        # Commit the transaction
-        connection.commit()
+        with transaction() as cursor:
+            # Keep the table permanent; it is shared with the mean reversion strategy, so a full
+            # rebuild only recreates this strategy's columns
+            if columns is None:
+                columns = list(INDICATOR_COLUMN_TYPES)
+            ensure_table(cursor, table_name, INDICATOR_COLUMN_TYPES, rebuild=full_rebuild, rebuild_columns=TREND_COLUMNS)
+            
+            # Skip bars this strategy has already written; the mean reversion strategy shares the tables
+            if not full_rebuild:
+                df = rows_after_high_water_marks(df, fetch_high_water_marks(cursor, table_name, marker_column='trend', tickers=df['ticker'].unique().tolist()))
+            
+            # Bulk load the rows through COPY and merge them in one upsert
+            copy_upsert(cursor, df.rename(columns=DI_COLUMN_NAMES), table_name, columns)
+        return True
 
     except psycopg2.Error as e:
         print(f"Error writing data to PostgreSQL database: {e}")
-    finally:
-        # Close the cursor and connection
-        if 'cursor' in locals():
-            cursor.close()
-        if 'connection' in locals():
-            connection.close()
+        return False
 
 # Example usage
 if __name__ == "__main__":
-    # Query for a specific ticker, e.g., 'AAPL'
-    ticker = 'AAPL'
-    daily_query = f"SELECT * FROM {DAILY_TABLE_NAME} WHERE ticker = '{ticker}';"
+    parser = argparse.ArgumentParser(description="Compute daily EMA trend signals and upsert them into the database.")
+    parser.add_argument('--full-rebuild', action='store_true',
+                        help="Drop and recreate the trend following columns and rewrite every bar, e.g. after a schema change")
+    parser.add_argument('--tickers', nargs='+', default=['AAPL'],
+                        help="Tickers to process, e.g. --tickers AAPL MSFT")
+    parser.add_argument('--all-tickers', action='store_true',
+                        help="Process every ticker in the bars table instead of --tickers, without plots")
+    args = parser.parse_args()
     
-    daily_data = fetch_data_from_db(daily_query)
+    # Stream the bars one ticker at a time so memory is bounded by the largest ticker, not the table
+    daily_query, params = bars_query(DAILY_TABLE_NAME, tickers=None if args.all_tickers else args.tickers)
+    # Only the first ticker rebuilds the tables, later tickers must keep the rows written before them
+    full_rebuild = args.full_rebuild
+    failed_tickers = []
     
-    if daily_data is not None:
+    for ticker, daily_data in stream_data_from_db(daily_query, params):
         print(f"Daily Data for {ticker}:")
         print(daily_data)
         # Compute EMAs for daily data
-        daily_data_with_ema_10 = compute_ema(daily_data, span=10)
-        daily_data_with_ema_20 = compute_ema(daily_data_with_ema_10, span=20)
-        daily_data_with_ema_50 = compute_ema(daily_data_with_ema_20, span=50)
+        daily_data_with_emas = compute_emas(daily_data, spans=[10, 20, 50])
         # Compute ADX for daily data
-        daily_data_with_adx = compute_adx(daily_data_with_ema_50)
+        daily_data_with_adx = compute_adx(daily_data_with_emas)
         # Generate trend signals
         daily_data_with_signals = generate_trend_signals(daily_data_with_adx)
         print(f"Daily Data with EMAs, ADX, and Trend Signals for {ticker}:")
         print(daily_data_with_signals)
-        # Plot daily data with EMAs and trend signals
-        plot_data_with_ema(daily_data_with_signals, f"Daily Data with EMAs and Trends for {ticker}")
-        # Plot ADX separately
-        plot_adx(daily_data_with_signals, f"ADX and DI for {ticker}")
+        if not args.all_tickers:
+            # Plot daily data with EMAs and trend signals
+            plot_data_with_ema(daily_data_with_signals, f"Daily Data with EMAs and Trends for {ticker}")
+            # Plot ADX separately
+            plot_adx(daily_data_with_signals, f"ADX and DI for {ticker}")
         # Write the data with EMAs, ADX, and trend signals back to the database
-        write_data_to_db(daily_data_with_signals, INDICATORS_TABLE_NAME)
\ No newline at end of file
+        written = write_data_to_db(daily_data_with_signals, INDICATORS_TABLE_NAME, full_rebuild=full_rebuild)
+        # The table is rebuilt by the first write that commits
+        full_rebuild = full_rebuild and not written
+        if not written:
+            failed_tickers.append(ticker)
+    
+    if failed_tickers:
+        print(f"Writing failed for {', '.join(failed_tickers)}; their bars are written by the next run.")
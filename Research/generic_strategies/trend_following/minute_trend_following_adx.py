@@ -1,57 +1,50 @@
+import argparse
 import psycopg2
+import psycopg2.extras
 import pandas as pd
 import matplotlib.pyplot as plt
-from technical_indicators.EMA import compute_ema
-from technical_indicators.ADX import compute_adx
+from technical_indicators.incremental import IncrementalIndicatorEngine
+from db.connection import transaction
+from db.fetch import iter_ticker_frames
+from db.copy_reader import iter_copy_dataframes
+from db.bulk import copy_upsert
+from db.schema import ROLLUP_INTERVALS, ensure_table, rollup_table_name
+from db.watermarks import fetch_high_water_marks, rows_after_high_water_marks
 
-# Database connection parameters
-DB_HOST = "postgres"
-DB_PORT = "5432"
-DB_NAME = "research"
-DB_USER = "myuser"
-DB_PASSWORD = "mypassword"
+# Database tables; the connection parameters come from the POSTGRES_* environment variables
 MINUTE_TABLE_NAME = "alpaca_minute"
 INDICATORS_TABLE_NAME = "ticker_minute_indicators"
 SIGNALS_TABLE_NAME = "ticker_minute_signals"
+STATE_TABLE_NAME = "ticker_minute_indicator_state"
+INDICATOR_COLUMN_TYPES = {
+    'datetime': 'TIMESTAMP',
+    'ticker': 'VARCHAR(10)',
+    'open': 'FLOAT',
+    'high': 'FLOAT',
+    'low': 'FLOAT',
+    'close': 'FLOAT',
+    'volume': 'BIGINT',
+    'ema_10': 'FLOAT',
+    'ema_20': 'FLOAT',
+    'ema_50': 'FLOAT',
+    'adx': 'FLOAT',
+    'plus_di': 'FLOAT',
+    'minus_di': 'FLOAT',
+    'trend': 'VARCHAR(10)',
+}
+SIGNAL_COLUMN_TYPES = {'datetime': 'TIMESTAMP', 'ticker': 'VARCHAR(10)', 'trend': 'VARCHAR(10)'}
+# Columns owned by this strategy in the tables it shares with the mean reversion strategy
+TREND_COLUMNS = ['ema_10', 'ema_20', 'ema_50', 'adx', 'plus_di', 'minus_di', 'trend']
+# The indicator functions name the directional indicators '+di'/'-di'; the tables use plus_di/minus_di
+DI_COLUMN_NAMES = {'+di': 'plus_di', '-di': 'minus_di'}
 
-def fetch_data_from_db(query):
-    """Fetch data from the PostgreSQL database based on the provided query."""
+def stream_data_from_db(query, params=None):
+    """Stream the result of a query ordered by ticker from the PostgreSQL database, one ticker at a time."""
     try:
-        # Connect to the PostgreSQL database
-        connection = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        
-        # Create a cursor object
-        cursor = connection.cursor()
-        
-        # Execute the query
-        cursor.execute(query)
-        
-        # Fetch all results
-        results = cursor.fetchall()
-        
-        # Get column names
-        colnames = [desc[0] for desc in cursor.description]
-        
-        # Create a DataFrame
-        df = pd.DataFrame(results, columns=colnames)
-        
-        return df
+        yield from iter_ticker_frames(query, params, reader=iter_copy_dataframes)
 
     except psycopg2.Error as e:
         print(f"Error fetching data from PostgreSQL database: {e}")
-        return None
-    finally:
-        # Close the cursor and connection
-        if 'cursor' in locals():
-            cursor.close()
-        if 'connection' in locals():
-            connection.close()
 
 def generate_trend_signals(df):
     """Generate trend following signals based on EMA crossovers and ADX."""
@@ -134,127 +127,164 @@ def plot_adx(df, title):
     plt.grid(True)
     plt.show()
 
-def write_data_to_db(df, table_name, columns=None):
-    """Write the DataFrame to the PostgreSQL database under the specified table name."""
+def ensure_state_table(cursor):
+    """Create the indicator state table on first use, so a fresh database starts from an empty engine."""
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {STATE_TABLE_NAME} (
+        ticker VARCHAR(10) PRIMARY KEY,
+        datetime TIMESTAMP,
+        state JSONB
+    );
+    """)
+
+def fetch_indicator_state():
+    """Load the checkpointed incremental indicator state, returning an empty engine if there is none."""
     try:
-        # Connect to the PostgreSQL database
-        connection = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        
-        # Create a cursor object
-        cursor = connection.cursor()
-        
-        # Drop table if it exists
-        drop_table_query = f"DROP TABLE IF EXISTS {table_name};"
-        cursor.execute(drop_table_query)
-        
-        # Create table with trend column
-        if table_name == SIGNALS_TABLE_NAME:
-            create_table_query = f"""
-            CREATE TABLE {table_name} (
-                datetime TIMESTAMP,
-                ticker VARCHAR(10),
-                trend VARCHAR(10),
-                PRIMARY KEY (datetime, ticker)
-            );
-            """
-        else:
-            create_table_query = f"""
-            CREATE TABLE {table_name} (
-                datetime TIMESTAMP,
-                ticker VARCHAR(10),
-                open FLOAT,
-                high FLOAT,
-                low FLOAT,
-                close FLOAT,
-                volume BIGINT,
-                ema_10 FLOAT,
-                ema_20 FLOAT,
-                ema_50 FLOAT,
-                adx FLOAT,
-                plus_di FLOAT,
-                minus_di FLOAT,
-                trend VARCHAR(10),
-                PRIMARY KEY (datetime, ticker)
-            );
+        with transaction() as cursor:
+            ensure_state_table(cursor)
+            cursor.execute(f"SELECT ticker, datetime, state FROM {STATE_TABLE_NAME};")
+            return IncrementalIndicatorEngine.from_records(cursor.fetchall())
+
+    except psycopg2.Error as e:
+        print(f"Error fetching indicator state from PostgreSQL database: {e}")
+        return IncrementalIndicatorEngine()
+
+def write_indicator_state(engine, tickers):
+    """Checkpoint the incremental indicator state of some tickers so the next run resumes after their last bar."""
+    try:
+        with transaction() as cursor:
+            # A full rebuild never reads the state, so the table may not exist yet
+            ensure_state_table(cursor)
+            # Upsert one state row per ticker
+            upsert_query = f"""
+            INSERT INTO {STATE_TABLE_NAME} (ticker, datetime, state)
+            VALUES (%s, %s, %s::jsonb)
+            ON CONFLICT (ticker) DO UPDATE SET
+            datetime = EXCLUDED.datetime,
+            state = EXCLUDED.state;
             """
-        cursor.execute(create_table_query)
-        
-        # Insert data into the table
-        for _, row in df.iterrows():
-            if table_name == SIGNALS_TABLE_NAME:
-                insert_query = f"""
-                INSERT INTO {table_name} (datetime, ticker, trend)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (datetime, ticker) DO UPDATE SET
-                trend = EXCLUDED.trend;
-                """
-                cursor.execute(insert_query, (row['datetime'], row['ticker'], row['trend']))
-            else:
-                insert_query = f"""
-                INSERT INTO {table_name} (datetime, ticker, open, high, low, close, volume, 
-                                        ema_10, ema_20, ema_50, adx, plus_di, minus_di, trend)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ON CONFLICT (datetime, ticker) DO UPDATE SET
-                open = EXCLUDED.open,
-                high = EXCLUDED.high,
-                low = EXCLUDED.low,
-                close = EXCLUDED.close,
-                volume = EXCLUDED.volume,
-                ema_10 = EXCLUDED.ema_10,
-                ema_20 = EXCLUDED.ema_20,
-                ema_50 = EXCLUDED.ema_50,
-                adx = EXCLUDED.adx,
-                plus_di = EXCLUDED.plus_di,
-                minus_di = EXCLUDED.minus_di,
-                trend = EXCLUDED.trend;
-                """
-                cursor.execute(insert_query, tuple(row))
-        
-        # Commit the transaction
-        connection.commit()
+            tickers = set(tickers)
+            psycopg2.extras.execute_batch(cursor, upsert_query, [record for record in engine.to_records() if record[0] in tickers])
+
+    except psycopg2.Error as e:
+        print(f"Error writing indicator state to PostgreSQL database: {e}")
+
+def write_data_to_db(df, table_name, columns=None, full_rebuild=False):
+    """Upsert the bars newer than the table's per-ticker high-water mark into the specified table.
+
+    With full_rebuild=True this strategy's columns are dropped and recreated first and every row is written. The
+    columns go for every ticker, so the checkpoints of every ticker go with them in the same transaction, and tickers
+    the run does not write are read from their first bar by the next run.
+
+    Returns:
+    bool: Whether the rows were committed; a failed write is reported and leaves the table unchanged.
+    """
+    try:
+        with transaction() as cursor:
+            # Keep the table permanent; it is shared with the mean reversion strategy, so a full
+            # rebuild only recreates this strategy's columns
+            column_types = SIGNAL_COLUMN_TYPES if table_name == SIGNALS_TABLE_NAME else INDICATOR_COLUMN_TYPES
+            if columns is None:
+                columns = list(column_types)
+            rebuild_columns = ['trend'] if table_name == SIGNALS_TABLE_NAME else TREND_COLUMNS
+            ensure_table(cursor, table_name, column_types, rebuild=full_rebuild, rebuild_columns=rebuild_columns)
+            if full_rebuild:
+                ensure_state_table(cursor)
+                cursor.execute(f"DELETE FROM {STATE_TABLE_NAME};")
+            
+            # Skip bars this strategy has already written; the mean reversion strategy shares the tables
+            if not full_rebuild:
+                df = rows_after_high_water_marks(df, fetch_high_water_marks(cursor, table_name, marker_column='trend', tickers=df['ticker'].unique().tolist()))
+            
+            # Bulk load the rows through COPY and merge them in one upsert
+            copy_upsert(cursor, df.rename(columns=DI_COLUMN_NAMES), table_name, columns)
+        return True
 
     except psycopg2.Error as e:
         print(f"Error writing data to PostgreSQL database: {e}")
-    finally:
-        # Close the cursor and connection
-        if 'cursor' in locals():
-            cursor.close()
-        if 'connection' in locals():
-            connection.close()
+        return False
 
 # Example usage
 if __name__ == "__main__":
-    # Query for a specific ticker, e.g., 'AAPL'
-    ticker = 'AAPL'
-    minute_query = f"SELECT * FROM {MINUTE_TABLE_NAME} WHERE ticker = '{ticker}';"
+    parser = argparse.ArgumentParser(description="Compute minute EMA/ADX trend signals and upsert them into the database.")
+    parser.add_argument('--full-rebuild', action='store_true',
+                        help="Drop and recreate the trend following columns and rewrite every bar, e.g. after a schema change")
+    parser.add_argument('--tickers', nargs='+', default=['AAPL'],
+                        help="Tickers to process, e.g. --tickers AAPL MSFT")
+    parser.add_argument('--all-tickers', action='store_true',
+                        help="Process every ticker in the bars table instead of --tickers, without plots")
+    parser.add_argument('--frequency', choices=['1m', *ROLLUP_INTERVALS], default='1m',
+                        help="Bar frequency; anything but 1m reads the continuous aggregate of the minute bars")
+    args = parser.parse_args()
+    
+    bars_table_name = rollup_table_name(MINUTE_TABLE_NAME, args.frequency)
+    if args.frequency != '1m':
+        # Keep the results of rolled-up bars apart from the minute tables
+        INDICATORS_TABLE_NAME = f"ticker_{args.frequency}_indicators"
+        SIGNALS_TABLE_NAME = f"ticker_{args.frequency}_signals"
+        STATE_TABLE_NAME = f"ticker_{args.frequency}_indicator_state"
     
-    minute_data = fetch_data_from_db(minute_query)
+    # Resume from the checkpointed indicator state so only bars after it are fetched; a full
+    # rebuild recomputes every bar from an empty state
+    engine = IncrementalIndicatorEngine() if args.full_rebuild else fetch_indicator_state()
+    conditions = []
+    params = []
+    if not args.all_tickers:
+        conditions.append("bars.ticker = ANY(%s)")
+        params.append(args.tickers)
+    state_join = ""
+    if not args.full_rebuild:
+        # Tickers without a checkpoint have no state row and are read from their first bar
+        state_join = f"LEFT JOIN {STATE_TABLE_NAME} AS state ON state.ticker = bars.ticker"
+        conditions.append("(state.datetime IS NULL OR bars.datetime > state.datetime)")
+    if args.frequency != '1m':
+        # Leave the bucket that is still being filled for a later run, the checkpoint would freeze it
+        conditions.append(f"bars.datetime + INTERVAL '{ROLLUP_INTERVALS[args.frequency]}' <= (SELECT MAX(datetime) FROM {MINUTE_TABLE_NAME})")
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    # Stream the new bars one ticker at a time so memory is bounded by the largest ticker, not the table
+    minute_query = f"""
+    SELECT bars.* FROM {bars_table_name} AS bars
+    {state_join}
+    {where_clause}
+    ORDER BY bars.ticker, bars.datetime;
+    """
+    # Only the first ticker rebuilds the tables, later tickers must keep the rows written before them
+    rebuild_indicators = rebuild_signals = args.full_rebuild
+    failed_tickers = []
+    written_tickers = []
     
-    if minute_data is not None:
+    for ticker, minute_data in stream_data_from_db(minute_query, params):
         print(f"Minute Data for {ticker}:")
         print(minute_data)
-        # Compute EMAs for minute data
-        minute_data_with_ema_10 = compute_ema(minute_data, span=10)
-        minute_data_with_ema_20 = compute_ema(minute_data_with_ema_10, span=20)
-        minute_data_with_ema_50 = compute_ema(minute_data_with_ema_20, span=50)
-        # Compute ADX for minute data
-        minute_data_with_adx = compute_adx(minute_data_with_ema_50)
+        # Compute EMAs (10, 20, 50) and ADX for the new bars, continuing from the stored state
+        minute_data_with_adx = engine.update_frame(minute_data)
         # Generate trend signals
         minute_data_with_signals = generate_trend_signals(minute_data_with_adx)
         print(f"Minute Data with EMAs, ADX, and Trend Signals for {ticker}:")
         print(minute_data_with_signals)
-        # Plot minute data with EMAs and trend signals
-        plot_data_with_ema(minute_data_with_signals, f"Minute Data with EMAs and Trends for {ticker}")
-        # Plot ADX separately
-        plot_adx(minute_data_with_signals, f"ADX and DI for {ticker}")
+        if not args.all_tickers:
+            # Plot minute data with EMAs and trend signals
+            plot_data_with_ema(minute_data_with_signals, f"Minute Data with EMAs and Trends for {ticker}")
+            # Plot ADX separately
+            plot_adx(minute_data_with_signals, f"ADX and DI for {ticker}")
         # Write the data with EMAs, ADX, and trend signals back to the database
-        write_data_to_db(minute_data_with_signals, INDICATORS_TABLE_NAME)
+        indicators_written = write_data_to_db(minute_data_with_signals, INDICATORS_TABLE_NAME, full_rebuild=rebuild_indicators)
         # Write only the ticker, datetime, and trend to the signals table
         signals_data = minute_data_with_signals[['datetime', 'ticker', 'trend']]
-        write_data_to_db(signals_data, SIGNALS_TABLE_NAME)
\ No newline at end of file
+        signals_written = write_data_to_db(signals_data, SIGNALS_TABLE_NAME, full_rebuild=rebuild_signals)
+        # A table is rebuilt by the first write that commits
+        rebuild_indicators = rebuild_indicators and not indicators_written
+        rebuild_signals = rebuild_signals and not signals_written
+        if not (indicators_written and signals_written):
+            failed_tickers.append(ticker)
+        else:
+            written_tickers.append(ticker)
+    
+    if written_tickers:
+        # Checkpoint the indicator state for the next run, only of the tickers whose rows were committed: the
+        # next run reads the bars after the checkpoint, so a checkpoint past unwritten rows would skip them for good
+        write_indicator_state(engine, written_tickers)
+    elif not failed_tickers:
+        print("No new minute data since the last checkpoint.")
+    if failed_tickers:
+        print(f"Writing failed for {', '.join(failed_tickers)}; their bars are computed again by the next run.")
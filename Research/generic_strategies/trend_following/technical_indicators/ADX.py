@@ -1,3 +1,26 @@
+import numpy as np
+import pandas as pd
+from indicators.panel import ewm_columns, shift_columns
+
+
+def _grouped_ewm(tickers, columns, span):
+    """
+    Apply an EMA with adjust=False to each column within every ticker, in a single grouped pass.
+
+    Parameters:
+    tickers (np.ndarray): Ticker label of each row.
+    columns (dict): Mapping of column name to a float array aligned with `tickers`.
+    span (int): The span for the EMA calculation.
+
+    Returns:
+    pd.DataFrame: Smoothed columns, positionally aligned with the input arrays.
+    """
+    frame = pd.DataFrame(columns)
+    frame['ticker'] = tickers
+    smoothed = frame.groupby('ticker', sort=False)[list(columns)].ewm(span=span, adjust=False).mean()
+    return smoothed.reset_index(level=0, drop=True).reindex(frame.index)
+
+
 def compute_adx(df, span=14):
     """
     Compute the Average Directional Index (ADX) for each ticker in a specified window.
@@ -12,31 +35,79 @@ def compute_adx(df, span=14):
     # Ensure the DataFrame is sorted by datetime
     df = df.sort_values(by='datetime')
 
-    # Calculate True Range (TR)
-    df['prev_close'] = df.groupby('ticker')['close'].shift(1)
-    df['high_low'] = df['high'] - df['low']
-    df['high_prev_close'] = (df['high'] - df['prev_close']).abs()
-    df['low_prev_close'] = (df['low'] - df['prev_close']).abs()
-    df['tr'] = df[['high_low', 'high_prev_close', 'low_prev_close']].max(axis=1)
-
-    # Calculate Directional Movement (+DM, -DM)
-    df['prev_high'] = df.groupby('ticker')['high'].shift(1)
-    df['prev_low'] = df.groupby('ticker')['low'].shift(1)
-    df['+dm'] = df['high'] - df['prev_high']
-    df['-dm'] = df['prev_low'] - df['low']
-    df['+dm'] = df.apply(lambda row: row['+dm'] if row['+dm'] > row['-dm'] and row['+dm'] > 0 else 0, axis=1)
-    df['-dm'] = df.apply(lambda row: row['-dm'] if row['-dm'] > row['+dm'] and row['-dm'] > 0 else 0, axis=1)
+    tickers = df['ticker'].to_numpy()
+    high = df['high'].to_numpy(dtype=float)
+    low = df['low'].to_numpy(dtype=float)
+    grouped = df.groupby('ticker', sort=False)
+    prev_close = grouped['close'].shift(1).to_numpy(dtype=float)
+    prev_high = grouped['high'].shift(1).to_numpy(dtype=float)
+    prev_low = grouped['low'].shift(1).to_numpy(dtype=float)
+
+    # Calculate True Range (TR); the first bar of each ticker has no previous close
+    high_low = high - low
+    high_prev_close = np.abs(high - prev_close)
+    low_prev_close = np.abs(low - prev_close)
+    tr = np.fmax(high_low, np.fmax(high_prev_close, low_prev_close))
+
+    # Calculate Directional Movement (+DM, -DM). -DM is compared against the already
+    # filtered +DM, exactly as the original row-wise implementation did.
+    up_move = high - prev_high
+    down_move = prev_low - low
+    with np.errstate(invalid='ignore'):
+        plus_dm = np.where((up_move > down_move) & (up_move > 0), up_move, 0.0)
+        minus_dm = np.where((down_move > plus_dm) & (down_move > 0), down_move, 0.0)
 
     # Calculate smoothed TR, +DM, -DM
-    df['atr'] = df.groupby('ticker')['tr'].transform(lambda x: x.ewm(span=span, adjust=False).mean())
-    df['+di'] = 100 * df.groupby('ticker')['+dm'].transform(lambda x: x.ewm(span=span, adjust=False).mean()) / df['atr']
-    df['-di'] = 100 * df.groupby('ticker')['-dm'].transform(lambda x: x.ewm(span=span, adjust=False).mean()) / df['atr']
+    smoothed = _grouped_ewm(tickers, {'tr': tr, '+dm': plus_dm, '-dm': minus_dm}, span)
+    atr = smoothed['tr'].to_numpy()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        plus_di = 100 * smoothed['+dm'].to_numpy() / atr
+        minus_di = 100 * smoothed['-dm'].to_numpy() / atr
 
-    # Calculate DX and ADX
-    df['dx'] = (abs(df['+di'] - df['-di']) / (df['+di'] + df['-di'])) * 100
-    df['adx'] = df.groupby('ticker')['dx'].transform(lambda x: x.ewm(span=span, adjust=False).mean())
+        # Calculate DX and ADX
+        dx = (np.abs(plus_di - minus_di) / (plus_di + minus_di)) * 100
+    adx = _grouped_ewm(tickers, {'dx': dx}, span)['dx'].to_numpy()
 
-    # Drop intermediate columns
-    df.drop(['prev_close', 'high_low', 'high_prev_close', 'low_prev_close', 'tr', 'prev_high', 'prev_low', '+dm', '-dm', 'atr', 'dx'], axis=1, inplace=True)
+    df['+di'] = plus_di
+    df['-di'] = minus_di
+    df['adx'] = adx
 
     return df
+
+
+def compute_adx_panel(panel, span=14):
+    """
+    Compute the Average Directional Index (ADX) of every ticker column of a panel.
+
+    Parameters:
+    panel (Panel): Bars pivoted into time x ticker arrays, with 'high', 'low' and 'close' fields.
+    span (int): The span for the ADX calculation.
+
+    Returns:
+    dict: Time x ticker arrays keyed '+di', '-di' and 'adx', NaN where the ticker has no bar.
+    """
+    # In the packed layout the previous row of a column is that ticker's previous bar
+    high = panel.pack(panel.fields['high'])
+    low = panel.pack(panel.fields['low'])
+    close = panel.pack(panel.fields['close'])
+    prev_close = shift_columns(close)
+    prev_high = shift_columns(high)
+    prev_low = shift_columns(low)
+
+    # Calculate True Range (TR) and Directional Movement (+DM, -DM) as in compute_adx
+    tr = np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+    up_move = high - prev_high
+    down_move = prev_low - low
+    with np.errstate(invalid='ignore'):
+        plus_dm = np.where((up_move > down_move) & (up_move > 0), up_move, 0.0)
+        minus_dm = np.where((down_move > plus_dm) & (down_move > 0), down_move, 0.0)
+
+    # Calculate smoothed TR, +DM, -DM, then DX and ADX
+    atr = ewm_columns(tr, span)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        plus_di = 100 * ewm_columns(plus_dm, span) / atr
+        minus_di = 100 * ewm_columns(minus_dm, span) / atr
+        dx = (np.abs(plus_di - minus_di) / (plus_di + minus_di)) * 100
+    adx = ewm_columns(dx, span)
+
+    return {'+di': panel.unpack(plus_di), '-di': panel.unpack(minus_di), 'adx': panel.unpack(adx)}
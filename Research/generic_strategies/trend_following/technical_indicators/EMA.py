@@ -1,3 +1,61 @@
+import numpy as np
+import pandas as pd
+from indicators.panel import ewm_columns
+
+
+def ticker_blocks(tickers):
+    """
+    Group rows into contiguous per-ticker blocks without reordering rows within a ticker.
+
+    Parameters:
+    tickers (array-like): Ticker label of each row.
+
+    Returns:
+    tuple: (order, starts, ends) where order[starts[i]:ends[i]] are the row positions of the i-th ticker.
+    """
+    codes, _ = pd.factorize(np.asarray(tickers))
+    order = np.argsort(codes, kind='stable')
+    boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(order)]))
+    return order, starts, ends
+
+
+def compute_emas(df, spans=(10, 20, 50)):
+    """
+    Compute the Exponential Moving Average (EMA) for each ticker for several spans at once.
+
+    The frame is sorted and split into per-ticker blocks a single time; every span is then filled
+    while visiting each ticker's contiguous block once, instead of re-sorting and re-grouping the
+    frame per span.
+
+    Parameters:
+    df (pd.DataFrame): DataFrame containing columns ['datetime', 'ticker', 'open', 'high', 'low', 'close', 'volume']
+    spans (iterable): The spans for the EMA calculation.
+
+    Returns:
+    pd.DataFrame: DataFrame with an additional column per span representing the EMA for each ticker, named 'ema_<span>'.
+    """
+    # Ensure the DataFrame is sorted by datetime
+    df = df.sort_values(by='datetime')
+
+    spans = list(spans)
+    order, starts, ends = ticker_blocks(df['ticker'])
+    close = df['close'].to_numpy(dtype=float)[order]
+    emas = {span: np.empty(len(close)) for span in spans}
+
+    # Fill every span from one pass over each ticker's block of close prices
+    for start, end in zip(starts, ends):
+        block = pd.Series(close[start:end])
+        for span in spans:
+            emas[span][order[start:end]] = block.ewm(span=span, adjust=False).mean().to_numpy()
+
+    for span in spans:
+        df[f'ema_{span}'] = emas[span]
+
+    return df
+
+
 def compute_ema(df, span=14):
     """
     Compute the Exponential Moving Average (EMA) for each ticker in a specified window.
@@ -9,13 +67,19 @@ def compute_ema(df, span=14):
     Returns:
     pd.DataFrame: DataFrame with an additional column representing the EMA for each ticker, named 'ema_<span>'.
     """
-    # Ensure the DataFrame is sorted by datetime
-    df = df.sort_values(by='datetime')
+    return compute_emas(df, spans=[span])
 
-    # Define the column name based on the span
-    ema_column_name = f'ema_{span}'
 
-    # Group by ticker and calculate the EMA for the 'close' price
-    df[ema_column_name] = df.groupby('ticker')['close'].transform(lambda x: x.ewm(span=span, adjust=False).mean())
+def compute_emas_panel(panel, spans=(10, 20, 50)):
+    """
+    Compute the Exponential Moving Average (EMA) of every ticker column of a panel.
 
-    return df
+    Parameters:
+    panel (Panel): Bars pivoted into time x ticker arrays, with a 'close' field.
+    spans (iterable): The spans for the EMA calculation.
+
+    Returns:
+    dict: Time x ticker EMA arrays keyed 'ema_<span>', NaN where the ticker has no bar.
+    """
+    close = panel.pack(panel.fields['close'])
+    return {f'ema_{span}': panel.unpack(ewm_columns(close, span)) for span in spans}
@@ -0,0 +1,186 @@
+import json
+import math
+import numpy as np
+import pandas as pd
+
+
+def _ewm_update(state, value, span):
+    """
+    Advance an EMA (adjust=False) by one observation, mirroring pandas' ewm().mean() arithmetic.
+
+    Parameters:
+    state (list): Mutable [weighted, old_weight] pair; weighted is NaN until the first observation.
+    value (float): The new observation, NaN for a missing value.
+    span (int): The span for the EMA calculation.
+
+    Returns:
+    float: The smoothed value after this observation.
+    """
+    com = (span - 1) / 2
+    alpha = 1. / (1. + com)
+    weighted, old_weight = state
+    if weighted == weighted:
+        old_weight *= 1. - alpha
+        if value == value:
+            # pandas skips the update on constant series to avoid numerical noise
+            if weighted != value:
+                # adjust=False weights the new value by alpha, except that pandas' ewm kernel gives it 1 - old_weight
+                # when com == 1 (span 3), its update for irregularly spaced series. The two only differ after missing
+                # values, where old_weight has decayed below 1 - alpha, and the EMAs must match pandas there too
+                new_weight = 1. - old_weight if com == 1 else alpha
+                weighted = (old_weight * weighted + new_weight * value) / (old_weight + new_weight)
+            old_weight = 1.
+    elif value == value:
+        weighted = value
+    state[0], state[1] = weighted, old_weight
+    return weighted
+
+
+class IncrementalIndicatorEngine:
+    """
+    Stateful EMA/ADX calculator that updates each ticker in O(1) per new bar.
+
+    The values produced for every bar are identical to compute_ema followed by compute_adx
+    run over the ticker's full history, so a checkpointed engine can resume without replaying it.
+    """
+
+    def __init__(self, ema_spans=(10, 20, 50), adx_span=14, state=None):
+        self.ema_spans = tuple(ema_spans)
+        self.adx_span = adx_span
+        self.state = state if state is not None else {}
+
+    def last_datetime(self, ticker):
+        """Return the datetime of the last bar applied for a ticker, or None if it has no state."""
+        ticker_state = self.state.get(ticker)
+        return None if ticker_state is None else ticker_state['datetime']
+
+    def _new_ticker_state(self):
+        """Create the empty state for a ticker that has not seen any bars yet."""
+        ticker_state = {
+            'datetime': None,
+            'prev_high': math.nan,
+            'prev_low': math.nan,
+            'prev_close': math.nan,
+            'tr': [math.nan, 1.],
+            '+dm': [math.nan, 1.],
+            '-dm': [math.nan, 1.],
+            'adx': [math.nan, 1.],
+        }
+        for span in self.ema_spans:
+            ticker_state[f'ema_{span}'] = [math.nan, 1.]
+        return ticker_state
+
+    def update(self, ticker, datetime, high, low, close):
+        """
+        Apply one bar to a ticker's state.
+
+        Parameters:
+        ticker (str): The ticker symbol.
+        datetime: Timestamp of the bar; bars must arrive in increasing datetime order per ticker.
+        high, low, close (float): The bar prices.
+
+        Returns:
+        dict: The indicator values for this bar, keyed 'ema_<span>', '+di', '-di' and 'adx'.
+        """
+        ticker_state = self.state.get(ticker)
+        if ticker_state is None:
+            ticker_state = self.state[ticker] = self._new_ticker_state()
+        high, low, close = np.float64(high), np.float64(low), np.float64(close)
+
+        values = {}
+        for span in self.ema_spans:
+            values[f'ema_{span}'] = _ewm_update(ticker_state[f'ema_{span}'], close, span)
+
+        # True Range, falling back to high - low when there is no previous close
+        tr = np.fmax(high - low, np.fmax(abs(high - ticker_state['prev_close']), abs(low - ticker_state['prev_close'])))
+
+        # Directional Movement, with -DM compared against the filtered +DM as in compute_adx
+        up_move = high - ticker_state['prev_high']
+        down_move = ticker_state['prev_low'] - low
+        plus_dm = up_move if up_move > down_move and up_move > 0 else 0.
+        minus_dm = down_move if down_move > plus_dm and down_move > 0 else 0.
+
+        atr = np.float64(_ewm_update(ticker_state['tr'], tr, self.adx_span))
+        smoothed_plus_dm = _ewm_update(ticker_state['+dm'], plus_dm, self.adx_span)
+        smoothed_minus_dm = _ewm_update(ticker_state['-dm'], minus_dm, self.adx_span)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            plus_di = 100 * np.float64(smoothed_plus_dm) / atr
+            minus_di = 100 * np.float64(smoothed_minus_dm) / atr
+            dx = (abs(plus_di - minus_di) / (plus_di + minus_di)) * 100
+        values['+di'] = float(plus_di)
+        values['-di'] = float(minus_di)
+        values['adx'] = _ewm_update(ticker_state['adx'], float(dx), self.adx_span)
+
+        ticker_state['datetime'] = datetime
+        ticker_state['prev_high'] = float(high)
+        ticker_state['prev_low'] = float(low)
+        ticker_state['prev_close'] = float(close)
+        return values
+
+    def update_frame(self, df):
+        """
+        Apply every bar in a DataFrame that is newer than the ticker's stored state.
+
+        Parameters:
+        df (pd.DataFrame): DataFrame containing columns ['datetime', 'ticker', 'open', 'high', 'low', 'close', 'volume']
+
+        Returns:
+        pd.DataFrame: The bars that were applied, sorted by datetime, with the EMA, +DI, -DI and ADX columns added.
+        """
+        df = df.sort_values(by='datetime')
+        last_datetimes = df['ticker'].map(lambda ticker: self.last_datetime(ticker))
+        is_new = last_datetimes.isna() | (pd.to_datetime(df['datetime']) > pd.to_datetime(last_datetimes))
+        df = df[is_new.to_numpy()].copy()
+
+        columns = [f'ema_{span}' for span in self.ema_spans] + ['+di', '-di', 'adx']
+        rows = [
+            self.update(ticker, datetime, high, low, close)
+            for ticker, datetime, high, low, close in zip(
+                df['ticker'], df['datetime'], df['high'], df['low'], df['close'])
+        ]
+        for column in columns:
+            df[column] = np.array([row[column] for row in rows], dtype=float)
+        return df
+
+    def to_records(self):
+        """
+        Serialise the engine state for checkpointing.
+
+        Returns:
+        list: (ticker, datetime, state_json) tuples; NaN values are stored as JSON null.
+        """
+        records = []
+        for ticker, ticker_state in self.state.items():
+            payload = {key: value for key, value in ticker_state.items() if key != 'datetime'}
+            payload = json.loads(json.dumps(payload), parse_constant=lambda constant: None)
+            records.append((ticker, ticker_state['datetime'], json.dumps(payload)))
+        return records
+
+    @classmethod
+    def from_records(cls, records, ema_spans=(10, 20, 50), adx_span=14):
+        """
+        Rebuild an engine from checkpoint records produced by to_records.
+
+        Parameters:
+        records (iterable): (ticker, datetime, state) tuples, where state is a JSON string or an already decoded dict.
+        ema_spans (tuple): The EMA spans the checkpoint was produced with.
+        adx_span (int): The ADX span the checkpoint was produced with.
+
+        Returns:
+        IncrementalIndicatorEngine: The restored engine.
+        """
+        def restore(value):
+            if value is None:
+                return math.nan
+            if isinstance(value, list):
+                return [restore(item) for item in value]
+            return value
+
+        state = {}
+        for ticker, datetime, payload in records:
+            if isinstance(payload, str):
+                payload = json.loads(payload)
+            ticker_state = {key: restore(value) for key, value in payload.items()}
+            ticker_state['datetime'] = datetime
+            state[ticker] = ticker_state
+        return cls(ema_spans=ema_spans, adx_span=adx_span, state=state)
@@ -0,0 +1 @@
+"""Indicator building blocks shared by the strategies, such as the time x ticker bar panel."""
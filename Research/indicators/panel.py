@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+
+
+class Panel:
+    """
+    Bars pivoted into contiguous time x ticker float arrays.
+
+    Rows follow the sorted `times` index and columns the `tickers` index. `present` marks the cells
+    that hold a bar; every other cell is NaN. Kernels that need each ticker's own bar sequence work
+    on the packed layout, where every column's present bars are moved to the top in time order, so
+    the previous row is always the ticker's previous bar regardless of gaps in the time index.
+    """
+
+    def __init__(self, times, tickers, fields, present, dtypes=None):
+        self.times = times
+        self.tickers = tickers
+        self.fields = fields
+        self.present = present
+        self.dtypes = dtypes if dtypes is not None else {}
+        # Stable sort puts present cells first in every column without changing their order
+        self._pack_order = np.argsort(~present, axis=0, kind='stable')
+        self._packed_present = np.arange(len(times))[:, None] < present.sum(axis=0)[None, :]
+
+    @classmethod
+    def from_long(cls, df, fields=('open', 'high', 'low', 'close', 'volume')):
+        """
+        Pivot a long DataFrame keyed by ['datetime', 'ticker'] into a panel.
+
+        Parameters:
+        df (pd.DataFrame): DataFrame containing columns ['datetime', 'ticker'] and the requested fields.
+        fields (iterable): The columns to pivot into time x ticker arrays.
+
+        Returns:
+        Panel: The pivoted bars.
+        """
+        fields = [field for field in fields if field in df.columns]
+        time_codes, times = pd.factorize(pd.to_datetime(df['datetime']), sort=True)
+        ticker_codes, tickers = pd.factorize(df['ticker'], sort=True)
+        shape = (len(times), len(tickers))
+
+        present = np.zeros(shape, dtype=bool)
+        present[time_codes, ticker_codes] = True
+        values = {}
+        for field in fields:
+            values[field] = np.full(shape, np.nan)
+            values[field][time_codes, ticker_codes] = df[field].to_numpy(dtype=float)
+        dtypes = {field: df[field].dtype for field in fields}
+        return cls(np.asarray(times), np.asarray(tickers), values, present, dtypes)
+
+    @classmethod
+    def from_ticker_arrays(cls, ticker_arrays, fields=('open', 'high', 'low', 'close', 'volume')):
+        """
+        Build a panel straight from per-ticker column arrays, such as the memory-mapped files of the bar store.
+
+        Each array is read once into its panel column, without building a long DataFrame first.
+
+        Parameters:
+        ticker_arrays (dict): For every ticker, a dict of equal-length arrays with 'datetime' in ascending order
+                              and the requested fields, e.g. from local_store.bar_store.open_ticker_arrays.
+        fields (iterable): The columns to place into time x ticker arrays.
+
+        Returns:
+        Panel: The bars.
+        """
+        tickers = np.array(sorted(ticker_arrays), dtype=object)
+        fields = [field for field in fields if all(field in arrays for arrays in ticker_arrays.values())]
+        datetimes = [np.asarray(ticker_arrays[ticker]['datetime']) for ticker in tickers]
+        times = np.unique(np.concatenate(datetimes)) if datetimes else np.array([], dtype='datetime64[us]')
+        shape = (len(times), len(tickers))
+
+        present = np.zeros(shape, dtype=bool)
+        values = {field: np.full(shape, np.nan) for field in fields}
+        for column, ticker in enumerate(tickers):
+            rows = np.searchsorted(times, ticker_arrays[ticker]['datetime'])
+            present[rows, column] = True
+            for field in fields:
+                values[field][rows, column] = ticker_arrays[ticker][field]
+        dtypes = {field: ticker_arrays[tickers[0]][field].dtype for field in fields} if len(tickers) else {}
+        return cls(times, tickers, values, present, dtypes)
+
+    def to_long(self, columns=None):
+        """
+        Convert the panel back to the long format, one row per present (datetime, ticker) cell.
+
+        Parameters:
+        columns (dict): Extra time x ticker arrays to include, keyed by output column name.
+
+        Returns:
+        pd.DataFrame: Rows sorted by datetime then ticker, with 'datetime', 'ticker', the panel fields and the extra columns.
+        """
+        time_index, ticker_index = np.nonzero(self.present)
+        df = pd.DataFrame({'datetime': self.times[time_index], 'ticker': self.tickers[ticker_index]})
+        for name, values in list(self.fields.items()) + list((columns or {}).items()):
+            df[name] = values[time_index, ticker_index]
+            dtype = self.dtypes.get(name)
+            if dtype is not None and pd.api.types.is_integer_dtype(dtype) and not df[name].isna().any():
+                df[name] = df[name].astype(dtype)
+        return df
+
+    def pack(self, values):
+        """Move each column's present cells to the top, in time order, padding the rest with NaN."""
+        packed = np.take_along_axis(values, self._pack_order, axis=0)
+        packed[~self._packed_present] = np.nan
+        return packed
+
+    def unpack(self, packed):
+        """Inverse of pack: return packed values to their time rows, with NaN where no bar is present."""
+        values = np.full(packed.shape, np.nan)
+        np.put_along_axis(values, self._pack_order, packed, axis=0)
+        values[~self.present] = np.nan
+        return values
+
+
+def ewm_columns(packed, span):
+    """
+    Apply an EMA (adjust=False) down every column of a packed array in a single call.
+
+    Parameters:
+    packed (np.ndarray): Packed time x ticker values, as returned by Panel.pack.
+    span (int): The span for the EMA calculation.
+
+    Returns:
+    np.ndarray: The smoothed values in the packed layout.
+    """
+    return pd.DataFrame(packed).ewm(span=span, adjust=False).mean().to_numpy()
+
+
+def shift_columns(packed, periods=1):
+    """Shift every column of a packed array down by `periods` rows, filling the top with NaN."""
+    shifted = np.full(packed.shape, np.nan)
+    shifted[periods:] = packed[:-periods]
+    return shifted
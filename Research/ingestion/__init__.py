@@ -0,0 +1 @@
+"""Shared helpers of the market data ingestion scripts."""
@@ -0,0 +1,422 @@
+import argparse
+import importlib
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+import pandas as pd
+from psycopg2 import extras
+from db.bulk import copy_upsert
+from db.connection import transaction
+from db.schema import ensure_table
+from ingestion.rate_limit import call_with_retry, classify_yfinance_error, quota_usage, rate_limiter
+from ingestion.runner import INGESTION_WORKERS, SOURCE_CONCURRENCY, source_semaphore
+from ingestion.spool import BAR_COLUMNS
+from ingestion.timeutil import to_utc
+
+# The days of bars one chunk requests, per source and bar frequency: a month of minute bars (a week for
+# yfinance, which serves at most 7 days of minute bars per request) and ten years of daily bars
+BACKFILL_CHUNK_DAYS = {
+    ('alpaca', 'minute'): int(os.environ.get("BACKFILL_ALPACA_MINUTE_CHUNK_DAYS", "30")),
+    ('alpaca', 'daily'): int(os.environ.get("BACKFILL_ALPACA_DAILY_CHUNK_DAYS", "3650")),
+    ('yfinance', 'minute'): int(os.environ.get("BACKFILL_YFINANCE_MINUTE_CHUNK_DAYS", "7")),
+    ('yfinance', 'daily'): int(os.environ.get("BACKFILL_YFINANCE_DAILY_CHUNK_DAYS", "3650")),
+    ('ibkr', 'minute'): int(os.environ.get("BACKFILL_IBKR_MINUTE_CHUNK_DAYS", "30")),
+    ('ibkr', 'daily'): int(os.environ.get("BACKFILL_IBKR_DAILY_CHUNK_DAYS", "3650")),
+}
+# Yahoo Finance only serves minute bars of the last 30 days
+YFINANCE_MINUTE_HISTORY = pd.Timedelta(days=29)
+# Completed chunks are loaded once their bars reach this many rows, or this many seconds after the last load
+BACKFILL_LOAD_ROWS = int(os.environ.get("BACKFILL_LOAD_ROWS", "200000"))
+BACKFILL_LOAD_SECONDS = float(os.environ.get("BACKFILL_LOAD_SECONDS", "10"))
+# Seconds between progress lines
+BACKFILL_PROGRESS_SECONDS = float(os.environ.get("BACKFILL_PROGRESS_SECONDS", "10"))
+
+# The progress of every chunk of every backfill job, so an interrupted job resumes at its first chunk not done
+BACKFILL_TABLE_NAME = "backfill_chunks"
+BACKFILL_COLUMN_TYPES = {
+    'ticker': 'VARCHAR(10)',
+    'job': 'TEXT',
+    'chunk_start': 'TIMESTAMP',
+    'chunk_end': 'TIMESTAMP',
+    'source': 'TEXT',
+    'table_name': 'TEXT',
+    'status': 'TEXT',
+    'rows': 'BIGINT',
+    'attempts': 'INTEGER',
+    'error': 'TEXT',
+    'fetch_seconds': 'DOUBLE PRECISION',
+    'updated_at': 'TIMESTAMP',
+}
+BACKFILL_KEY_COLUMNS = ('ticker', 'job', 'chunk_start')
+CHUNK_STATUS_COLUMNS = ['ticker', 'job', 'chunk_start', 'status', 'rows', 'attempts', 'error', 'fetch_seconds', 'updated_at']
+REPORT_COLUMNS = ['ticker', 'chunk_start', 'chunk_end', 'rows', 'fetch_seconds', 'error']
+FREQUENCIES = {'minute': {'alpaca': '1Min', 'yfinance': '1m', 'ibkr': '1 min'},
+               'daily': {'alpaca': '1Day', 'yfinance': '1d', 'ibkr': '1 day'}}
+
+
+def plan_chunks(tickers, start, end, chunk_days):
+    """
+    Split a backfill into chunks of one ticker and at most `chunk_days` days each.
+
+    The boundaries only depend on `start`, `end` and `chunk_days`, so planning the same job again gives
+    the same chunks.
+
+    Parameters:
+    tickers (list): The tickers to backfill.
+    start (datetime): The first bar time to fetch; naive datetimes are read as UTC.
+    end (datetime): The bar times to fetch are before it; naive datetimes are read as UTC.
+    chunk_days (int): The longest time range of a chunk, in days.
+
+    Returns:
+    pd.DataFrame: One row per chunk with 'ticker', 'chunk_start' and 'chunk_end' as naive UTC timestamps,
+                  ordered by time first so the backfill moves forward through the range for every ticker.
+    """
+    start, end = _naive_utc(start), _naive_utc(end)
+    if start >= end:
+        raise ValueError(f"The backfill starts at {start} and ends at {end}, expected a start before the end")
+    boundaries = list(pd.date_range(start, end, freq=pd.Timedelta(days=chunk_days)))
+    if boundaries[-1] < end:
+        boundaries.append(end)
+    windows = list(zip(boundaries[:-1], boundaries[1:]))
+    return pd.DataFrame([(ticker, chunk_start, chunk_end) for chunk_start, chunk_end in windows for ticker in tickers],
+                        columns=['ticker', 'chunk_start', 'chunk_end'])
+
+
+def ensure_backfill_table():
+    """Create the chunk progress table if needed."""
+    with transaction() as cursor:
+        ensure_table(cursor, BACKFILL_TABLE_NAME, BACKFILL_COLUMN_TYPES, BACKFILL_KEY_COLUMNS)
+
+
+def pending_chunks(job, source, table_name, chunks):
+    """
+    Record the planned chunks of a job and return the ones still to run.
+
+    Chunks already recorded keep their progress, so a job run again skips the chunks it has loaded.
+
+    Parameters:
+    job (str): The name of the backfill job.
+    source (str): The data source of the job.
+    table_name (str): The bars table the job loads into.
+    chunks (pd.DataFrame): The planned chunks, see plan_chunks.
+
+    Returns:
+    pd.DataFrame: The chunks not done yet, with their 'attempts' so far, in the order of `chunks`.
+    """
+    ensure_backfill_table()
+    with transaction() as cursor:
+        extras.execute_values(cursor, f"""
+        INSERT INTO {BACKFILL_TABLE_NAME} (ticker, job, chunk_start, chunk_end, source, table_name, status, rows, attempts)
+        VALUES %s
+        ON CONFLICT ({", ".join(BACKFILL_KEY_COLUMNS)}) DO NOTHING;
+        """, [(row.ticker, job, row.chunk_start.to_pydatetime(), row.chunk_end.to_pydatetime(), source, table_name, 'pending', 0, 0)
+              for row in chunks.itertuples(index=False)], page_size=1000)
+        cursor.execute(f"SELECT ticker, chunk_start, attempts FROM {BACKFILL_TABLE_NAME} WHERE job = %s AND status <> 'done';", (job,))
+        remaining = pd.DataFrame(cursor.fetchall(), columns=['ticker', 'chunk_start', 'attempts'])
+    remaining['chunk_start'] = pd.to_datetime(remaining['chunk_start'])
+    return chunks.merge(remaining, on=['ticker', 'chunk_start'])
+
+
+def job_progress(job):
+    """
+    Return the progress of a backfill job.
+
+    Parameters:
+    job (str): The name of the backfill job.
+
+    Returns:
+    pd.DataFrame: One row per chunk status with the number of chunks, their rows and their attempts.
+    """
+    with transaction() as cursor:
+        cursor.execute(f"""
+        SELECT status, COUNT(*), COALESCE(SUM(rows), 0), COALESCE(SUM(attempts), 0)
+        FROM {BACKFILL_TABLE_NAME} WHERE job = %s GROUP BY status ORDER BY status;
+        """, (job,))
+        return pd.DataFrame(cursor.fetchall(), columns=['status', 'chunks', 'rows', 'attempts'])
+
+
+def run_backfill(job, source, table_name, tickers, start, end, fetch, chunk_days, workers=INGESTION_WORKERS):
+    """
+    Backfill the bars of some tickers over a date range, in chunks fetched in parallel, resuming an earlier run of the job.
+
+    The range of every ticker is split into chunks (plan_chunks), and each chunk's progress is kept in
+    backfill_chunks under the job's name. Chunks are fetched on a pool of worker threads, at most the
+    source's cap at a time and through the source's rate limiter. A writer thread gathers the completed
+    chunks and loads them in large COPY upserts; every load marks its chunks done in the same transaction,
+    so a chunk is done exactly when its bars are in the table. A failed chunk is marked failed and does not
+    stop the backfill. Running the job again, after failures or an interruption, fetches only the chunks
+    not done. On KeyboardInterrupt the chunks not started are cancelled and the fetched ones are loaded
+    before the interrupt is raised again.
+
+    Parameters:
+    job (str): The name of the backfill job, keying its progress.
+    source (str): The data source, selecting the concurrency cap, e.g. 'alpaca'.
+    table_name (str): The bars table to load, which must exist.
+    tickers (list): The tickers to backfill.
+    start (datetime): The first bar time to fetch; naive datetimes are read as UTC.
+    end (datetime): The bar times to fetch are before it; naive datetimes are read as UTC.
+    fetch (callable): fetch(ticker, start, end) with UTC pd.Timestamps, returning the bars of the ticker as a
+                      DataFrame indexed by the UTC bar timestamp with the price, volume and 'ticker' columns.
+    chunk_days (int): The longest time range of a chunk, in days.
+    workers (int): The number of fetch threads.
+
+    Returns:
+    pd.DataFrame: One row per chunk run with the rows loaded, the fetch latency in seconds and any error.
+    """
+    chunks = plan_chunks(tickers, start, end, chunk_days)
+    remaining = pending_chunks(job, source, table_name, chunks)
+    print(f"Backfill {job}: {len(chunks)} chunks of {len(tickers)} tickers, {len(chunks) - len(remaining)} done already, "
+          f"{len(remaining)} to run")
+    semaphore = source_semaphore(source)
+    completed = queue.Queue(maxsize=max(1, workers) * 2)
+    results = []
+    totals = {'chunks': 0, 'failed': 0, 'rows': 0}
+    lock = threading.Lock()
+
+    def fetch_chunk(chunk):
+        # Time the request itself, not the wait for a free slot of the source
+        chunk_start, chunk_end = to_utc(chunk.chunk_start), to_utc(chunk.chunk_end)
+        with semaphore:
+            started = time.perf_counter()
+            try:
+                data = fetch(chunk.ticker, chunk_start, chunk_end)
+                bars = table_bars(data[(data.index >= chunk_start) & (data.index < chunk_end)])
+                error = None
+            except Exception as e:
+                bars, error = None, f"fetch failed: {e}"
+            fetch_seconds = time.perf_counter() - started
+        completed.put((chunk, bars, fetch_seconds, error))
+
+    def load_chunks(batch):
+        status = pd.DataFrame({
+            'ticker': [chunk.ticker for chunk, _, _, _ in batch],
+            'job': job,
+            'chunk_start': [chunk.chunk_start for chunk, _, _, _ in batch],
+            'status': ['failed' if error else 'done' for _, _, _, error in batch],
+            'rows': [0 if bars is None else len(bars) for _, bars, _, _ in batch],
+            'attempts': [chunk.attempts + 1 for chunk, _, _, _ in batch],
+            'error': [error for _, _, _, error in batch],
+            'fetch_seconds': [fetch_seconds for _, _, fetch_seconds, _ in batch],
+            'updated_at': datetime.now(timezone.utc).replace(tzinfo=None),
+        })
+        frames = [bars for _, bars, _, error in batch if error is None and not bars.empty]
+        try:
+            with transaction() as cursor:
+                if frames:
+                    copy_upsert(cursor, pd.concat(frames, ignore_index=True), table_name, BAR_COLUMNS)
+                copy_upsert(cursor, status, BACKFILL_TABLE_NAME, CHUNK_STATUS_COLUMNS, BACKFILL_KEY_COLUMNS)
+        except Exception as e:
+            # The chunks stay pending, to be fetched again by the next run of the job
+            status['error'] = f"load failed: {e}"
+            print(f"Backfill {job}: loading {len(batch)} chunks failed: {e}")
+        with lock:
+            for row in status.itertuples(index=False):
+                failed = pd.notna(row.error)
+                results.append({'ticker': row.ticker, 'chunk_start': row.chunk_start, 'rows': 0 if failed else row.rows,
+                                'fetch_seconds': row.fetch_seconds, 'error': row.error})
+                totals['chunks'] += 1
+                totals['failed'] += failed
+                totals['rows'] += 0 if failed else row.rows
+
+    def write_chunks():
+        batch, batch_rows, last_load = [], 0, time.monotonic()
+        while True:
+            try:
+                item = completed.get(timeout=1.0)
+            except queue.Empty:
+                item = False
+            if item:
+                batch.append(item)
+                batch_rows += 0 if item[1] is None else len(item[1])
+            if batch and (item is None or batch_rows >= BACKFILL_LOAD_ROWS or time.monotonic() - last_load >= BACKFILL_LOAD_SECONDS):
+                load_chunks(batch)
+                batch, batch_rows, last_load = [], 0, time.monotonic()
+            if item is None:
+                return
+
+    backfill_start = time.perf_counter()
+    writer = threading.Thread(target=write_chunks, name=f"{source}-backfill-writer", daemon=True)
+    writer.start()
+    executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=f"{source}-backfill")
+    try:
+        futures = [executor.submit(fetch_chunk, chunk) for chunk in remaining.itertuples(index=False)]
+        last_progress = time.perf_counter()
+        for future in as_completed(futures):
+            future.result()
+            if time.perf_counter() - last_progress >= BACKFILL_PROGRESS_SECONDS:
+                last_progress = time.perf_counter()
+                with lock:
+                    print_progress(job, totals, len(remaining), last_progress - backfill_start)
+    except KeyboardInterrupt:
+        print(f"Backfill {job}: interrupted, loading the chunks already fetched; run it again to resume")
+        raise
+    finally:
+        # Cancel the chunks not started and load the fetched ones before returning
+        executor.shutdown(wait=True, cancel_futures=True)
+        completed.put(None)
+        writer.join()
+
+    report = pd.DataFrame(results, columns=['ticker', 'chunk_start', 'rows', 'fetch_seconds', 'error'])
+    report = report.merge(remaining[['ticker', 'chunk_start', 'chunk_end']], on=['ticker', 'chunk_start'], how='left')[REPORT_COLUMNS]
+    print_backfill_report(job, source, report, len(chunks), time.perf_counter() - backfill_start)
+    return report
+
+
+def print_progress(job, totals, chunks, seconds):
+    """Print the chunks and bars loaded so far, the throughput and the time left at that pace."""
+    rate = totals['rows'] / seconds if seconds else 0.0
+    left = (chunks - totals['chunks']) * seconds / totals['chunks'] if totals['chunks'] else float('nan')
+    print(f"Backfill {job}: {totals['chunks']}/{chunks} chunks, {totals['failed']} failed, {totals['rows']:,} bars, "
+          f"{rate:,.0f} bars/s, about {left:.0f}s left")
+
+
+def print_backfill_report(job, source, report, planned_chunks, seconds):
+    """Print the failed chunks of a backfill run, followed by its totals, throughput and the quota use of its source."""
+    for row in report[report['error'].notna()].itertuples(index=False):
+        print(f"Backfill {job} {row.ticker} {row.chunk_start:%Y-%m-%d}..{row.chunk_end:%Y-%m-%d}: {row.error}")
+    rows = int(report['rows'].sum())
+    fetch_total = report['fetch_seconds'].sum()
+    print(f"Backfill {job}: {len(report)} of {planned_chunks} chunks run, {report['error'].notna().sum()} failed, "
+          f"{rows:,} bars in {seconds:.2f}s, {rows / seconds if seconds else 0:,.0f} bars/s "
+          f"({fetch_total:.2f}s of fetches, {fetch_total / seconds if seconds else 0:.1f}x overlap)")
+    for usage in quota_usage(source).itertuples(index=False):
+        limit = f" of {usage.limit_per_minute:.0f} ({usage.quota_used:.0%})" if pd.notna(usage.limit_per_minute) else ""
+        print(f"{source} {usage.endpoint} quota: {usage.requests_last_minute} requests in the last minute{limit}, "
+              f"{usage.throttled} throttled, {usage.retries} retried, {usage.failures} failed, {usage.waited_seconds:.1f}s waited")
+
+
+def table_bars(data):
+    """Turn fetched bars, indexed by their UTC timestamp, into the rows of a bars table, as the ingestion scripts store them."""
+    # yfinance capitalizes its columns; the table stores UTC datetimes without a time zone
+    data = data.rename(columns=str.lower)
+    return pd.DataFrame({
+        'datetime': data.index.tz_convert('UTC').tz_localize(None),
+        'ticker': data['ticker'].to_numpy(),
+        'open': data['open'].to_numpy(),
+        'high': data['high'].to_numpy(),
+        'low': data['low'].to_numpy(),
+        'close': data['close'].to_numpy(),
+        'volume': data['volume'].to_numpy(dtype='int64'),
+    }, columns=BAR_COLUMNS)
+
+
+def chunk_fetcher(source, frequency, client=None):
+    """
+    Return the fetch of a source for run_backfill.
+
+    Parameters:
+    source (str): 'alpaca', 'yfinance' or 'ibkr'.
+    frequency (str): 'minute' or 'daily'.
+    client: The AlpacaBarsClient or IBKRHistoricalClient the chunks are fetched with; unused for yfinance.
+
+    Returns:
+    callable: fetch(ticker, start, end) returning the bars of a ticker from start to before end.
+    """
+    bar_size = FREQUENCIES[frequency][source]
+    if source == 'alpaca':
+        # The bars endpoint includes its end; run_backfill drops the bars at the end of the chunk
+        return lambda ticker, start, end: client.get_bars([ticker], bar_size, start.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                                                          end.strftime('%Y-%m-%dT%H:%M:%SZ')).get(ticker, _empty_bars(ticker))
+    if source == 'ibkr':
+        return lambda ticker, start, end: client.fetch_bars(ticker, start, end, bar_size)
+
+    import yfinance as yf
+
+    def fetch_yfinance(ticker, start, end):
+        # Under the shared Yahoo Finance quota, retrying throttled and failed requests
+        data = call_with_retry(rate_limiter('yfinance', 'history'),
+                               lambda: yf.Ticker(ticker).history(interval=bar_size, start=start, end=end),
+                               classify=classify_yfinance_error)
+        if data.empty:
+            return _empty_bars(ticker)
+        data['ticker'] = ticker
+        return data
+    return fetch_yfinance
+
+
+def backfill_source(source, frequency, start, end=None, tickers=None, job=None, workers=INGESTION_WORKERS, chunk_days=None):
+    """
+    Backfill the minute or daily bars table of a source with the tickers of its tickers.csv.
+
+    Parameters:
+    source (str): 'alpaca', 'yfinance' or 'ibkr'.
+    frequency (str): 'minute' or 'daily'.
+    start (datetime): The first bar time to fetch; naive datetimes are read as UTC.
+    end (datetime): The bar times to fetch are before it; the start of today (UTC) when omitted.
+    tickers (list): The tickers to backfill; the source's tickers.csv when omitted.
+    job (str): The name of the backfill job; named after the table and the range when omitted, so running
+               the same command again resumes it.
+    workers (int): The number of fetch threads.
+    chunk_days (int): The longest time range of a chunk, in days; BACKFILL_CHUNK_DAYS when omitted.
+
+    Returns:
+    pd.DataFrame: The report of the run, see run_backfill.
+    """
+    # The ingestion scripts of the source hold its table, its schema and its client
+    from ingestion.daemon import RESEARCH_DIR, SOURCE_DIRECTORIES
+    source_dir = os.path.join(RESEARCH_DIR, SOURCE_DIRECTORIES[source])
+    if source_dir not in sys.path:
+        sys.path.insert(0, source_dir)
+    module = importlib.import_module(f"{source}_{frequency}_data_initialize")
+
+    start = _naive_utc(start)
+    end = _naive_utc(end) if end is not None else pd.Timestamp.now(tz='UTC').tz_localize(None).normalize()
+    if source == 'yfinance' and frequency == 'minute' and start < end - YFINANCE_MINUTE_HISTORY:
+        start = max(start, (pd.Timestamp.now(tz='UTC').tz_localize(None) - YFINANCE_MINUTE_HISTORY).normalize())
+        print(f"Yahoo Finance serves minute bars of the last 30 days only; backfilling from {start:%Y-%m-%d}")
+    tickers = tickers or module.get_tickers_from_csv(module.TICKERS_PATH)
+    job = job or f"{module.TABLE_NAME}_{start:%Y%m%d}_{end:%Y%m%d}"
+    module.ensure_bars_table(module.TABLE_NAME)
+
+    client = None
+    if source == 'alpaca':
+        client = module.AlpacaBarsClient(module.APCA_API_KEY_ID, module.APCA_API_SECRET_KEY, max_connections=SOURCE_CONCURRENCY['alpaca'])
+    elif source == 'ibkr':
+        client = module.IBKRHistoricalClient()
+    try:
+        return run_backfill(job, source, module.TABLE_NAME, tickers, start, end, chunk_fetcher(source, frequency, client),
+                            chunk_days or BACKFILL_CHUNK_DAYS[(source, frequency)], workers)
+    finally:
+        if source == 'ibkr':
+            client.close()
+
+
+def _empty_bars(ticker):
+    """The frame of a chunk without bars."""
+    data = pd.DataFrame(columns=['open', 'high', 'low', 'close', 'volume', 'ticker'], index=pd.DatetimeIndex([], tz='UTC'))
+    data['ticker'] = ticker
+    return data
+
+
+def _naive_utc(timestamp):
+    """Return a timestamp as a naive pd.Timestamp in UTC, as the tables store them."""
+    return to_utc(timestamp).tz_localize(None)
+
+
+# Example usage
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill years of bars of a source in parallel chunks, resuming an interrupted backfill.")
+    parser.add_argument('--source', choices=sorted(FREQUENCIES['minute']))
+    parser.add_argument('--frequency', default='minute', choices=sorted(FREQUENCIES))
+    parser.add_argument('--start', help="The first date to backfill, e.g. 2020-01-01")
+    parser.add_argument('--end', help="The date to backfill up to, excluded; today when omitted")
+    parser.add_argument('--tickers', nargs='+', help="The tickers to backfill; the source's tickers.csv when omitted")
+    parser.add_argument('--job', help="The name of the job to run or resume; named after the table and the dates when omitted")
+    parser.add_argument('--workers', type=int, default=INGESTION_WORKERS,
+                        help="Chunks fetched concurrently; requests are also capped by the source's INGESTION_*_CONCURRENCY")
+    parser.add_argument('--chunk-days', type=int, help="Days of bars per chunk; BACKFILL_<SOURCE>_<FREQUENCY>_CHUNK_DAYS when omitted")
+    parser.add_argument('--status', action='store_true', help="Print the progress of the job instead of running it")
+    args = parser.parse_args()
+
+    if args.status:
+        if not args.job:
+            parser.error("--status needs --job")
+        print(job_progress(args.job).to_string(index=False))
+    else:
+        if not args.source or not args.start:
+            parser.error("a backfill needs --source and --start")
+        backfill_source(args.source, args.frequency, args.start, args.end, args.tickers, args.job, args.workers, args.chunk_days)
@@ -0,0 +1,339 @@
+import argparse
+import asyncio
+import importlib
+import math
+import os
+import signal
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+from ingestion.rate_limit import backoff_seconds, quota_usage
+from ingestion.runner import SOURCE_CONCURRENCY
+from ingestion.spool import spool_usage
+
+# Minute passes start this many seconds after every minute, once the bars of the minute have closed
+MINUTE_INTERVAL_SECONDS = float(os.environ.get("INGESTION_MINUTE_INTERVAL_SECONDS", "60"))
+MINUTE_OFFSET_SECONDS = float(os.environ.get("INGESTION_MINUTE_OFFSET_SECONDS", "5"))
+# Daily passes run at this UTC time of day, and once when the daemon starts
+DAILY_AT = os.environ.get("INGESTION_DAILY_AT", "03:00")
+METRICS_PORT = int(os.environ.get("INGESTION_METRICS_PORT", "9108"))
+# A job or stream that raised is restarted with backoff, and counts as failing until it has run this long again
+SUPERVISOR_HEALTHY_SECONDS = float(os.environ.get("INGESTION_SUPERVISOR_HEALTHY_SECONDS", "300"))
+# The ingestion scripts of every source, next to this package
+RESEARCH_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_DIRECTORIES = {'alpaca': 'alpaca', 'yfinance': 'yfinance', 'ibkr': 'interactive_brokers'}
+
+
+class Job:
+    """
+    A pass run on a wall-clock cadence: every `interval` seconds, aligned to multiples of it since the epoch and
+    shifted by `offset` seconds, or daily at `daily_at` ('HH:MM', UTC). It also keeps the metrics of its passes.
+    """
+
+    def __init__(self, name, source, run, interval=None, offset=0.0, daily_at=None, run_at_start=False):
+        self.name = name
+        self.source = source
+        self.run = run
+        self.interval = interval
+        self.offset = offset
+        self.daily_at = daily_at
+        self.run_at_start = run_at_start
+        self.passes = 0
+        self.failures = 0
+        self.skipped = 0
+        self.rows = 0
+        self.running = False
+        self.last_duration = None
+        self.last_lag = None
+        self.last_started = None
+        self.last_succeeded = None
+        self.last_error = None
+
+    def next_run(self, now):
+        """Return the first scheduled time after `now`, both in seconds since the epoch."""
+        if self.interval:
+            return (math.floor((now - self.offset) / self.interval) + 1) * self.interval + self.offset
+        hour, minute = (int(part) for part in self.daily_at.split(':'))
+        today = datetime.fromtimestamp(now, timezone.utc).replace(hour=hour, minute=minute, second=0, microsecond=0)
+        return (today if today.timestamp() > now else today + timedelta(days=1)).timestamp()
+
+
+class IngestionDaemon:
+    """
+    Run ingestion jobs on their cadences in one long-running process.
+
+    Every job runs its passes one after the other on a worker thread, so two passes of the same job never
+    overlap; a pass running past the next scheduled times skips them and the job waits for the first time
+    after it finished, which keeps every job on its wall-clock grid. Jobs run concurrently with each other.
+    Streams, objects with async run() and stop() like AlpacaBarStream, run alongside the jobs until the daemon stops.
+    A job or stream that raises is restarted with backoff, without stopping the others, and counts as failing
+    until it has run SUPERVISOR_HEALTHY_SECONDS without raising again. The metrics of the jobs and streams are
+    served in the Prometheus text format at /metrics, and /health answers 200 once every job that runs at start
+    has finished its first pass and while nothing is failing; the ready file exists exactly then.
+    """
+
+    def __init__(self, jobs, metrics_port=METRICS_PORT, ready_file=None, streams=()):
+        self.jobs = jobs
+        self.streams = list(streams)
+        self.metrics_port = metrics_port
+        self.ready_file = ready_file
+        self.cleanups = []
+        self.server = None
+        self.failing = {}
+        self.restarts = {}
+        self._stopping = None
+        self._startup_pending = {job.name for job in jobs if job.run_at_start}
+
+    @property
+    def ready(self):
+        return not self._startup_pending
+
+    @property
+    def healthy(self):
+        return self.ready and not self.failing
+
+    async def run(self, duration=None):
+        """
+        Run the jobs until stop is called, SIGTERM or SIGINT arrives, or `duration` seconds have passed.
+
+        Passes still running when the daemon stops are waited for, so no pass is cut off halfway.
+        """
+        self._stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                # Not available off the main thread or on Windows; stop() still works
+                pass
+        if self.metrics_port is not None:
+            self.server = await asyncio.start_server(self._serve_metrics, '0.0.0.0', self.metrics_port)
+            self.metrics_port = self.server.sockets[0].getsockname()[1]
+            print(f"Serving ingestion metrics on port {self.metrics_port}")
+        if duration is not None:
+            loop.call_later(duration, self.stop)
+        self._mark_ready()
+        try:
+            await asyncio.gather(*(self._supervise(job.name, lambda job=job: self._run_job(job)) for job in self.jobs),
+                                 *(self._supervise(f"{stream.source}_stream", stream.run) for stream in self.streams))
+        finally:
+            if self.server is not None:
+                self.server.close()
+                await self.server.wait_closed()
+            for cleanup in self.cleanups:
+                cleanup()
+
+    def stop(self):
+        """Stop scheduling passes and close the streams; running passes finish first."""
+        if self._stopping is not None:
+            self._stopping.set()
+        for stream in self.streams:
+            stream.stop()
+
+    async def _supervise(self, name, run):
+        """Run a job or stream until the daemon stops, restarting it with backoff whenever it raises."""
+        attempt = 0
+        while not self._stopping.is_set():
+            task = asyncio.create_task(run())
+            if name in self.failing:
+                await asyncio.wait([task], timeout=SUPERVISOR_HEALTHY_SECONDS)
+                if not task.done():
+                    print(f"{name}: running again since its restart")
+                    del self.failing[name]
+                    attempt = 0
+                    self._mark_ready()
+            try:
+                await task
+                return
+            except Exception as e:
+                self.failing[name] = str(e)
+                self.restarts[name] = self.restarts.get(name, 0) + 1
+                self._mark_ready()
+                delay = backoff_seconds(attempt)
+                attempt += 1
+                print(f"{name}: failed ({type(e).__name__}: {e}), restarting in {delay:.1f}s")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run_job(self, job):
+        scheduled = time.time() if job.run_at_start else job.next_run(time.time())
+        while not self._stopping.is_set():
+            # Sleep until the scheduled time, waking up early only to stop
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=max(0.0, scheduled - time.time()))
+                return
+            except asyncio.TimeoutError:
+                pass
+            await self._run_pass(job, scheduled)
+            finished = time.time()
+            next_scheduled = job.next_run(finished)
+            if job.interval:
+                # Scheduled times that came and went while the pass ran
+                job.skipped += max(0, round((next_scheduled - scheduled) / job.interval) - 1)
+            scheduled = next_scheduled
+
+    async def _run_pass(self, job, scheduled):
+        job.running = True
+        job.last_started = time.time()
+        job.last_lag = job.last_started - scheduled
+        try:
+            report = await asyncio.to_thread(job.run)
+        except Exception as e:
+            job.failures += 1
+            job.last_error = str(e)
+            print(f"{job.name}: pass failed: {e}")
+        else:
+            job.last_succeeded = time.time()
+            job.last_error = None
+            if isinstance(report, pd.DataFrame) and 'rows' in report:
+                job.rows += int(report['rows'].sum())
+        finally:
+            job.running = False
+            job.passes += 1
+            job.last_duration = time.time() - job.last_started
+        print(f"{job.name}: pass took {job.last_duration:.2f}s, started {job.last_lag:.2f}s after its scheduled time")
+        self._startup_pending.discard(job.name)
+        self._mark_ready()
+
+    def _mark_ready(self):
+        if not self.ready_file:
+            return
+        if self.healthy and not os.path.exists(self.ready_file):
+            with open(self.ready_file, 'w'):
+                pass
+        elif not self.healthy and os.path.exists(self.ready_file):
+            os.remove(self.ready_file)
+
+    def metrics(self):
+        """Return the metrics of every job, stream, the spool and the rate limiters in the Prometheus text format."""
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                if value is not None and not pd.isna(value):
+                    label_text = ','.join(f'{key}="{label}"' for key, label in labels.items())
+                    lines.append(f"{name}{{{label_text}}} {value}")
+
+        jobs = [({'job': job.name, 'source': job.source}, job) for job in self.jobs]
+        metric('ingestion_pass_duration_seconds', 'gauge', "Duration of the last pass.", [(labels, job.last_duration) for labels, job in jobs])
+        metric('ingestion_pass_lag_seconds', 'gauge', "How late the last pass started after its scheduled time.", [(labels, job.last_lag) for labels, job in jobs])
+        metric('ingestion_pass_running', 'gauge', "1 while a pass of the job runs.", [(labels, int(job.running)) for labels, job in jobs])
+        metric('ingestion_last_success_timestamp_seconds', 'gauge', "When the last successful pass finished.", [(labels, job.last_succeeded) for labels, job in jobs])
+        metric('ingestion_passes_total', 'counter', "Passes run.", [(labels, job.passes) for labels, job in jobs])
+        metric('ingestion_pass_failures_total', 'counter', "Passes that raised.", [(labels, job.failures) for labels, job in jobs])
+        metric('ingestion_skipped_runs_total', 'counter', "Scheduled runs skipped because the previous pass was still running.", [(labels, job.skipped) for labels, job in jobs])
+        metric('ingestion_rows_total', 'counter', "Bars fetched.", [(labels, job.rows) for labels, job in jobs])
+        components = [({'component': name}, name) for name in [job.name for job in self.jobs] + [f"{stream.source}_stream" for stream in self.streams]]
+        metric('ingestion_component_failing', 'gauge', "1 while the job or stream is failing, from its last error until it has run without one.",
+               [(labels, int(name in self.failing)) for labels, name in components])
+        metric('ingestion_component_restarts_total', 'counter', "Restarts of the job or stream after it raised.",
+               [(labels, self.restarts.get(name, 0)) for labels, name in components])
+        streams = [({'source': stream.source}, stream.latency()) for stream in self.streams]
+        metric('ingestion_stream_bars_total', 'counter', "Streamed bars stored.", [(labels, latency['bars']) for labels, latency in streams])
+        metric('ingestion_stream_batches_total', 'counter', "Batches of streamed bars stored.", [(labels, latency['batches']) for labels, latency in streams])
+        metric('ingestion_stream_latency_seconds', 'gauge', "From the close of a streamed bar's minute to its batch being stored.",
+               [(dict(labels, quantile=quantile), latency[f'bar_close_to_stored_{column}'])
+                for labels, latency in streams for quantile, column in [('0.5', 'p50'), ('0.99', 'p99')]])
+        spool = [({'table': row.table}, row) for row in spool_usage().itertuples(index=False)]
+        metric('ingestion_spool_rows', 'gauge', "Bars spooled and not loaded into the table yet.", [(labels, row.spooled_rows) for labels, row in spool])
+        metric('ingestion_spool_loaded_rows_total', 'counter', "Spooled bars loaded into the table.", [(labels, row.loaded_rows) for labels, row in spool])
+        metric('ingestion_spool_load_failures_total', 'counter', "Loads of spooled bars that failed.", [(labels, row.load_failures) for labels, row in spool])
+        metric('ingestion_spool_rejected_segments_total', 'counter', "Spooled segments set aside after failing to load.", [(labels, row.rejected_segments) for labels, row in spool])
+        usage = [({'source': row.source, 'endpoint': row.endpoint}, row) for row in quota_usage().itertuples(index=False)]
+        metric('ingestion_quota_used_ratio', 'gauge', "Requests of the last minute over the limit per minute.", [(labels, row.quota_used) for labels, row in usage])
+        metric('ingestion_requests_total', 'counter', "Requests sent.", [(labels, row.requests) for labels, row in usage])
+        metric('ingestion_throttled_total', 'counter', "Throttled responses.", [(labels, row.throttled) for labels, row in usage])
+        return '\n'.join(lines) + '\n'
+
+    async def _serve_metrics(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode(errors='replace').split()
+            # Skip the headers of the request
+            while (await reader.readline()).strip():
+                pass
+            path = request_line[1] if len(request_line) > 1 else '/'
+            if path == '/metrics':
+                status, body = '200 OK', self.metrics()
+            elif path == '/health':
+                if self.healthy:
+                    status, body = '200 OK', 'ready\n'
+                elif self.failing:
+                    status, body = '503 Service Unavailable', ''.join(f"failing: {name}: {error}\n" for name, error in self.failing.items())
+                else:
+                    status, body = '503 Service Unavailable', 'starting\n'
+            else:
+                status, body = '404 Not Found', 'not found\n'
+            payload = body.encode()
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload)
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+def source_jobs(source, stream=False):
+    """
+    Import the ingestion scripts of a source, prepare its bars tables, and return its jobs and streams, with a cleanup to call at shutdown.
+
+    The clients of a source are kept across passes: one HTTP session for Alpaca, one gateway connection for IBKR.
+
+    Parameters:
+    source (str): 'alpaca', 'yfinance' or 'ibkr'.
+    stream (bool): Stream the minute bars of Alpaca instead of polling them every minute.
+
+    Returns:
+    tuple: The list of Jobs, the list of streams, and a callable closing the source's clients, or None.
+    """
+    source_dir = os.path.join(RESEARCH_DIR, SOURCE_DIRECTORIES[source])
+    if source_dir not in sys.path:
+        sys.path.insert(0, source_dir)
+    minute = importlib.import_module(f"{source}_minute_data_initialize")
+    daily = importlib.import_module(f"{source}_daily_data_initialize")
+    # Prepare the bars tables once at start; the passes skip the schema setup once it has succeeded
+    minute.ensure_bars_table(minute.TABLE_NAME)
+    daily.ensure_bars_table(daily.TABLE_NAME)
+    cleanup = None
+    if source == 'alpaca':
+        client = minute.AlpacaBarsClient(minute.APCA_API_KEY_ID, minute.APCA_API_SECRET_KEY, max_connections=SOURCE_CONCURRENCY['alpaca'])
+        run_minute, run_daily = (lambda: minute.run_pass(client=client)), (lambda: daily.run_pass(client=client))
+    elif source == 'ibkr':
+        client = minute.IBKRHistoricalClient()
+        run_minute, run_daily = (lambda: minute.run_pass(client=client)), (lambda: daily.run_pass(client=client))
+        cleanup = client.close
+    else:
+        run_minute, run_daily = minute.run_pass, daily.run_pass
+    jobs = [Job(f"{source}_daily", source, run_daily, daily_at=DAILY_AT, run_at_start=True)]
+    streams = []
+    if stream and source == 'alpaca':
+        streams.append(importlib.import_module("alpaca_minute_stream").build_stream(client))
+    else:
+        jobs.append(Job(f"{source}_minute", source, run_minute, interval=MINUTE_INTERVAL_SECONDS, offset=MINUTE_OFFSET_SECONDS))
+    return jobs, streams, cleanup
+
+
+# Example usage
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the minute and daily ingestion passes of the sources on their schedules in one process.")
+    parser.add_argument('--sources', nargs='+', default=['alpaca', 'yfinance'], choices=sorted(SOURCE_DIRECTORIES))
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT, help="Port of the /metrics and /health endpoints")
+    parser.add_argument('--ready-file', help="File created once every daily job has finished its first pass, for health checks")
+    parser.add_argument('--stream', action='store_true', help="Stream the Alpaca minute bars from the websocket instead of polling them")
+    args = parser.parse_args()
+
+    jobs = []
+    streams = []
+    cleanups = []
+    for source in args.sources:
+        source_job_list, source_streams, cleanup = source_jobs(source, args.stream)
+        jobs.extend(source_job_list)
+        streams.extend(source_streams)
+        if cleanup is not None:
+            cleanups.append(cleanup)
+    daemon = IngestionDaemon(jobs, args.metrics_port, args.ready_file, streams)
+    daemon.cleanups.extend(cleanups)
+    asyncio.run(daemon.run())
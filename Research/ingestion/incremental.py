@@ -0,0 +1,53 @@
+import os
+import pandas as pd
+from db.connection import transaction
+from db.watermarks import fetch_high_water_marks
+from ingestion.spool import UNAVAILABLE_ERRORS, get_spool
+from ingestion.timeutil import to_utc
+
+# Bars re-requested before each ticker's latest stored bar, so late corrections by the source replace the stored bars
+MINUTE_BARS_OVERLAP = pd.Timedelta(os.environ.get("INGESTION_MINUTE_OVERLAP", "15 minutes"))
+DAILY_BARS_OVERLAP = pd.Timedelta(os.environ.get("INGESTION_DAILY_OVERLAP", "3 days"))
+
+# The marks read last from every table, per ticker
+_stored_marks = {}
+
+
+def fetch_start_times(table_name, tickers, initial_start, overlap, earliest=None):
+    """
+    Return where the next request of every ticker should start, from the latest bar stored per ticker.
+
+    Tickers with bars start `overlap` before their latest bar; tickers without bars start at `initial_start`.
+    Bars spooled but not loaded yet count as stored. While the database is unreachable, the marks read last
+    from it stand in, so ingestion goes on into the spool. The bar tables store UTC datetimes without a
+    time zone, so the marks are read as UTC.
+
+    Parameters:
+    table_name (str): The bars table of the source, e.g. 'alpaca_minute'.
+    tickers (list): The tickers of the pass.
+    initial_start (datetime): Where tickers without stored bars start.
+    overlap (pd.Timedelta): How far before the latest stored bar to request again.
+    earliest (datetime): The earliest start the source serves, e.g. yfinance's minute bar lookback;
+                         no limit when omitted.
+
+    Returns:
+    dict: Mapping of ticker to a UTC pd.Timestamp.
+    """
+    try:
+        with transaction() as cursor:
+            cursor.execute("SELECT to_regclass(%s);", (table_name,))
+            marks = fetch_high_water_marks(cursor, table_name, tickers=tickers) if cursor.fetchone()[0] is not None else {}
+        _stored_marks.setdefault(table_name, {}).update(marks)
+    except UNAVAILABLE_ERRORS as e:
+        print(f"Database unavailable, starting {table_name} from the marks read last and the spool: {e}")
+        marks = dict(_stored_marks.get(table_name, {}))
+    for ticker, latest in get_spool().high_water_marks(table_name).items():
+        marks[ticker] = max(marks.get(ticker, latest), latest)
+
+    initial_start = to_utc(initial_start)
+    earliest = to_utc(earliest) if earliest is not None else None
+    start_times = {}
+    for ticker in tickers:
+        start = to_utc(marks[ticker]) - overlap if ticker in marks else initial_start
+        start_times[ticker] = max(start, earliest) if earliest is not None else start
+    return start_times
@@ -0,0 +1,255 @@
+import asyncio
+import collections
+import os
+import random
+import threading
+import time
+import pandas as pd
+
+# Requests per minute per source; 0 leaves a source without a bucket. The IBKR client paces its requests to
+# IB's own windows, so its bucket is off unless set, and the limiter only backs off on pacing violations
+RATE_LIMITS_PER_MINUTE = {
+    'alpaca': float(os.environ.get("RATE_LIMIT_ALPACA_PER_MINUTE", "200")),
+    'yfinance': float(os.environ.get("RATE_LIMIT_YFINANCE_PER_MINUTE", "120")),
+    'ibkr': float(os.environ.get("RATE_LIMIT_IBKR_PER_MINUTE", "0")),
+}
+# Retries of a throttled or transiently failing request, with exponential backoff and full jitter
+RATE_LIMIT_RETRIES = int(os.environ.get("RATE_LIMIT_RETRIES", "5"))
+RATE_LIMIT_BACKOFF_SECONDS = float(os.environ.get("RATE_LIMIT_BACKOFF_SECONDS", "1"))
+RATE_LIMIT_MAX_BACKOFF_SECONDS = float(os.environ.get("RATE_LIMIT_MAX_BACKOFF_SECONDS", "60"))
+# After a throttled response the rate is halved, down to this fraction of the limit, and every success
+# wins back this fraction of the limit
+ADAPTIVE_MIN_FRACTION = 0.05
+ADAPTIVE_RECOVERY_FRACTION = 0.05
+USAGE_COLUMNS = ['source', 'endpoint', 'limit_per_minute', 'rate_per_minute', 'requests_last_minute', 'quota_used',
+                 'requests', 'throttled', 'retries', 'failures', 'waited_seconds']
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class RateLimited(Exception):
+    """A response asking the client to slow down, e.g. HTTP 429 or an IB pacing violation."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TransientError(Exception):
+    """A failure worth retrying as is, e.g. a timeout, a dropped connection or a 5xx response."""
+
+
+class RateLimiter:
+    """
+    A token bucket for one endpoint of a data source, shared by every thread and pass of the process.
+
+    The bucket refills at the current rate, which starts at the source's limit. A throttled response halves
+    the rate and pauses the bucket; successes bring it back to the limit step by step. Without a limit the
+    bucket never runs dry, but throttled responses still pause it.
+    """
+
+    def __init__(self, source, endpoint, limit_per_minute, burst=None):
+        self.source = source
+        self.endpoint = endpoint
+        self.limit = limit_per_minute / 60 if limit_per_minute else None
+        self.rate = self.limit
+        self.capacity = burst or max(1.0, self.limit or 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.consecutive_throttles = 0
+        self.recent = collections.deque()
+        self.stats = {'requests': 0, 'throttled': 0, 'retries': 0, 'failures': 0, 'waited_seconds': 0.0}
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token for one request and return how many seconds to wait before sending it."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self.paused_until - now)
+            if self.rate is not None:
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                # Tokens go negative while requests queue up; each waits until its own token has refilled
+                self.tokens -= 1
+                if self.tokens < 0:
+                    wait = max(wait, -self.tokens / self.rate)
+            self.stats['requests'] += 1
+            self.stats['waited_seconds'] += wait
+            self.recent.append(now + wait)
+            return wait
+
+    def acquire(self):
+        """Wait for a token for one request."""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def throttled(self, retry_after=None):
+        """
+        Slow down after a throttled response: halve the rate and hold every request back.
+
+        The pause grows exponentially with the throttled responses since the last success, with full jitter,
+        and lasts at least retry_after seconds. Returns the pause in seconds.
+        """
+        with self._lock:
+            self.stats['throttled'] += 1
+            pause = backoff_seconds(self.consecutive_throttles, retry_after)
+            self.consecutive_throttles += 1
+            self.paused_until = max(self.paused_until, time.monotonic() + pause)
+            if self.rate is not None:
+                self.rate = max(self.limit * ADAPTIVE_MIN_FRACTION, self.rate / 2)
+                self.tokens = min(self.tokens, 0.0)
+            return pause
+
+    def succeeded(self):
+        """Win back part of the rate after a successful request."""
+        with self._lock:
+            self.consecutive_throttles = 0
+            if self.rate is not None:
+                self.rate = min(self.limit, self.rate + self.limit * ADAPTIVE_RECOVERY_FRACTION)
+
+    def retried(self):
+        with self._lock:
+            self.stats['retries'] += 1
+
+    def failed(self):
+        with self._lock:
+            self.stats['failures'] += 1
+
+    def usage(self):
+        """Return the quota use of the endpoint: the requests of the last minute against its limit, and the totals."""
+        with self._lock:
+            now = time.monotonic()
+            while self.recent and self.recent[0] <= now - 60:
+                self.recent.popleft()
+            limit_per_minute = self.limit * 60 if self.limit else None
+            return {
+                'source': self.source,
+                'endpoint': self.endpoint,
+                'limit_per_minute': limit_per_minute,
+                'rate_per_minute': self.rate * 60 if self.rate else None,
+                'requests_last_minute': len(self.recent),
+                'quota_used': len(self.recent) / limit_per_minute if limit_per_minute else None,
+                **self.stats,
+            }
+
+
+def rate_limiter(source, endpoint='default'):
+    """
+    Return the rate limiter of an endpoint of a data source, created at the first use.
+
+    Parameters:
+    source (str): The data source, e.g. 'alpaca', selecting the limit in RATE_LIMITS_PER_MINUTE.
+    endpoint (str): The endpoint, e.g. 'bars'; endpoints of a source have separate buckets.
+
+    Returns:
+    RateLimiter: The limiter every caller in the process shares.
+    """
+    with _limiters_lock:
+        if (source, endpoint) not in _limiters:
+            _limiters[(source, endpoint)] = RateLimiter(source, endpoint, RATE_LIMITS_PER_MINUTE.get(source))
+        return _limiters[(source, endpoint)]
+
+
+def quota_usage(source=None):
+    """Return the quota use of every rate limiter, or of one source's, as a DataFrame of USAGE_COLUMNS."""
+    with _limiters_lock:
+        limiters = [limiter for (limiter_source, _), limiter in _limiters.items() if source in (None, limiter_source)]
+    return pd.DataFrame([limiter.usage() for limiter in limiters], columns=USAGE_COLUMNS)
+
+
+def classify_http_error(error):
+    """
+    Sort an exception of an HTTP request into RateLimited, TransientError or None for errors not worth retrying.
+
+    Works with requests' exceptions without importing requests: a 429 response is throttled, honouring its
+    Retry-After or X-RateLimit-Reset header, 5xx responses and network errors are transient.
+    """
+    response = getattr(error, 'response', None)
+    status = getattr(response, 'status_code', None)
+    if status == 429:
+        headers = getattr(response, 'headers', None) or {}
+        retry_after = None
+        if headers.get('Retry-After', '').isdigit():
+            retry_after = float(headers['Retry-After'])
+        elif headers.get('X-RateLimit-Reset', '').isdigit():
+            retry_after = max(0.0, float(headers['X-RateLimit-Reset']) - time.time())
+        return RateLimited(str(error), retry_after)
+    if status is not None:
+        return TransientError(str(error)) if status >= 500 else None
+    # Dropped connections and timeouts, including requests' ConnectionError and Timeout
+    return TransientError(str(error)) if isinstance(error, OSError) else None
+
+
+def classify_yfinance_error(error):
+    """Sort an exception of yfinance like classify_http_error; yfinance raises YFRateLimitError when Yahoo throttles."""
+    if type(error).__name__ == 'YFRateLimitError' or 'Too Many Requests' in str(error):
+        return RateLimited(str(error))
+    return classify_http_error(error)
+
+
+def backoff_seconds(attempt, retry_after=None):
+    """Return the wait before retry number `attempt` (from 0): full jitter over an exponential ceiling, at least retry_after."""
+    ceiling = min(RATE_LIMIT_MAX_BACKOFF_SECONDS, RATE_LIMIT_BACKOFF_SECONDS * 2 ** attempt)
+    return max(retry_after or 0.0, random.uniform(0, ceiling))
+
+
+def call_with_retry(limiter, request, classify=classify_http_error, retries=RATE_LIMIT_RETRIES):
+    """
+    Send a request under a rate limiter, retrying throttled and transient failures.
+
+    Parameters:
+    limiter (RateLimiter): The limiter of the endpoint.
+    request (callable): request() sending the request once and returning its result.
+    classify (callable): classify(exception) returning RateLimited, TransientError or None for errors to raise.
+    retries (int): Retries before the last error is raised.
+
+    Returns:
+    The result of the first successful request.
+    """
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        try:
+            result = request()
+        except Exception as e:
+            error = classify(e)
+            delay = _retry_delay(limiter, error, attempt, retries)
+            if delay is None:
+                raise
+            # A throttled limiter holds the next request back itself
+            if not isinstance(error, RateLimited):
+                time.sleep(delay)
+            continue
+        limiter.succeeded()
+        return result
+
+
+async def call_with_retry_async(limiter, request, classify=classify_http_error, retries=RATE_LIMIT_RETRIES):
+    """The coroutine version of call_with_retry, for request() returning an awaitable; waits without blocking the event loop."""
+    for attempt in range(retries + 1):
+        wait = limiter.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        try:
+            result = await request()
+        except Exception as e:
+            error = classify(e)
+            delay = _retry_delay(limiter, error, attempt, retries)
+            if delay is None:
+                raise
+            if not isinstance(error, RateLimited):
+                await asyncio.sleep(delay)
+            continue
+        limiter.succeeded()
+        return result
+
+
+def _retry_delay(limiter, error, attempt, retries):
+    """Record a failed attempt and return how long to back off before the next one, or None to give up."""
+    if not isinstance(error, (RateLimited, TransientError)) or attempt == retries:
+        limiter.failed()
+        return None
+    limiter.retried()
+    return limiter.throttled(error.retry_after) if isinstance(error, RateLimited) else backoff_seconds(attempt)
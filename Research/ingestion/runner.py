@@ -0,0 +1,132 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from ingestion.rate_limit import quota_usage
+
+# Fetch threads per ingestion pass, and the most requests in flight per data source across every pass of the process
+INGESTION_WORKERS = int(os.environ.get("INGESTION_WORKERS", "8"))
+SOURCE_CONCURRENCY = {
+    'alpaca': int(os.environ.get("INGESTION_ALPACA_CONCURRENCY", "4")),
+    'yfinance': int(os.environ.get("INGESTION_YFINANCE_CONCURRENCY", "4")),
+    # IBKR requests share one gateway connection, whose client paces them to IB's historical data limits
+    'ibkr': int(os.environ.get("INGESTION_IBKR_CONCURRENCY", "8")),
+}
+# Fetched frames waiting for the writer; fetch threads block once it is full, so a slow database holds back the downloads
+WRITE_QUEUE_SIZE = int(os.environ.get("INGESTION_WRITE_QUEUE_SIZE", "16"))
+REPORT_COLUMNS = ['ticker', 'rows', 'fetch_seconds', 'store_seconds', 'error']
+
+_source_semaphores = {}
+_source_semaphores_lock = threading.Lock()
+
+
+def source_semaphore(source):
+    """
+    Return the semaphore capping the concurrent requests to a data source.
+
+    Every pass in the process shares it, so two passes against the same source together stay under the cap.
+
+    Parameters:
+    source (str): The data source, e.g. 'alpaca'; sources without a configured cap get INGESTION_WORKERS.
+
+    Returns:
+    threading.BoundedSemaphore: The semaphore of the source.
+    """
+    with _source_semaphores_lock:
+        if source not in _source_semaphores:
+            _source_semaphores[source] = threading.BoundedSemaphore(SOURCE_CONCURRENCY.get(source, INGESTION_WORKERS))
+        return _source_semaphores[source]
+
+
+def run_ingestion_pass(tickers, fetch, store, source, workers=INGESTION_WORKERS, batch_size=None):
+    """
+    Fetch the bars of every ticker concurrently and store them while the remaining tickers download.
+
+    Fetches run on a pool of worker threads, at most the source's cap at a time. A single writer thread
+    stores the fetched frames in the order they arrive, so the database sees one writer per pass while the
+    next requests are already in flight. A failing ticker is reported and does not stop the pass.
+
+    Parameters:
+    tickers (list): The tickers to ingest.
+    fetch (callable): fetch(ticker) returning a DataFrame of bars; an empty frame means no new bars. With a
+                      batch_size, fetch(tickers) for up to batch_size tickers, returning a dict of ticker to DataFrame.
+    store (callable): store(ticker, df) writing one ticker's bars to the database.
+    source (str): The data source, selecting the concurrency cap, e.g. 'alpaca'.
+    workers (int): The number of fetch threads.
+    batch_size (int): Fetch this many tickers per call, for sources that serve several symbols per request.
+
+    Returns:
+    pd.DataFrame: One row per ticker with the rows fetched, the fetch and store latency in seconds and any error.
+                  Tickers fetched together share the latency of their batch.
+    """
+    semaphore = source_semaphore(source)
+    results = {ticker: {'ticker': ticker, 'rows': 0, 'fetch_seconds': None, 'store_seconds': None, 'error': None} for ticker in tickers}
+    pending_writes = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+    batches = [tickers[i:i + batch_size] for i in range(0, len(tickers), batch_size)] if batch_size else [[ticker] for ticker in tickers]
+
+    def fetch_batch(batch):
+        # Time the request itself, not the wait for a free slot of the source
+        with semaphore:
+            start = time.perf_counter()
+            try:
+                fetched = fetch(batch) if batch_size else {batch[0]: fetch(batch[0])}
+            except Exception as e:
+                for ticker in batch:
+                    results[ticker]['error'] = f"fetch failed: {e}"
+                return
+            finally:
+                fetch_seconds = time.perf_counter() - start
+                for ticker in batch:
+                    results[ticker]['fetch_seconds'] = fetch_seconds
+        for ticker in batch:
+            data = fetched.get(ticker)
+            if data is not None and not data.empty:
+                results[ticker]['rows'] = len(data)
+                pending_writes.put((ticker, data))
+
+    def write_frames():
+        while True:
+            item = pending_writes.get()
+            if item is None:
+                return
+            ticker, data = item
+            start = time.perf_counter()
+            try:
+                store(ticker, data)
+            except Exception as e:
+                results[ticker]['error'] = f"store failed: {e}"
+            results[ticker]['store_seconds'] = time.perf_counter() - start
+
+    pass_start = time.perf_counter()
+    writer = threading.Thread(target=write_frames, name=f"{source}-writer", daemon=True)
+    writer.start()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix=f"{source}-fetch") as executor:
+            list(executor.map(fetch_batch, batches))
+    finally:
+        # Let the writer drain what was fetched before the pass ends
+        pending_writes.put(None)
+        writer.join()
+
+    report = pd.DataFrame(list(results.values()), columns=REPORT_COLUMNS)
+    print_pass_report(report, source, time.perf_counter() - pass_start)
+    return report
+
+
+def print_pass_report(report, source, pass_seconds):
+    """Print the per-ticker latencies of a pass, followed by its totals."""
+    for row in report.itertuples(index=False):
+        fetch_seconds = f"{row.fetch_seconds:.2f}s" if pd.notna(row.fetch_seconds) else "-"
+        store_seconds = f"{row.store_seconds:.2f}s" if pd.notna(row.store_seconds) else "-"
+        status = f", {row.error}" if pd.notna(row.error) else ""
+        print(f"{source} {row.ticker}: {row.rows} rows, fetch {fetch_seconds}, store {store_seconds}{status}")
+    fetch_total = report['fetch_seconds'].sum()
+    print(f"{source} pass: {len(report)} tickers, {int(report['rows'].sum())} rows, {report['error'].notna().sum()} failed, "
+          f"{pass_seconds:.2f}s total ({fetch_total:.2f}s of fetches, {fetch_total / pass_seconds if pass_seconds else 0:.1f}x overlap)")
+    # The quota use of the source's rate limiters, shared with any other pass of the process
+    for usage in quota_usage(source).itertuples(index=False):
+        limit = f" of {usage.limit_per_minute:.0f} ({usage.quota_used:.0%})" if pd.notna(usage.limit_per_minute) else ""
+        print(f"{source} {usage.endpoint} quota: {usage.requests_last_minute} requests in the last minute{limit}, "
+              f"{usage.throttled} throttled, {usage.retries} retried, {usage.failures} failed, {usage.waited_seconds:.1f}s waited")
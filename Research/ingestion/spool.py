@@ -0,0 +1,476 @@
+import atexit
+import fcntl
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import psycopg2
+import psycopg2.pool
+from db.bulk import copy_upsert
+from db.connection import transaction
+from ingestion.rate_limit import backoff_seconds
+
+# Fetched bars wait here, one directory per table, until the flusher has loaded them into Postgres
+SPOOL_DIR = os.environ.get("INGESTION_SPOOL_DIR", os.path.expanduser(os.path.join("~", ".cache", "ingestion_spool")))
+# fsync every append, so acknowledged bars also survive a power loss and not only a crash of the process
+SPOOL_FSYNC = os.environ.get("INGESTION_SPOOL_FSYNC", "0") == "1"
+# The most rows loaded with one COPY, and the size at which an open segment is sealed for the flusher
+SPOOL_FLUSH_ROWS = int(os.environ.get("INGESTION_SPOOL_FLUSH_ROWS", "500000"))
+SPOOL_SEGMENT_BYTES = int(os.environ.get("INGESTION_SPOOL_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+# Loads failing for another reason than an unreachable database are retried this many times, then set aside
+SPOOL_MAX_ATTEMPTS = int(os.environ.get("INGESTION_SPOOL_MAX_ATTEMPTS", "5"))
+# How long a process waits at exit for its spooled bars to be loaded; what is left is loaded by the next run
+SPOOL_EXIT_FLUSH_SECONDS = float(os.environ.get("INGESTION_SPOOL_EXIT_FLUSH_SECONDS", "30"))
+
+# Columns of the bar tables, and the fixed-size record of a bar in a segment: the datetime as UTC nanoseconds
+# since the epoch, the ticker as ASCII (the tables store VARCHAR(10)), then the prices and volume
+BAR_COLUMNS = ['datetime', 'ticker', 'open', 'high', 'low', 'close', 'volume']
+RECORD_DTYPE = np.dtype([('datetime', '<i8'), ('ticker', 'S10'), ('open', '<f8'), ('high', '<f8'), ('low', '<f8'),
+                         ('close', '<f8'), ('volume', '<i8')])
+SEGMENT_MAGIC = b'BARSPOOL1\n'.ljust(16, b'\0')
+# Segments being appended to, sealed for loading, and set aside after failing to load
+OPEN_SUFFIX = '.open'
+SEALED_SUFFIX = '.seg'
+REJECTED_DIR = 'rejected'
+# Errors meaning the database cannot be reached right now, rather than that the bars cannot be loaded; PoolError
+# is the connection pool being exhausted
+UNAVAILABLE_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, psycopg2.pool.PoolError)
+USAGE_COLUMNS = ['table', 'spooled_rows', 'spooled_segments', 'loaded_rows', 'loads', 'load_failures', 'rejected_segments']
+
+_spool = None
+_spool_lock = threading.Lock()
+
+
+def load_bars(table_name, bars):
+    """Upsert spooled bars into their table with COPY in one transaction."""
+    with transaction() as cursor:
+        copy_upsert(cursor, bars, table_name, BAR_COLUMNS)
+
+
+class BarSpool:
+    """
+    An append-only local spool of fetched bars, loaded into Postgres in the background.
+
+    append writes the bars to the open segment file of their table and returns, so ingestion runs at the
+    speed of the source and the local disk whatever the database does. A flusher thread seals the open
+    segments and loads the sealed ones with `load`, many segments per COPY, deleting them once committed.
+    While the database is unreachable the segments stay on disk and the flusher retries with backoff.
+    Segments of a process that died are picked up by the next spool over the same directory, less the
+    torn record a crash may leave at their end. Loads are upserts, so a segment loaded twice is harmless.
+    """
+
+    def __init__(self, spool_dir=SPOOL_DIR, load=load_bars, fsync=SPOOL_FSYNC):
+        self.spool_dir = spool_dir
+        self.load = load
+        self.fsync = fsync
+        self.token = uuid.uuid4().hex[:12]
+        self.stats = {}
+        self._segments = {}
+        self._marks = {}
+        self._attempts = {}
+        self._on_loaded = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._cycle = threading.Condition()
+        self._cycles_started = 0
+        self._cycles_finished = 0
+        self._closing = False
+        self._flusher = None
+        os.makedirs(spool_dir, exist_ok=True)
+        self._recover_marks()
+
+    def append(self, table_name, bars, on_loaded=None):
+        """
+        Spool bars for a table and return once they are written to the local disk.
+
+        Parameters:
+        table_name (str): The bars table to load them into.
+        bars (pd.DataFrame): The bars, with BAR_COLUMNS; 'datetime' holds UTC datetimes without a time zone.
+        on_loaded (callable): Called without arguments on the flusher thread once the bars are committed to the table.
+                              Not called for bars set aside, nor for bars left to the next spool at exit.
+        """
+        if bars.empty:
+            if on_loaded is not None:
+                on_loaded()
+            return
+        records = bars_to_records(bars)
+        with self._lock:
+            segment = self._segments.get(table_name)
+            if segment is None:
+                segment = self._segments[table_name] = _OpenSegment(os.path.join(self.spool_dir, table_name), self.token)
+            segment.write(records.tobytes(), len(records), self.fsync)
+            if on_loaded is not None:
+                self._on_loaded.setdefault(segment.sealed_path, []).append(on_loaded)
+            if segment.rows * RECORD_DTYPE.itemsize >= SPOOL_SEGMENT_BYTES:
+                self._segments.pop(table_name).seal()
+            self._table_stats(table_name)['appended_rows'] += len(records)
+            marks = self._marks.setdefault(table_name, {})
+            for ticker, latest in latest_per_ticker(records).items():
+                marks[ticker] = max(marks.get(ticker, latest), latest)
+        self._start_flusher()
+        self._wake.set()
+
+    def high_water_marks(self, table_name):
+        """Return the latest datetime spooled per ticker for a table, as naive UTC pd.Timestamps, loaded or not."""
+        with self._lock:
+            return {ticker: pd.Timestamp(latest) for ticker, latest in self._marks.get(table_name, {}).items()}
+
+    def flush(self, timeout=None):
+        """
+        Wait until every bar spooled so far is loaded, or until `timeout` seconds have passed.
+
+        Returns:
+        bool: Whether the spool was emptied; False when the database stayed unreachable.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self._start_flusher()
+        with self._cycle:
+            cycle = self._cycles_started + 1
+            self._wake.set()
+        while True:
+            # Wait for a cycle that started after the call, so it saw every bar spooled before it; after a failed
+            # cycle the flusher retries on its own backoff
+            with self._cycle:
+                while self._cycles_finished < cycle:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cycle.wait(remaining)
+                cycle = self._cycles_finished + 1
+            if not self.usage()['spooled_rows'].sum():
+                return True
+
+    def close(self, timeout=SPOOL_EXIT_FLUSH_SECONDS):
+        """Load what is spooled within `timeout` seconds and stop the flusher; what is left is loaded by the next spool."""
+        drained = self.flush(timeout)
+        self._closing = True
+        self._wake.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=5)
+        with self._lock:
+            for segment in self._segments.values():
+                segment.seal()
+            self._segments.clear()
+        return drained
+
+    def usage(self):
+        """
+        Return the bars waiting and loaded per table.
+
+        Returns:
+        pd.DataFrame: One row per table with USAGE_COLUMNS.
+        """
+        rows = []
+        tables = set(self.stats) | {name for name in os.listdir(self.spool_dir) if os.path.isdir(os.path.join(self.spool_dir, name))}
+        for table_name in sorted(tables):
+            table_dir = os.path.join(self.spool_dir, table_name)
+            segments = [name for name in _list_segments(table_dir) if name.endswith((OPEN_SUFFIX, SEALED_SUFFIX))]
+            spooled = sum(_segment_rows(os.path.join(table_dir, name)) for name in segments)
+            stats = self._table_stats(table_name)
+            rows.append([table_name, spooled, len(segments), stats['loaded_rows'], stats['loads'], stats['load_failures'], stats['rejected_segments']])
+        return pd.DataFrame(rows, columns=USAGE_COLUMNS)
+
+    def _table_stats(self, table_name):
+        return self.stats.setdefault(table_name, {'appended_rows': 0, 'loaded_rows': 0, 'loads': 0, 'load_failures': 0, 'rejected_segments': 0})
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run_flusher, name="spool-flusher", daemon=True)
+                self._flusher.start()
+
+    def _run_flusher(self):
+        attempt = 0
+        delay = None
+        while not self._closing:
+            self._wake.wait(delay)
+            self._wake.clear()
+            with self._cycle:
+                self._cycles_started += 1
+            try:
+                self._flush_once()
+            except UNAVAILABLE_ERRORS as e:
+                delay = backoff_seconds(attempt)
+                attempt += 1
+                print(f"Database unavailable, {self.usage()['spooled_rows'].sum()} bars stay spooled; retrying in {delay:.1f}s: {e}")
+            except Exception as e:
+                # E.g. a segment that cannot be read or renamed; the flusher must outlive it, or the spool never empties
+                delay = backoff_seconds(attempt)
+                attempt += 1
+                print(f"Flushing the spool failed, retrying in {delay:.1f}s: {type(e).__name__}: {e}")
+            else:
+                # Segments that failed to load are tried again after a pause, the rest wait for the next append
+                delay = backoff_seconds(max(self._attempts.values())) if self._attempts else None
+                attempt = 0
+            with self._cycle:
+                self._cycles_finished += 1
+                self._cycle.notify_all()
+
+    def _flush_once(self):
+        """Seal the open segments and load every sealed segment, raising UNAVAILABLE_ERRORS when the database is unreachable."""
+        with self._lock:
+            sealing = [table_name for table_name, segment in self._segments.items() if segment.rows]
+            for table_name in sealing:
+                self._segments.pop(table_name).seal()
+        for table_name in sorted(os.listdir(self.spool_dir)):
+            table_dir = os.path.join(self.spool_dir, table_name)
+            if os.path.isdir(table_dir):
+                _seal_orphans(table_dir)
+                self._load_table(table_name, table_dir)
+
+    def _load_table(self, table_name, table_dir):
+        """Load the sealed segments of a table oldest first, many per COPY."""
+        paths = [os.path.join(table_dir, name) for name in _list_segments(table_dir) if name.endswith(SEALED_SUFFIX)]
+        while paths:
+            # A segment that failed to load goes on its own, so it does not hold back the others
+            group = [paths.pop(0)]
+            rows = _segment_rows(group[0])
+            while paths and group[0] not in self._attempts and paths[0] not in self._attempts and rows + _segment_rows(paths[0]) <= SPOOL_FLUSH_ROWS:
+                rows += _segment_rows(paths[0])
+                group.append(paths.pop(0))
+            with _locked_segments(group) as locked:
+                if not locked:
+                    continue
+                bars = records_to_bars(np.concatenate([read_segment(path) for path in locked]))
+                stats = self._table_stats(table_name)
+                try:
+                    self.load(table_name, bars)
+                except UNAVAILABLE_ERRORS:
+                    stats['load_failures'] += 1
+                    raise
+                except Exception as e:
+                    stats['load_failures'] += 1
+                    self._failed(table_name, table_dir, locked, e)
+                    continue
+                for path in locked:
+                    os.remove(path)
+                    self._attempts.pop(path, None)
+                stats['loaded_rows'] += len(bars)
+                stats['loads'] += 1
+                self._notify_loaded(locked)
+
+    def _failed(self, table_name, table_dir, paths, error):
+        """Count a failed load of some segments, setting a segment aside once it has failed SPOOL_MAX_ATTEMPTS times on its own."""
+        for path in paths:
+            self._attempts.setdefault(path, 0)
+        if len(paths) > 1:
+            print(f"Loading {len(paths)} spooled segments into {table_name} failed, retrying them one by one: {error}")
+            return
+        path = paths[0]
+        self._attempts[path] += 1
+        if self._attempts[path] < SPOOL_MAX_ATTEMPTS:
+            print(f"Loading {os.path.basename(path)} into {table_name} failed, will retry: {error}")
+            return
+        rejected_dir = os.path.join(table_dir, REJECTED_DIR)
+        os.makedirs(rejected_dir, exist_ok=True)
+        os.replace(path, os.path.join(rejected_dir, os.path.basename(path)))
+        self._attempts.pop(path)
+        with self._lock:
+            self._on_loaded.pop(path, None)
+            # Its bars never reach the table, so the next pass must not start after them: the marks are read again
+            # from the segments still spooled, which also forgets the marks of loaded bars, now in the table
+            self._marks[table_name] = _spooled_marks(table_dir)
+        self._table_stats(table_name)['rejected_segments'] += 1
+        print(f"Set {os.path.basename(path)} aside in {rejected_dir} after {SPOOL_MAX_ATTEMPTS} failed loads into {table_name}: {error}")
+
+    def _notify_loaded(self, paths):
+        """Call the on_loaded callbacks of the bars appended to some segments, now committed."""
+        with self._lock:
+            callbacks = [callback for path in paths for callback in self._on_loaded.pop(path, [])]
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"A callback of loaded spooled bars failed: {e}")
+
+    def _recover_marks(self):
+        """Seed the high-water marks with the bars still spooled by earlier runs."""
+        for table_name in os.listdir(self.spool_dir):
+            table_dir = os.path.join(self.spool_dir, table_name)
+            if os.path.isdir(table_dir):
+                self._marks[table_name] = _spooled_marks(table_dir)
+
+
+class _OpenSegment:
+    """The segment a spool appends the bars of a table to, locked so no other spool seals it while it is open."""
+
+    def __init__(self, table_dir, token):
+        os.makedirs(table_dir, exist_ok=True)
+        # Names sort by creation time, so the flusher loads the segments in the order they were written
+        self.path = os.path.join(table_dir, f"{time.time_ns():020d}-{token}{OPEN_SUFFIX}")
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        os.write(self.fd, SEGMENT_MAGIC)
+        self.rows = 0
+
+    @property
+    def sealed_path(self):
+        return self.path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX
+
+    def write(self, data, rows, fsync):
+        os.write(self.fd, data)
+        if fsync:
+            os.fsync(self.fd)
+        self.rows += rows
+
+    def seal(self):
+        """Hand the segment to the flusher; empty segments are removed."""
+        if self.rows:
+            os.replace(self.path, self.sealed_path)
+        else:
+            os.remove(self.path)
+        os.close(self.fd)
+
+
+@contextmanager
+def _locked_segments(paths):
+    """Lock sealed segments for loading, yielding the ones no other flusher holds or has already loaded."""
+    fds = []
+    locked = []
+    try:
+        for path in paths:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            fds.append(fd)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            # Another flusher may have loaded and removed it before the lock was ours
+            if os.path.exists(path):
+                locked.append(path)
+        yield locked
+    finally:
+        for fd in fds:
+            os.close(fd)
+
+
+def _list_segments(table_dir):
+    try:
+        return sorted(name for name in os.listdir(table_dir) if os.path.isfile(os.path.join(table_dir, name)))
+    except FileNotFoundError:
+        return []
+
+
+def _segment_rows(path):
+    try:
+        return max(0, os.path.getsize(path) - len(SEGMENT_MAGIC)) // RECORD_DTYPE.itemsize
+    except FileNotFoundError:
+        return 0
+
+
+def _spooled_marks(table_dir):
+    """Return the latest datetime per ticker of the bars in the open and sealed segments of a table, set aside ones excluded."""
+    marks = {}
+    for name in _list_segments(table_dir):
+        if name.endswith((OPEN_SUFFIX, SEALED_SUFFIX)):
+            try:
+                records = read_segment(os.path.join(table_dir, name))
+            except FileNotFoundError:
+                # Loaded and removed by another spool meanwhile
+                continue
+            for ticker, latest in latest_per_ticker(records).items():
+                marks[ticker] = max(marks.get(ticker, latest), latest)
+    return marks
+
+
+def _seal_orphans(table_dir):
+    """Seal the open segments no live spool holds, left behind by a process that stopped without closing its spool."""
+    for name in _list_segments(table_dir):
+        if not name.endswith(OPEN_SUFFIX):
+            continue
+        path = os.path.join(table_dir, name)
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except FileNotFoundError:
+            continue
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Its spool is alive and seals it itself
+            os.close(fd)
+            continue
+        try:
+            # Drop the torn record a crash in the middle of a write leaves at the end
+            size = os.fstat(fd).st_size
+            whole = len(SEGMENT_MAGIC) + max(0, size - len(SEGMENT_MAGIC)) // RECORD_DTYPE.itemsize * RECORD_DTYPE.itemsize
+            if whole != size:
+                os.ftruncate(fd, whole)
+            if whole > len(SEGMENT_MAGIC):
+                os.replace(path, path[:-len(OPEN_SUFFIX)] + SEALED_SUFFIX)
+            else:
+                os.remove(path)
+        finally:
+            os.close(fd)
+
+
+def read_segment(path):
+    """Read the bar records of a segment, ignoring a torn record at its end."""
+    with open(path, 'rb') as segment:
+        data = segment.read()
+    if not data.startswith(SEGMENT_MAGIC):
+        raise ValueError(f"{path} is not a bar spool segment")
+    rows = (len(data) - len(SEGMENT_MAGIC)) // RECORD_DTYPE.itemsize
+    return np.frombuffer(data, dtype=RECORD_DTYPE, count=rows, offset=len(SEGMENT_MAGIC))
+
+
+def bars_to_records(bars):
+    """Pack bars with BAR_COLUMNS into segment records."""
+    tickers = bars['ticker'].astype(str)
+    if (tickers.str.len() > RECORD_DTYPE['ticker'].itemsize).any():
+        raise ValueError(f"Tickers longer than {RECORD_DTYPE['ticker'].itemsize} characters cannot be spooled")
+    records = np.empty(len(bars), dtype=RECORD_DTYPE)
+    records['datetime'] = bars['datetime'].to_numpy(dtype='datetime64[ns]').view('int64')
+    records['ticker'] = np.char.encode(tickers.to_numpy(dtype=str), 'ascii')
+    for column in ['open', 'high', 'low', 'close', 'volume']:
+        records[column] = bars[column].to_numpy()
+    return records
+
+
+def records_to_bars(records):
+    """Unpack segment records into bars with BAR_COLUMNS."""
+    return pd.DataFrame({
+        'datetime': records['datetime'].view('datetime64[ns]'),
+        'ticker': np.char.decode(records['ticker'], 'ascii'),
+        **{column: records[column] for column in ['open', 'high', 'low', 'close', 'volume']},
+    }, columns=BAR_COLUMNS)
+
+
+def latest_per_ticker(records):
+    """Return the latest datetime of the records per ticker, as numpy datetime64."""
+    if not len(records):
+        return {}
+    latest = pd.Series(records['datetime']).groupby(records['ticker']).max()
+    return {ticker.decode('ascii'): np.datetime64(int(value), 'ns') for ticker, value in latest.items()}
+
+
+def get_spool():
+    """Return the process-wide spool under SPOOL_DIR, opening it on first use."""
+    global _spool
+    with _spool_lock:
+        if _spool is None:
+            _spool = BarSpool()
+        return _spool
+
+
+def spool_usage():
+    """Return the usage of the process-wide spool, see BarSpool.usage; empty before anything was spooled."""
+    return _spool.usage() if _spool is not None else pd.DataFrame(columns=USAGE_COLUMNS)
+
+
+def close_spool():
+    """Load what the process spooled before it exits, waiting at most SPOOL_EXIT_FLUSH_SECONDS."""
+    global _spool
+    with _spool_lock:
+        spool, _spool = _spool, None
+    if spool is not None and not spool.close():
+        print(f"Some bars stay spooled in {spool.spool_dir}; the next ingestion run loads them")
+
+
+# Registered after the connection pool's, so it runs first and the pool is still open for the last loads
+atexit.register(close_spool)
@@ -0,0 +1,17 @@
+import pandas as pd
+
+
+def to_utc(timestamp):
+    """
+    Return a timestamp as a UTC pd.Timestamp.
+
+    The bar tables store UTC datetimes without a time zone, so naive timestamps are read as UTC; aware ones are converted.
+
+    Parameters:
+    timestamp (str, datetime or pd.Timestamp): The timestamp to normalize.
+
+    Returns:
+    pd.Timestamp: The timestamp in UTC.
+    """
+    timestamp = pd.Timestamp(timestamp)
+    return timestamp.tz_localize('UTC') if timestamp.tzinfo is None else timestamp.tz_convert('UTC')
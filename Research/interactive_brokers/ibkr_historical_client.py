@@ -0,0 +1,310 @@
+import asyncio
+import collections
+import math
+import os
+import threading
+import time
+from datetime import timedelta
+import pandas as pd
+from ib_insync import IB, RequestError, Stock
+from ingestion.rate_limit import RateLimited, TransientError, call_with_retry_async, rate_limiter
+from ingestion.timeutil import to_utc
+
+# TWS / IB Gateway to connect to; the client ID must not be in use by another connection to the same gateway
+IBKR_HOST = os.environ.get("IBKR_HOST", "127.0.0.1")
+IBKR_PORT = int(os.environ.get("IBKR_PORT", "7497"))
+IBKR_CLIENT_ID = int(os.environ.get("IBKR_CLIENT_ID", "1"))
+IBKR_REQUEST_TIMEOUT_SECONDS = float(os.environ.get("IBKR_REQUEST_TIMEOUT_SECONDS", "60"))
+# IB's pacing rules for historical data: at most 60 requests in any 10 minutes for bars of 30 seconds or less, at
+# most 6 requests for the same contract in any 2 seconds, no identical request within 15 seconds, and at most 50
+# requests open at once
+IBKR_PACING_REQUESTS = int(os.environ.get("IBKR_PACING_REQUESTS", "60"))
+IBKR_PACING_WINDOW_SECONDS = float(os.environ.get("IBKR_PACING_WINDOW_SECONDS", "600"))
+IBKR_WINDOW_BAR_SIZES = frozenset({'1 secs', '5 secs', '10 secs', '15 secs', '30 secs'})
+IBKR_CONTRACT_REQUESTS = 6
+IBKR_CONTRACT_WINDOW_SECONDS = 2.0
+IBKR_IDENTICAL_REQUEST_SECONDS = 15.0
+IBKR_MAX_OPEN_REQUESTS = 50
+# Longest range requested at once per bar size; longer ranges are split into chunks of this length
+CHUNK_DURATIONS = {'1 min': timedelta(days=5), '1 day': timedelta(days=365)}
+# Bar fields of ib_insync's BarData and the columns of the frames returned, named like the Alpaca frames
+BAR_FIELDS = {'open': 'open', 'high': 'high', 'low': 'low', 'close': 'close', 'volume': 'volume', 'barCount': 'trade_count', 'average': 'vwap'}
+
+
+class HistoricalPacer:
+    """
+    Hold historical data requests back until IB's pacing rules allow them.
+
+    IB answers a request that breaks a rule with a pacing violation and no bars, and repeated violations get the
+    connection throttled, so requests wait here instead. Violations can still come when other clients of the
+    account use up the limit; the pacer then halves the requests it allows per window, and wins them back one
+    per answered request. Only requests for the bar sizes in `window_bar_sizes` count against the window, as IB
+    applies it to small bars only. The pacer lives on the client's event loop.
+    """
+
+    def __init__(self, requests=IBKR_PACING_REQUESTS, window_seconds=IBKR_PACING_WINDOW_SECONDS,
+                 contract_requests=IBKR_CONTRACT_REQUESTS, contract_window_seconds=IBKR_CONTRACT_WINDOW_SECONDS,
+                 identical_request_seconds=IBKR_IDENTICAL_REQUEST_SECONDS, max_open_requests=IBKR_MAX_OPEN_REQUESTS,
+                 window_bar_sizes=IBKR_WINDOW_BAR_SIZES):
+        self.max_requests = requests
+        self.requests = requests
+        self.window_seconds = window_seconds
+        self.window_bar_sizes = frozenset(window_bar_sizes)
+        self.contract_requests = contract_requests
+        self.contract_window_seconds = contract_window_seconds
+        self.identical_request_seconds = identical_request_seconds
+        self.max_open_requests = max_open_requests
+        self.sent = collections.deque()
+        self.contract_sent = collections.defaultdict(collections.deque)
+        self.identical_sent = {}
+        # Created on the event loop at the first request
+        self._lock = None
+        self._open_requests = None
+
+    async def acquire(self, contract_key, request_key, bar_size):
+        """
+        Wait until a request may be sent, and record it as sent.
+
+        Parameters:
+        contract_key (str): The contract of the request, e.g. its symbol.
+        request_key (tuple): Everything that makes two requests identical.
+        bar_size (str): The bar size of the request, e.g. '1 min'.
+        """
+        windowed = bar_size in self.window_bar_sizes
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+            self._open_requests = asyncio.Semaphore(self.max_open_requests)
+        await self._open_requests.acquire()
+        try:
+            # The lock only covers checking the rules and taking the slot; a request waits out its delay without it,
+            # so one held back by its contract's rules does not hold back the requests for other contracts
+            while True:
+                async with self._lock:
+                    now = time.monotonic()
+                    delay = self._delay(contract_key, request_key, windowed, now)
+                    if delay <= 0:
+                        if windowed:
+                            self.sent.append(now)
+                        self.contract_sent[contract_key].append(now)
+                        # Re-inserted, so the requests stay in the order they were sent and the oldest are pruned first
+                        self.identical_sent.pop(request_key, None)
+                        self.identical_sent[request_key] = now
+                        return
+                # Another request may take the slot meanwhile, so the rules are checked again after waking
+                await asyncio.sleep(delay)
+        except BaseException:
+            self._open_requests.release()
+            raise
+
+    def release(self):
+        """Mark a request acquired with acquire as finished."""
+        self._open_requests.release()
+
+    def throttled(self):
+        """Allow half as many requests per window after IB reported a pacing violation."""
+        self.requests = max(1, self.requests // 2)
+
+    def succeeded(self):
+        """Allow one more request per window after an answered request, up to the configured limit."""
+        self.requests = min(self.max_requests, self.requests + 1)
+
+    def _delay(self, contract_key, request_key, windowed, now):
+        """Return how long the rules hold a request back, forgetting the requests too old to matter."""
+        contract_sent = self.contract_sent[contract_key]
+        for sent, window in [(self.sent, self.window_seconds), (contract_sent, self.contract_window_seconds)]:
+            while sent and sent[0] <= now - window:
+                sent.popleft()
+        while self.identical_sent:
+            oldest = next(iter(self.identical_sent))
+            if self.identical_sent[oldest] > now - self.identical_request_seconds:
+                break
+            del self.identical_sent[oldest]
+        delays = [0.0]
+        if windowed and len(self.sent) >= self.requests:
+            delays.append(self.sent[-self.requests] + self.window_seconds - now)
+        if len(contract_sent) >= self.contract_requests:
+            delays.append(contract_sent[-self.contract_requests] + self.contract_window_seconds - now)
+        if request_key in self.identical_sent:
+            delays.append(self.identical_sent[request_key] + self.identical_request_seconds - now)
+        return max(delays)
+
+
+class IBKRHistoricalClient:
+    """
+    Historical bars from TWS / IB Gateway over one long-lived connection.
+
+    The connection runs on an event loop in a background thread, where requests from any thread are sent
+    concurrently through ib_insync's async API under a HistoricalPacer. It connects at the first request and
+    reconnects when the gateway drops the connection. Use it as a context manager, or call close when done.
+    """
+
+    def __init__(self, host=IBKR_HOST, port=IBKR_PORT, client_id=IBKR_CLIENT_ID, pacer=None, ib_factory=IB):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.pacer = pacer or HistoricalPacer()
+        self.ib_factory = ib_factory
+        self.ib = None
+        self.connections = 0
+        self.requests_sent = 0
+        self.loop = None
+        self._thread = None
+        self._loop_lock = threading.Lock()
+        self._connect_lock = None
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def connect(self):
+        """Connect to the gateway now rather than at the first request."""
+        self._run(self._ensure_connected())
+
+    def close(self):
+        """Disconnect from the gateway and stop the event loop thread; a later request starts them again."""
+        with self._loop_lock:
+            if self.loop is None:
+                return
+            asyncio.run_coroutine_threadsafe(self._disconnect(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self.loop.close()
+            self.loop = None
+            self._connect_lock = None
+
+    def fetch_bars(self, ticker, start, end, bar_size):
+        """
+        Fetch the bars of a ticker between two times, in chunks sent concurrently; callable from any thread.
+
+        Parameters:
+        ticker (str): The stock symbol.
+        start (datetime): The first bar time to include; naive datetimes are read as UTC.
+        end (datetime): The bar times to include are before it; naive datetimes are read as UTC.
+        bar_size (str): '1 min' or '1 day'.
+
+        Returns:
+        pd.DataFrame: Bars indexed by the UTC bar timestamp with columns
+                      ['open', 'high', 'low', 'close', 'volume', 'trade_count', 'vwap', 'ticker'].
+        """
+        return self._run(self.fetch_bars_async(ticker, start, end, bar_size))
+
+    async def fetch_bars_async(self, ticker, start, end, bar_size):
+        """The coroutine of fetch_bars, for callers already on the client's event loop."""
+        start, end = to_utc(start), to_utc(end)
+        chunks = split_range(start, end, CHUNK_DURATIONS[bar_size])
+        chunk_bars = await asyncio.gather(*(self.request_bars(ticker, chunk_end, duration_string(chunk_end - chunk_start, bar_size), bar_size)
+                                            for chunk_start, chunk_end in chunks))
+        data = bars_to_frame(ticker, [bar for bars in chunk_bars for bar in bars])
+        # Durations in days count trading days, so chunks can reach back past their start and overlap
+        data = data[~data.index.duplicated(keep='last')].sort_index()
+        return data[(data.index >= start) & (data.index < end)]
+
+    async def request_bars(self, ticker, end, duration, bar_size):
+        """
+        Send one historical data request once the pacer allows it.
+
+        Parameters:
+        ticker (str): The stock symbol.
+        end (pd.Timestamp): The end of the request, in UTC.
+        duration (str): The IB duration string of the request, e.g. '5 D'.
+        bar_size (str): '1 min' or '1 day'.
+
+        Returns:
+        list: The BarData of the response; empty if IB had no bars.
+        """
+        # Pacing violations, e.g. from another client of the same account, and dropped connections are retried with backoff
+        return await call_with_retry_async(rate_limiter('ibkr', 'historical'), lambda: self._request_bars_once(ticker, end, duration, bar_size),
+                                           classify=classify_ib_error)
+
+    async def _request_bars_once(self, ticker, end, duration, bar_size):
+        await self._ensure_connected()
+        await self.pacer.acquire(ticker, (ticker, end, duration, bar_size), bar_size)
+        try:
+            self.requests_sent += 1
+            bars = await self.ib.reqHistoricalDataAsync(
+                Stock(ticker, 'SMART', 'USD'), endDateTime=end.to_pydatetime(), durationStr=duration,
+                barSizeSetting=bar_size, whatToShow='TRADES', useRTH=True, formatDate=2,
+                timeout=IBKR_REQUEST_TIMEOUT_SECONDS
+            )
+        except RequestError as e:
+            # IB answers a range without bars with an error
+            if e.code == 162 and 'returned no data' in e.message:
+                return []
+            if isinstance(classify_ib_error(e), RateLimited):
+                self.pacer.throttled()
+            raise
+        finally:
+            self.pacer.release()
+        self.pacer.succeeded()
+        return bars
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def _run(self, coroutine):
+        """Run a coroutine on the client's event loop, started at the first call, and wait for its result."""
+        with self._loop_lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._run_loop, name="ibkr-client", daemon=True)
+                self._thread.start()
+            loop = self.loop
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+    async def _ensure_connected(self):
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self.ib is not None and self.ib.isConnected():
+                return
+            self.ib = self.ib_factory()
+            # Raise failed requests instead of returning no bars, so pacing violations can be told apart
+            self.ib.RaiseRequestErrors = True
+            await self.ib.connectAsync(self.host, self.port, clientId=self.client_id, readonly=True)
+            self.connections += 1
+
+    async def _disconnect(self):
+        if self.ib is not None and self.ib.isConnected():
+            self.ib.disconnect()
+
+
+def classify_ib_error(error):
+    """Sort an exception of a historical data request into RateLimited, TransientError or None for errors not worth retrying."""
+    if isinstance(error, RequestError):
+        if error.code == 162 and 'pacing violation' in error.message.lower():
+            return RateLimited(error.message)
+        # 504: not connected, 1100: connectivity between IB and TWS lost
+        return TransientError(error.message) if error.code in (504, 1100) else None
+    return TransientError(str(error)) if isinstance(error, (ConnectionError, asyncio.TimeoutError)) else None
+
+
+def split_range(start, end, chunk_duration):
+    """Split the range from start to end into consecutive chunks of at most chunk_duration, as (start, end) pairs."""
+    chunks = []
+    chunk_end = end
+    while chunk_end > start:
+        chunk_start = max(start, chunk_end - chunk_duration)
+        chunks.append((chunk_start, chunk_end))
+        chunk_end = chunk_start
+    return chunks[::-1]
+
+
+def duration_string(span, bar_size):
+    """Return the IB duration string covering a time span: seconds below a day for intraday bars, otherwise days or years."""
+    if bar_size != '1 day' and span < timedelta(days=1):
+        return f"{max(60, math.ceil(span.total_seconds()))} S"
+    days = max(1, math.ceil(span / timedelta(days=1)))
+    return f"{days // 365} Y" if days % 365 == 0 else f"{days} D"
+
+
+def bars_to_frame(ticker, bars):
+    """Turn a list of ib_insync BarData into a DataFrame indexed by the UTC bar timestamp."""
+    data = pd.DataFrame({column: [getattr(bar, field) for bar in bars] for field, column in BAR_FIELDS.items()})
+    # Intraday bars are UTC datetimes with formatDate=2; daily bars are dates
+    data.index = pd.DatetimeIndex(pd.to_datetime([bar.date for bar in bars], utc=True), name='timestamp')
+    data['ticker'] = ticker
+    return data
@@ -1,99 +1,116 @@
-from ib_insync import IB, Stock
+import argparse
+import contextlib
+import os
 import psycopg2
-from psycopg2 import sql, extras
+from psycopg2 import sql
 import pandas as pd
 from datetime import datetime, timedelta
+from db.connection import transaction
+from db.schema import MINUTE_BARS_HYPERTABLE, PRICE_COLUMNS, ensure_bar_rollups, ensure_float_columns, ensure_hypertable
+from ingestion.incremental import MINUTE_BARS_OVERLAP, fetch_start_times
+from ingestion.runner import INGESTION_WORKERS, run_ingestion_pass
+from ingestion.spool import get_spool
+from ibkr_historical_client import IBKRHistoricalClient
 
-# Database connection parameters
-DB_HOST = "localhost"
-DB_PORT = "5432"
-DB_NAME = "research"
-DB_USER = "myuser"
-DB_PASSWORD = "mypassword"
+# Tickers to ingest, read from next to this script wherever it runs from
+TICKERS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tickers.csv')
+
+# Database tables; the connection parameters come from the POSTGRES_* environment variables
 TABLE_NAME = "ibkr_minute"
+# Bars tables whose schema setup has run in this process; a failed setup is tried again by the next pass
+_prepared_tables = set()
 
-def fetch_minute_data(ticker_symbol):
-    """Fetch minute data for a given ticker symbol from Interactive Brokers."""
-    ib = IB()
-    ib.connect('127.0.0.1', 7497, clientId=1)
-    contract = Stock(ticker_symbol, 'SMART', 'USD')
-    end_date = datetime.now().strftime('%Y%m%d %H:%M:%S')
-    start_date = (datetime.now() - timedelta(days=5)).strftime('%Y%m%d %H:%M:%S')
-    bars = ib.reqHistoricalData(
-        contract, endDateTime=end_date, durationStr='5 D',
-        barSizeSetting='1 min', whatToShow='TRADES', useRTH=True
-    )
-    data = pd.DataFrame(bars)
-    data['ticker'] = ticker_symbol  # Add ticker column
-    ib.disconnect()
-    return data
+def fetch_minute_data(ticker_symbol, client, start):
+    """Fetch minute data for a given ticker symbol from Interactive Brokers, from the given start time up to now."""
+    # The client splits long ranges into chunks and paces the requests over its one connection
+    return client.fetch_bars(ticker_symbol, start, datetime.utcnow(), '1 min')
 
-def store_data_in_db(data, table_name):
-    """Store the fetched data into a PostgreSQL database."""
+def ensure_bars_table(table_name):
+    """Create the bars table if needed and bring its schema up to date, once per process; later calls return at once."""
+    if table_name in _prepared_tables:
+        return
     try:
-        # Connect to the PostgreSQL database
-        connection = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        
-        # Create a cursor object
-        cursor = connection.cursor()
-        
-        # Create table if it doesn't exist
-        create_table_query = sql.SQL("""
-            CREATE TABLE IF NOT EXISTS {table} (
-                datetime TIMESTAMP,
-                ticker VARCHAR(10),
-                open NUMERIC,
-                high NUMERIC,
-                low NUMERIC,
-                close NUMERIC,
-                volume BIGINT,
-                PRIMARY KEY (datetime, ticker)
-            );
-        """).format(table=sql.Identifier(table_name))
-        
-        cursor.execute(create_table_query)
-        connection.commit()
-        
-        # Use execute_batch for faster inserts
-        insert_query = sql.SQL("""
-            INSERT INTO {table} (datetime, ticker, open, high, low, close, volume)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (datetime, ticker) DO NOTHING;
-        """).format(table=sql.Identifier(table_name))
-        
-        psycopg2.extras.execute_batch(cursor, insert_query, 
-            [(row['date'], row['ticker'], row['open'], row['high'], row['low'], row['close'], row['volume']) for index, row in data.iterrows()])
-        
-        connection.commit()
-        #print("Data stored successfully!")
+        with transaction() as cursor:
+            # Create table if it doesn't exist
+            create_table_query = sql.SQL("""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    datetime TIMESTAMP,
+                    ticker VARCHAR(10),
+                    open DOUBLE PRECISION,
+                    high DOUBLE PRECISION,
+                    low DOUBLE PRECISION,
+                    close DOUBLE PRECISION,
+                    volume BIGINT,
+                    PRIMARY KEY (ticker, datetime)
+                );
+            """).format(table=sql.Identifier(table_name))
+            
+            cursor.execute(create_table_query)
+            # Tables created before the prices were float8 store them as NUMERIC
+            ensure_float_columns(cursor, table_name, PRICE_COLUMNS)
+            # Chunk the bars on datetime and compress old chunks per ticker
+            ensure_hypertable(cursor, table_name, **MINUTE_BARS_HYPERTABLE)
+            # Derive the 5m, 15m, 1h and 1d bars from the minute bars
+            ensure_bar_rollups(cursor, table_name, MINUTE_BARS_HYPERTABLE['retain_for'])
+        _prepared_tables.add(table_name)
 
     except psycopg2.Error as e:
-        print(f"Error storing data in PostgreSQL database: {e}")
-    finally:
-        # Close the cursor and connection
-        if 'cursor' in locals():
-            cursor.close()
-        if 'connection' in locals():
-            connection.close()
+        print(f"Error preparing {table_name} in PostgreSQL database: {e}")
+
+def store_data_in_db(data, table_name):
+    """Spool the fetched data for the PostgreSQL database; bars fetched again in the overlap replace the stored ones once loaded."""
+    # The table stores UTC datetimes without a time zone
+    bars = pd.DataFrame({
+        'datetime': data.index.tz_convert('UTC').tz_localize(None),
+        'ticker': data['ticker'].to_numpy(),
+        'open': data['open'].to_numpy(),
+        'high': data['high'].to_numpy(),
+        'low': data['low'].to_numpy(),
+        'close': data['close'].to_numpy(),
+        'volume': data['volume'].to_numpy(dtype='int64'),
+    })
+    
+    # Acknowledge the bars once they are on local disk; the spool's flusher bulk loads them with COPY as soon as the database takes them
+    get_spool().append(table_name, bars)
 
 def get_tickers_from_csv(file_path):
     """Read tickers from a CSV file."""
     tickers = pd.read_csv(file_path, header=None).squeeze().tolist()
     return [ticker.strip().strip('"') for ticker in tickers]
 
+def run_pass(workers=INGESTION_WORKERS, start=None, client=None):
+    """
+    Fetch the minute bars of every ticker in tickers.csv and store them in the database.
+
+    Parameters:
+    workers (int): Tickers fetched concurrently.
+    start (datetime): Backfill every ticker from this date instead of from its latest stored bar.
+    client (IBKRHistoricalClient): A client to keep across passes; one for this pass when omitted.
+
+    Returns:
+    pd.DataFrame: The report of the pass, see run_ingestion_pass.
+    """
+    tickers = get_tickers_from_csv(TICKERS_PATH)
+    ensure_bars_table(TABLE_NAME)
+    # Request only the bars after each ticker's latest stored bar, less a small overlap; tickers without
+    # bars get the last 5 days. A backfill start is split into chunks by the client
+    if start is not None:
+        start_times = {ticker_symbol: start for ticker_symbol in tickers}
+    else:
+        start_times = fetch_start_times(TABLE_NAME, tickers, datetime.utcnow() - timedelta(days=5), MINUTE_BARS_OVERLAP)
+    # One connection to the gateway for the pass, shared by the fetch threads, unless the caller keeps one across passes
+    with IBKRHistoricalClient() if client is None else contextlib.nullcontext(client) as client:
+        # Fetch the tickers concurrently while a writer thread stores the ones already downloaded
+        return run_ingestion_pass(tickers, lambda ticker_symbol: fetch_minute_data(ticker_symbol, client, start_times[ticker_symbol]),
+                                  lambda ticker_symbol, minute_data: store_data_in_db(minute_data, TABLE_NAME), 'ibkr', workers=workers)
+
 # Example usage
 if __name__ == "__main__":
-    tickers = get_tickers_from_csv('./Research/interactive_brokers/tickers.csv')
-    for ticker_symbol in tickers:
-        minute_data = fetch_minute_data(ticker_symbol)
-        if not minute_data.empty:
-            store_data_in_db(minute_data, TABLE_NAME)
-            #print(f"Data for {ticker_symbol} stored successfully!")
-        else:
-            print(f"No data to display for {ticker_symbol}.")
+    parser = argparse.ArgumentParser(description="Fetch the minute bars of every ticker in tickers.csv from Interactive Brokers and store them in the database.")
+    parser.add_argument('--workers', type=int, default=INGESTION_WORKERS,
+                        help="Tickers fetched concurrently; requests to ibkr are also capped by INGESTION_IBKR_CONCURRENCY")
+    parser.add_argument('--start', type=pd.Timestamp,
+                        help="Backfill every ticker from this date (UTC) instead of from its latest stored bar")
+    args = parser.parse_args()
+    
+    run_pass(args.workers, args.start)
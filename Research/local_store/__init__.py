@@ -0,0 +1 @@
+"""Local on-disk copies of the database tables for repeated research runs."""
@@ -0,0 +1,239 @@
+import argparse
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import psycopg2
+from db.copy_reader import iter_copy_dataframes
+from db.fetch import DEFAULT_CHUNK_SIZE, bars_query, iter_ticker_frames
+
+# Root of the bar store; each source table gets a directory with one subdirectory of column files per ticker
+BAR_STORE_DIR = os.environ.get("BAR_STORE_DIR", os.path.expanduser(os.path.join("~", ".cache", "research_bar_store")))
+INDEX_FILE_NAME = "index.json"
+
+
+def build_bar_store(source, tickers=None, columns=None, store_dir=BAR_STORE_DIR, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Export a table from the database into the bar store, one ticker at a time.
+
+    Every column becomes a fixed-width .npy file per ticker, in datetime order: float64 for float columns,
+    int64 for integer columns, datetime64[us] for datetimes and int64 codes for text columns. The index file
+    records the column kinds, the labels of the text columns and the row count and time range of every ticker.
+    Tickers are exported whole and replace their earlier export.
+
+    Parameters:
+    source (str): The table to export, e.g. 'ticker_minute_indicators'.
+    tickers (list): Only export these tickers; every ticker in the table when omitted.
+    columns (list): The columns to export, including 'datetime' and 'ticker'; all columns when omitted.
+    store_dir (str): The bar store root directory.
+    chunk_size (int): The number of rows decoded from the database at a time.
+
+    Returns:
+    int: The number of rows exported.
+    """
+    source_dir = os.path.join(store_dir, source)
+    index = load_bar_store_index(source, store_dir)
+    query, params = bars_query(source, columns, tickers)
+
+    rows_written = 0
+    for ticker, ticker_data in iter_ticker_frames(query, params, chunk_size=chunk_size, reader=iter_copy_dataframes):
+        ticker_data = ticker_data.drop(columns=['ticker'])
+        if index['columns'] is None:
+            index['columns'] = {column: _column_kind(dtype) for column, dtype in ticker_data.dtypes.items()}
+        elif list(index['columns']) != list(ticker_data.columns):
+            raise ValueError(f"The bar store of {source} holds columns {list(index['columns'])}, not {list(ticker_data.columns)}; "
+                             f"export into an empty directory to change them.")
+        _write_ticker(source_dir, ticker, ticker_data, index)
+        index['tickers'][ticker] = {
+            'rows': len(ticker_data),
+            'start': ticker_data['datetime'].iloc[0].isoformat(),
+            'end': ticker_data['datetime'].iloc[-1].isoformat(),
+        }
+        _save_index(source_dir, index)
+        rows_written += len(ticker_data)
+    return rows_written
+
+
+def load_bar_store_index(source, store_dir=BAR_STORE_DIR):
+    """
+    Load the index of a source in the bar store.
+
+    Parameters:
+    source (str): The exported table.
+    store_dir (str): The bar store root directory.
+
+    Returns:
+    dict: 'columns' maps each column to 'float', 'int', 'datetime' or 'label' (None before the first export),
+          'labels' the labels of each text column and 'tickers' the 'rows', 'start' and 'end' of each ticker.
+    """
+    path = os.path.join(store_dir, source, INDEX_FILE_NAME)
+    if not os.path.exists(path):
+        return {'columns': None, 'labels': {}, 'tickers': {}}
+    with open(path) as index_file:
+        return json.load(index_file)
+
+
+def open_ticker_arrays(source, ticker, columns=None, store_dir=BAR_STORE_DIR):
+    """
+    Memory-map the column files of one ticker read-only.
+
+    Nothing is read until the arrays are used, and processes mapping the same files share their pages
+    through the OS page cache. Text columns are returned as their int64 codes, see load_bar_store_index.
+
+    Parameters:
+    source (str): The exported table.
+    ticker (str): The ticker to open.
+    columns (list): The columns to open; all exported columns when omitted. 'ticker' is ignored.
+    store_dir (str): The bar store root directory.
+
+    Returns:
+    dict: The np.memmap of every requested column, keyed by column name.
+    """
+    if columns is None:
+        columns = list(load_bar_store_index(source, store_dir)['columns'] or [])
+    ticker_dir = os.path.join(store_dir, source, ticker)
+    return {column: np.load(os.path.join(ticker_dir, f"{column}.npy"), mmap_mode='r')
+            for column in columns if column != 'ticker'}
+
+
+def read_ticker_frame(source, ticker, start=None, end=None, columns=None, store_dir=BAR_STORE_DIR, index=None):
+    """
+    Read one ticker of the bar store as a DataFrame backed by the memory-mapped column files.
+
+    The time range is found by binary search on the datetime file, and the numeric columns of the frame
+    are views of the mapped files rather than copies. Only the text columns are decoded into memory.
+
+    Parameters:
+    source (str): The exported table.
+    ticker (str): The ticker to read.
+    start (datetime): Only rows at or after this datetime.
+    end (datetime): Only rows before this datetime.
+    columns (list): The columns to return; all exported columns when omitted.
+    store_dir (str): The bar store root directory.
+    index (dict): The loaded index of the source, to avoid reading it again for every ticker.
+
+    Returns:
+    pd.DataFrame: The rows in datetime order with a RangeIndex, with the same columns as a database read.
+    """
+    index = index if index is not None else load_bar_store_index(source, store_dir)
+    if index['columns'] is None or ticker not in index['tickers']:
+        raise KeyError(f"{ticker} is not in the bar store of {source}")
+    columns = list(columns) if columns else ['datetime', 'ticker', *[column for column in index['columns'] if column != 'datetime']]
+    arrays = open_ticker_arrays(source, ticker, set(columns) | {'datetime'}, store_dir)
+
+    datetimes = arrays['datetime']
+    first = 0 if start is None else np.searchsorted(datetimes, np.datetime64(pd.Timestamp(start), 'us'), side='left')
+    last = len(datetimes) if end is None else np.searchsorted(datetimes, np.datetime64(pd.Timestamp(end), 'us'), side='left')
+
+    data = {}
+    for column in columns:
+        if column == 'ticker':
+            data[column] = pd.Categorical.from_codes(np.zeros(last - first, dtype=np.int8), categories=[ticker])
+        elif index['columns'][column] == 'label':
+            data[column] = pd.Categorical.from_codes(arrays[column][first:last], categories=index['labels'][column])
+        else:
+            data[column] = arrays[column][first:last]
+    return pd.DataFrame(data, copy=False)
+
+
+def iter_bar_store_frames(source, tickers=None, start=None, end=None, columns=None, store_dir=BAR_STORE_DIR):
+    """
+    Read the bar store one ticker at a time, like iter_ticker_frames on a database query.
+
+    Parameters:
+    source (str): The exported table.
+    tickers (list): Only these tickers, or a single ticker as a string; every exported ticker when omitted.
+    start (datetime): Only rows at or after this datetime.
+    end (datetime): Only rows before this datetime.
+    columns (list): The columns to return; all exported columns when omitted.
+    store_dir (str): The bar store root directory.
+
+    Yields:
+    tuple: (ticker, pd.DataFrame) in ticker order, skipping tickers without rows in the time range.
+    """
+    index = load_bar_store_index(source, store_dir)
+    if tickers is None:
+        tickers = list(index['tickers'])
+    elif isinstance(tickers, str):
+        tickers = [tickers]
+    for ticker in sorted(ticker for ticker in tickers if ticker in index['tickers']):
+        ticker_data = read_ticker_frame(source, ticker, start, end, columns, store_dir, index)
+        if not ticker_data.empty:
+            yield ticker, ticker_data
+
+
+def _column_kind(dtype):
+    """Return how a column of the given dtype is stored: 'float', 'int', 'datetime' or 'label'."""
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return 'datetime'
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return 'int'
+    if pd.api.types.is_numeric_dtype(dtype):
+        return 'float'
+    return 'label'
+
+
+def _column_values(series, kind, labels):
+    """Convert a column to the fixed-width array it is stored as, appending unseen text values to labels."""
+    if kind == 'datetime':
+        return series.to_numpy(dtype='datetime64[us]')
+    if kind == 'float':
+        return series.to_numpy(dtype=np.float64, na_value=np.nan)
+    if kind == 'label':
+        # Codes index the labels kept in the index file, and -1 marks a NULL as in pd.Categorical
+        values = series.astype(object)
+        known = set(labels)
+        labels.extend(value for value in values.dropna().unique() if value not in known)
+        return pd.Categorical(values, categories=labels).codes.astype(np.int64)
+    if series.isna().any():
+        raise ValueError(f"Integer column {series.name} holds NULLs, which int64 files cannot store")
+    return series.to_numpy(dtype=np.int64)
+
+
+def _write_ticker(source_dir, ticker, df, index):
+    """Write the column files of one ticker next to its current export, then swap the directories."""
+    ticker_dir = os.path.join(source_dir, ticker)
+    # Directories starting with a dot are never opened by readers
+    temporary_dir = os.path.join(source_dir, f".{ticker}.tmp")
+    previous_dir = os.path.join(source_dir, f".{ticker}.old")
+    for leftover_dir in [temporary_dir, previous_dir]:
+        shutil.rmtree(leftover_dir, ignore_errors=True)
+    os.makedirs(temporary_dir)
+
+    for column, kind in index['columns'].items():
+        values = _column_values(df[column], kind, index['labels'].setdefault(column, []) if kind == 'label' else None)
+        np.save(os.path.join(temporary_dir, f"{column}.npy"), values)
+
+    # Save the labels of any new text values before the codes that use them become visible
+    _save_index(source_dir, index)
+    # Processes that still map the previous files keep reading them until they close them
+    if os.path.exists(ticker_dir):
+        os.replace(ticker_dir, previous_dir)
+    os.replace(temporary_dir, ticker_dir)
+    shutil.rmtree(previous_dir, ignore_errors=True)
+
+
+def _save_index(source_dir, index):
+    """Write the index of a source atomically."""
+    os.makedirs(source_dir, exist_ok=True)
+    path = os.path.join(source_dir, INDEX_FILE_NAME)
+    with open(f"{path}.tmp", "w") as index_file:
+        json.dump(index, index_file)
+    os.replace(f"{path}.tmp", path)
+
+
+# Example usage
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a bars or indicators table into the memory-mapped bar store.")
+    parser.add_argument('source', nargs='?', default='ticker_minute_indicators',
+                        help="The table to export, e.g. alpaca_minute or ticker_minute_indicators")
+    parser.add_argument('--tickers', nargs='+',
+                        help="Only export these tickers, e.g. --tickers AAPL MSFT; every ticker when omitted")
+    args = parser.parse_args()
+
+    try:
+        rows = build_bar_store(args.source, args.tickers)
+        print(f"Exported {rows:,} rows of {args.source} to {os.path.join(BAR_STORE_DIR, args.source)}")
+    except psycopg2.Error as e:
+        print(f"Error exporting {args.source} from PostgreSQL database: {e}")
@@ -0,0 +1,223 @@
+import json
+import os
+import pandas as pd
+from db.copy_reader import iter_copy_dataframes
+from db.fetch import DEFAULT_CHUNK_SIZE, iter_ticker_frames
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is only needed by the research runs that use the cache
+    pa = ds = pq = None
+
+# Root of the local cache; each source table gets a directory of ticker=<ticker>/date=<YYYY-MM-DD> partitions
+PARQUET_CACHE_DIR = os.environ.get("PARQUET_CACHE_DIR", os.path.expanduser(os.path.join("~", ".cache", "research_parquet")))
+MANIFEST_FILE_NAME = "_manifest.json"
+
+
+def sync_cache(source, tickers=None, cache_dir=PARQUET_CACHE_DIR, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Bring the local Parquet copy of a table up to date with the database.
+
+    Each ticker is read again from the start of the day of its latest cached bar, so the one date partition
+    that may have been incomplete is rewritten whole and every later day is written once. Tickers that are
+    not cached yet are read in full. Rows that change in the database before that day are not picked up;
+    remove the source directory to rebuild it, e.g. after a strategy's --full-rebuild.
+
+    Parameters:
+    source (str): The table to mirror, e.g. 'alpaca_minute' or 'ticker_minute_indicators'.
+    tickers (list): Only sync these tickers; every ticker in the table when omitted.
+    cache_dir (str): The cache root directory.
+    chunk_size (int): The number of rows decoded from the database at a time.
+
+    Returns:
+    int: The number of rows written to the cache.
+    """
+    _require_pyarrow()
+    source_dir = os.path.join(cache_dir, source)
+    manifest = _load_manifest(source_dir)
+    marks = manifest['marks']
+
+    cached_tickers = [ticker for ticker in marks if tickers is None or ticker in tickers]
+    conditions = ["(marks.since IS NULL OR bars.datetime >= marks.since)"]
+    params = [cached_tickers, [pd.Timestamp(marks[ticker]).normalize().to_pydatetime() for ticker in cached_tickers]]
+    if tickers is not None:
+        conditions.append("bars.ticker = ANY(%s)")
+        params.append(list(tickers))
+    query = f"""
+    SELECT bars.* FROM {source} AS bars
+    LEFT JOIN unnest(%s::text[], %s::timestamp[]) AS marks(ticker, since) ON marks.ticker = bars.ticker
+    WHERE {' AND '.join(conditions)}
+    ORDER BY bars.ticker, bars.datetime;
+    """
+
+    rows_written = 0
+    for ticker, ticker_data in iter_ticker_frames(query, params, chunk_size=chunk_size, reader=iter_copy_dataframes):
+        if manifest['columns'] is None:
+            manifest['columns'] = list(ticker_data.columns)
+        days = ticker_data['datetime'].dt.strftime('%Y-%m-%d')
+        data = ticker_data.drop(columns=['ticker'])
+        schema = _arrow_schema(data)
+        for day, day_data in data.groupby(days, sort=False):
+            _write_partition(os.path.join(source_dir, f"ticker={ticker}", f"date={day}"), day_data, schema)
+        rows_written += len(ticker_data)
+        # Record progress per ticker so an interrupted sync resumes where it stopped
+        marks[ticker] = ticker_data['datetime'].max().isoformat()
+        _save_manifest(source_dir, manifest)
+    return rows_written
+
+
+def iter_cache_ticker_frames(source, tickers=None, start=None, end=None, columns=None, cache_dir=PARQUET_CACHE_DIR):
+    """
+    Read the cached rows of a table one ticker at a time, reading only the needed partitions and columns.
+
+    Parameters:
+    source (str): The cached table.
+    tickers (list): Only these tickers, or a single ticker as a string; every cached ticker when omitted.
+    start (datetime): Only rows at or after this datetime.
+    end (datetime): Only rows before this datetime.
+    columns (list): The columns to return; all columns when omitted.
+    cache_dir (str): The cache root directory.
+
+    Yields:
+    tuple: (ticker, pd.DataFrame) in ticker order, each frame in datetime order with a fresh RangeIndex.
+    """
+    _require_pyarrow()
+    source_dir = os.path.join(cache_dir, source)
+    manifest = _load_manifest(source_dir)
+    if manifest['columns'] is None:
+        return
+    if tickers is None:
+        tickers = sorted(manifest['marks'])
+    elif isinstance(tickers, str):
+        tickers = [tickers]
+    columns = list(columns) if columns else manifest['columns']
+    file_columns = [column for column in columns if column != 'ticker']
+    if 'datetime' not in file_columns:
+        file_columns.append('datetime')
+
+    # Prune on the date partitions first, then on the datetime column inside the remaining files
+    filter_expression = None
+    if start is not None:
+        start = pd.Timestamp(start)
+        filter_expression = (ds.field('date') >= start.strftime('%Y-%m-%d')) & (ds.field('datetime') >= pa.scalar(start.to_pydatetime(), pa.timestamp('us')))
+    if end is not None:
+        end = pd.Timestamp(end)
+        end_expression = (ds.field('date') <= end.strftime('%Y-%m-%d')) & (ds.field('datetime') < pa.scalar(end.to_pydatetime(), pa.timestamp('us')))
+        filter_expression = end_expression if filter_expression is None else filter_expression & end_expression
+
+    for ticker in sorted(tickers):
+        ticker_dir = os.path.join(source_dir, f"ticker={ticker}")
+        if not os.path.isdir(ticker_dir):
+            continue
+        dataset = ds.dataset(ticker_dir, format='parquet', partitioning=ds.partitioning(pa.schema([('date', pa.string())]), flavor='hive'))
+        ticker_data = dataset.to_table(columns=file_columns, filter=filter_expression).to_pandas()
+        if ticker_data.empty:
+            continue
+        ticker_data = ticker_data.sort_values('datetime', kind='stable', ignore_index=True)
+        ticker_data['ticker'] = ticker
+        yield ticker, ticker_data[columns]
+
+
+def read_cache(source, tickers=None, start=None, end=None, columns=None, cache_dir=PARQUET_CACHE_DIR):
+    """
+    Read cached rows of a table as one DataFrame, like fetch_dataframe(*bars_query(...)) on the database.
+
+    Parameters:
+    source (str): The cached table.
+    tickers (list): Only these tickers, or a single ticker as a string; every cached ticker when omitted.
+    start (datetime): Only rows at or after this datetime.
+    end (datetime): Only rows before this datetime.
+    columns (list): The columns to return; all columns when omitted.
+    cache_dir (str): The cache root directory.
+
+    Returns:
+    pd.DataFrame: The rows ordered by ticker and datetime.
+    """
+    frames = [ticker_data for _, ticker_data in iter_cache_ticker_frames(source, tickers, start, end, columns, cache_dir)]
+    if not frames:
+        return pd.DataFrame(columns=list(columns) if columns else _load_manifest(os.path.join(cache_dir, source))['columns'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def fetch_cached(source, tickers=None, start=None, end=None, columns=None, sync=True, cache_dir=PARQUET_CACHE_DIR):
+    """
+    Sync the requested tickers of a table into the local cache and read them from disk.
+
+    A drop-in for fetch_data_from_db in research runs: the first run pulls the rows from the database,
+    later runs only pull the bars added since and read the rest locally.
+
+    Parameters:
+    source (str): The table to read, e.g. 'ticker_minute_indicators'.
+    tickers (list): Only these tickers, or a single ticker as a string; every ticker when omitted.
+    start (datetime): Only rows at or after this datetime.
+    end (datetime): Only rows before this datetime.
+    columns (list): The columns to return; all columns when omitted.
+    sync (bool): Read the database for new rows first; False reads the cache as it is, e.g. offline.
+    cache_dir (str): The cache root directory.
+
+    Returns:
+    pd.DataFrame: The rows ordered by ticker and datetime.
+    """
+    if isinstance(tickers, str):
+        tickers = [tickers]
+    if sync:
+        sync_cache(source, tickers, cache_dir)
+    return read_cache(source, tickers, start, end, columns, cache_dir)
+
+
+def _require_pyarrow():
+    """Raise a clear error when the optional pyarrow dependency is missing."""
+    if pa is None:
+        raise ImportError("The Parquet cache needs pyarrow; install it with 'pip install pyarrow'.")
+
+
+def _arrow_schema(df):
+    """
+    Return a fixed Arrow schema for a frame decoded by the COPY reader.
+
+    Every partition of a source must have the same schema, so column types follow the dtype kind instead of
+    the values of one partition: an integer column with NULLs stays int64 and an all-NULL text column string.
+    """
+    fields = []
+    for column, dtype in df.dtypes.items():
+        if pd.api.types.is_bool_dtype(dtype):
+            arrow_type = pa.bool_()
+        elif pd.api.types.is_integer_dtype(dtype):
+            arrow_type = pa.int64()
+        elif pd.api.types.is_float_dtype(dtype):
+            arrow_type = pa.float64()
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            arrow_type = pa.timestamp('us', tz=getattr(dtype, 'tz', None))
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column, arrow_type))
+    return pa.schema(fields)
+
+
+def _write_partition(partition_dir, df, schema):
+    """Replace the data file of one date partition, writing to a temporary file first so readers never see half a file."""
+    os.makedirs(partition_dir, exist_ok=True)
+    # Datasets skip files starting with a dot, so a temporary file left by an interrupted sync is never read
+    temporary_path = os.path.join(partition_dir, ".part-0.parquet.tmp")
+    pq.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False), temporary_path)
+    os.replace(temporary_path, os.path.join(partition_dir, "part-0.parquet"))
+
+
+def _load_manifest(source_dir):
+    """Load the column order and per-ticker latest cached datetime of a source."""
+    path = os.path.join(source_dir, MANIFEST_FILE_NAME)
+    if not os.path.exists(path):
+        return {'columns': None, 'marks': {}}
+    with open(path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def _save_manifest(source_dir, manifest):
+    """Write the manifest of a source atomically."""
+    os.makedirs(source_dir, exist_ok=True)
+    path = os.path.join(source_dir, MANIFEST_FILE_NAME)
+    with open(f"{path}.tmp", "w") as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(f"{path}.tmp", path)
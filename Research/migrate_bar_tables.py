@@ -0,0 +1,35 @@
+import psycopg2
+from db.connection import transaction
+from db.schema import DAILY_BARS_HYPERTABLE, MINUTE_BARS_HYPERTABLE, PRICE_COLUMNS, ensure_bar_rollups, ensure_float_columns, ensure_hypertable
+
+# The connection parameters come from the POSTGRES_* environment variables; set POSTGRES_HOST=localhost
+# when running this outside the compose network
+
+# Bar tables written by the ingestion scripts
+MINUTE_BAR_TABLES = ["alpaca_minute", "yfinance_minute", "ibkr_minute"]
+DAILY_BAR_TABLES = ["alpaca_daily", "yfinance_daily", "ibkr_daily"]
+
+def migrate_bar_tables():
+    """Store the prices of the existing bar tables as float8, convert the tables into compressed hypertables, apply the configured policies and derive the minute rollups."""
+    for tables, policy in [(MINUTE_BAR_TABLES, MINUTE_BARS_HYPERTABLE), (DAILY_BAR_TABLES, DAILY_BARS_HYPERTABLE)]:
+        for table_name in tables:
+            try:
+                # One transaction per table, since migrating the rows of a large table takes a while
+                with transaction() as cursor:
+                    cursor.execute("SELECT to_regclass(%s);", (table_name,))
+                    if cursor.fetchone()[0] is None:
+                        print(f"Skipping {table_name}, it does not exist yet.")
+                        continue
+                    ensure_float_columns(cursor, table_name, PRICE_COLUMNS)
+                    ensure_hypertable(cursor, table_name, **policy)
+                    if tables is MINUTE_BAR_TABLES:
+                        ensure_bar_rollups(cursor, table_name, policy['retain_for'])
+
+                print(f"{table_name} migrated successfully!")
+
+            except psycopg2.Error as e:
+                print(f"Error migrating {table_name} in PostgreSQL database: {e}")
+
+# Example usage
+if __name__ == "__main__":
+    migrate_bar_tables()
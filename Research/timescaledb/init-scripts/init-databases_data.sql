@@ -1,3 +1,7 @@
 -- init-databases.sql
 CREATE DATABASE research;
 CREATE DATABASE trading;
+
+-- The bar tables of the research database are TimescaleDB hypertables
+\connect research
+CREATE EXTENSION IF NOT EXISTS timescaledb;
@@ -1,94 +1,110 @@
+import argparse
+import os
 import yfinance as yf
 import psycopg2
 from psycopg2 import sql
 import csv
 import pandas as pd
 from datetime import datetime, timedelta
+from db.connection import transaction
+from db.schema import DAILY_BARS_HYPERTABLE, PRICE_COLUMNS, ensure_float_columns, ensure_hypertable
+from ingestion.incremental import DAILY_BARS_OVERLAP, fetch_start_times
+from ingestion.rate_limit import call_with_retry, classify_yfinance_error, rate_limiter
+from ingestion.runner import INGESTION_WORKERS, run_ingestion_pass
+from ingestion.spool import get_spool
 
-# Database connection parameters
-DB_HOST = "postgres"
-DB_PORT = "5432"
-DB_NAME = "research"
-DB_USER = "myuser"
-DB_PASSWORD = "mypassword"
+# Tickers to ingest, read from next to this script wherever it runs from
+TICKERS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tickers.csv')
+
+# Database tables; the connection parameters come from the POSTGRES_* environment variables
 TABLE_NAME = "yfinance_daily"
+# Bars tables whose schema setup has run in this process; a failed setup is tried again by the next pass
+_prepared_tables = set()
 
-def fetch_daily_data(ticker_symbol):
-    """Fetch daily data for a given ticker symbol from Yahoo Finance."""
+def fetch_daily_data(ticker_symbol, start):
+    """Fetch daily data for a given ticker symbol from Yahoo Finance, from the given start time."""
     ticker = yf.Ticker(ticker_symbol)
-    # Fetch daily data for the last year
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=365)
-    data = ticker.history(interval="1d", start=start_date, end=end_date)
+    # Fetch the daily data after the start, up to today,
+    # under the shared Yahoo Finance quota, retrying throttled and failed requests
+    data = call_with_retry(rate_limiter('yfinance', 'history'), lambda: ticker.history(interval="1d", start=start, end=datetime.now()),
+                           classify=classify_yfinance_error)
     data['ticker'] = ticker_symbol  # Add ticker column
     return data
 
-def store_data_in_db(data, table_name):
-    """Store the fetched data into a PostgreSQL database."""
+def ensure_bars_table(table_name):
+    """Create the bars table if needed and bring its schema up to date, once per process; later calls return at once."""
+    if table_name in _prepared_tables:
+        return
     try:
-        # Connect to the PostgreSQL database
-        connection = psycopg2.connect(
-            host=DB_HOST,
-            port=DB_PORT,
-            database=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD
-        )
-        
-        # Create a cursor object
-        cursor = connection.cursor()
-        
-        # Create table if it doesn't exist
-        create_table_query = sql.SQL("""
-            CREATE TABLE IF NOT EXISTS {table} (
-                datetime TIMESTAMP,
-                ticker VARCHAR(10),
-                open NUMERIC,
-                high NUMERIC,
-                low NUMERIC,
-                close NUMERIC,
-                volume BIGINT,
-                PRIMARY KEY (datetime, ticker)
-            );
-        """).format(table=sql.Identifier(table_name))
-        
-        cursor.execute(create_table_query)
-        connection.commit()
-        
-        # Use execute_batch for faster inserts
-        insert_query = sql.SQL("""
-            INSERT INTO {table} (datetime, ticker, open, high, low, close, volume)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (datetime, ticker) DO NOTHING;
-        """).format(table=sql.Identifier(table_name))
-        
-        psycopg2.extras.execute_batch(cursor, insert_query, 
-            [(index, row['ticker'], row['Open'], row['High'], row['Low'], row['Close'], row['Volume']) for index, row in data.iterrows()])
-        
-        connection.commit()
-        #print("Data stored successfully!")
+        with transaction() as cursor:
+            # Create table if it doesn't exist
+            create_table_query = sql.SQL("""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    datetime TIMESTAMP,
+                    ticker VARCHAR(10),
+                    open DOUBLE PRECISION,
+                    high DOUBLE PRECISION,
+                    low DOUBLE PRECISION,
+                    close DOUBLE PRECISION,
+                    volume BIGINT,
+                    PRIMARY KEY (ticker, datetime)
+                );
+            """).format(table=sql.Identifier(table_name))
+            
+            cursor.execute(create_table_query)
+            # Tables created before the prices were float8 store them as NUMERIC
+            ensure_float_columns(cursor, table_name, PRICE_COLUMNS)
+            # Chunk the bars on datetime and compress old chunks per ticker
+            ensure_hypertable(cursor, table_name, **DAILY_BARS_HYPERTABLE)
+        _prepared_tables.add(table_name)
 
     except psycopg2.Error as e:
-        print(f"Error storing data in PostgreSQL database: {e}")
-    finally:
-        # Close the cursor and connection
-        if 'cursor' in locals():
-            cursor.close()
-        if 'connection' in locals():
-            connection.close()
+        print(f"Error preparing {table_name} in PostgreSQL database: {e}")
+
+def store_data_in_db(data, table_name):
+    """Spool the fetched data for the PostgreSQL database; bars fetched again in the overlap replace the stored ones once loaded."""
+    # The table stores UTC datetimes without a time zone
+    bars = pd.DataFrame({
+        'datetime': data.index.tz_convert('UTC').tz_localize(None),
+        'ticker': data['ticker'].to_numpy(),
+        'open': data['Open'].to_numpy(),
+        'high': data['High'].to_numpy(),
+        'low': data['Low'].to_numpy(),
+        'close': data['Close'].to_numpy(),
+        'volume': data['Volume'].to_numpy(dtype='int64'),
+    })
+    
+    # Acknowledge the bars once they are on local disk; the spool's flusher bulk loads them with COPY as soon as the database takes them
+    get_spool().append(table_name, bars)
 
 def get_tickers_from_csv(file_path):
     """Read tickers from a CSV file."""
     tickers = pd.read_csv(file_path, header=None).squeeze().tolist()
     return [ticker.strip().strip('"') for ticker in tickers]
 
+def run_pass(workers=INGESTION_WORKERS):
+    """
+    Fetch the daily bars of every ticker in tickers.csv and store them in the database.
+
+    Parameters:
+    workers (int): Tickers fetched concurrently.
+
+    Returns:
+    pd.DataFrame: The report of the pass, see run_ingestion_pass.
+    """
+    tickers = get_tickers_from_csv(TICKERS_PATH)
+    ensure_bars_table(TABLE_NAME)
+    # Request only the bars after each ticker's latest stored bar, less a small overlap; tickers without
+    # bars get the last year
+    start_times = fetch_start_times(TABLE_NAME, tickers, pd.Timestamp.now(tz='UTC') - timedelta(days=365), DAILY_BARS_OVERLAP)
+    # Fetch the tickers concurrently while a writer thread stores the ones already downloaded
+    return run_ingestion_pass(tickers, lambda ticker_symbol: fetch_daily_data(ticker_symbol, start_times[ticker_symbol]), lambda ticker_symbol, daily_data: store_data_in_db(daily_data, TABLE_NAME), 'yfinance', workers=workers)
+
 # Example usage
 if __name__ == "__main__":
-    tickers = get_tickers_from_csv('tickers.csv')
-    for ticker_symbol in tickers:
-        daily_data = fetch_daily_data(ticker_symbol)
-        if not daily_data.empty:
-            store_data_in_db(daily_data, TABLE_NAME)
-            #print(f"Data for {ticker_symbol} stored successfully!")
-        else:
-            print(f"No data to display for {ticker_symbol}.")
+    parser = argparse.ArgumentParser(description="Fetch the daily bars of every ticker in tickers.csv and store them in the database.")
+    parser.add_argument('--workers', type=int, default=INGESTION_WORKERS,
+                        help="Tickers fetched concurrently; requests to yfinance are also capped by INGESTION_YFINANCE_CONCURRENCY")
+    args = parser.parse_args()
+    
+    run_pass(args.workers)
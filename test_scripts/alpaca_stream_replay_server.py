@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+import pandas as pd
+import websockets
+
+# Make the stub server's synthetic bars importable when run from the repository root
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from alpaca_stub_server import synthetic_bars
+
+class StreamReplayServer:
+    """
+    Replay recorded bars like the Alpaca real-time market data stream.
+
+    A connection is greeted, authenticated and subscribed as by the stream, with the same control and error
+    messages. Once the first connection subscribes, the bars are replayed a minute at a time, one minute
+    every `interval` seconds on the wall-clock grid of the interval, to every connection subscribed to their
+    symbols. With `restamp`, every bar is stamped with the minute that closed as it was sent, as live bars
+    are. With `drop_after`, every connection is closed once before that many minutes have been sent, and
+    the bars of the minutes sent while no one is subscribed are lost, as they are for a real disconnect.
+    The send time of every bar is kept in `sent`, keyed by symbol and bar timestamp.
+    """
+
+    def __init__(self, bars, interval=60.0, address=('127.0.0.1', 0), key_id=None, secret_key=None, restamp=False, drop_after=None):
+        self.minutes = replay_minutes(bars)
+        self.interval = interval
+        self.address = address
+        self.key_id = key_id
+        self.secret_key = secret_key
+        self.restamp = restamp
+        self.drop_after = drop_after
+        self.subscribers = {}
+        self.connections = 0
+        self.sent = {}
+        self.missed = 0
+        self.finished = threading.Event()
+        self._ready = threading.Event()
+        self._loop = None
+        self._stop = None
+
+    @property
+    def url(self):
+        return f"ws://{self.address[0]}:{self.address[1]}"
+
+    def serve_forever(self):
+        asyncio.run(self._serve())
+
+    def shutdown(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    async def _serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._subscribed = asyncio.Event()
+        async with websockets.serve(self._handle, *self.address) as server:
+            self.address = server.sockets[0].getsockname()[:2]
+            self._ready.set()
+            replay = asyncio.create_task(self._replay())
+            await self._stop.wait()
+            replay.cancel()
+
+    async def _handle(self, websocket):
+        self.connections += 1
+        await websocket.send(json.dumps([{'T': 'success', 'msg': 'connected'}]))
+        auth = json.loads(await websocket.recv())
+        if auth.get('action') != 'auth' or (self.key_id is not None and (auth.get('key'), auth.get('secret')) != (self.key_id, self.secret_key)):
+            await websocket.send(json.dumps([{'T': 'error', 'code': 402, 'msg': 'auth failed'}]))
+            return
+        await websocket.send(json.dumps([{'T': 'success', 'msg': 'authenticated'}]))
+        try:
+            async for message in websocket:
+                request = json.loads(message)
+                if request.get('action') != 'subscribe':
+                    await websocket.send(json.dumps([{'T': 'error', 'code': 400, 'msg': 'invalid syntax'}]))
+                    continue
+                symbols = self.subscribers.setdefault(websocket, set())
+                symbols.update(request.get('bars', []))
+                await websocket.send(json.dumps([{'T': 'subscription', 'trades': [], 'quotes': [], 'bars': sorted(symbols),
+                                                  'updatedBars': sorted(request.get('updatedBars', []))}]))
+                self._subscribed.set()
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.subscribers.pop(websocket, None)
+
+    async def _replay(self):
+        await self._subscribed.wait()
+        start = (math.floor(time.time() / self.interval) + 1) * self.interval
+        for i, minute_bars in enumerate(self.minutes):
+            await asyncio.sleep(max(0.0, start + i * self.interval - time.time()))
+            if i == self.drop_after:
+                for websocket in list(self.subscribers):
+                    await websocket.close(1011, 'replay drop')
+            sent_at = time.time()
+            stamp = (datetime.fromtimestamp(sent_at, timezone.utc) - timedelta(minutes=1)).isoformat().replace('+00:00', 'Z')
+            subscribed = set()
+            for websocket, symbols in list(self.subscribers.items()):
+                messages = [dict(bar, T='b', S=symbol, t=stamp if self.restamp else bar['t'])
+                            for symbol, bar in minute_bars if symbol in symbols]
+                try:
+                    await websocket.send(json.dumps(messages))
+                except websockets.ConnectionClosed:
+                    continue
+                subscribed |= symbols
+                for message in messages:
+                    self.sent[(message['S'], message['t'])] = sent_at
+            self.missed += sum(symbol not in subscribed for symbol, _ in minute_bars)
+        self.finished.set()
+
+def replay_minutes(bars):
+    """Group bars in the response format of the bars endpoint by minute, in time order."""
+    minutes = {}
+    for symbol, symbol_bars in bars.items():
+        for bar in symbol_bars:
+            minutes.setdefault(bar['t'], []).append((symbol, bar))
+    return [minutes[t] for t in sorted(minutes)]
+
+def start_stream_replay_server(bars, interval=60.0, **kwargs):
+    """Start a replay server on a free local port in a background thread and return it once it listens."""
+    server = StreamReplayServer(bars, interval, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server._ready.wait()
+    return server
+
+# Example usage
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded or synthetic Alpaca bars as the real-time bar stream on a local port.")
+    parser.add_argument('--responses', help="JSON file of recorded bars, as written by alpaca_stub_server.py --record; synthetic bars when omitted")
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--interval', type=float, default=60.0, help="Seconds between replayed minutes")
+    parser.add_argument('--restamp', action='store_true', help="Stamp every bar with the minute that closed as it was sent")
+    args = parser.parse_args()
+
+    if args.responses:
+        with open(args.responses) as recording:
+            bars = json.load(recording)['bars']
+    else:
+        bars = synthetic_bars(pd.read_csv(os.path.join(os.path.dirname(__file__), '..', 'Research', 'alpaca', 'tickers.csv'),
+                                          header=None, skipinitialspace=True).squeeze().tolist())
+    server = StreamReplayServer(bars, args.interval, ('127.0.0.1', args.port), restamp=args.restamp)
+    print(f"Replaying the bars of {len(bars)} symbols at ws://127.0.0.1:{args.port}; set APCA_API_STREAM_URL to it")
+    server.serve_forever()
@@ -0,0 +1,168 @@
+import argparse
+import base64
+import collections
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+
+# Make the Alpaca ingestion modules importable from the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Research', 'alpaca')))
+
+def synthetic_bars(symbols, n_bars=2_730, seed=0):
+    """Build minute bars in the response format of the Alpaca bars endpoint, 390 a day from 14:30 UTC."""
+    rng = np.random.default_rng(seed)
+    days = pd.bdate_range('2024-01-02', periods=-(-n_bars // 390))
+    timestamps = (days.repeat(390) + pd.Timedelta('14:30:00') + pd.to_timedelta(np.tile(np.arange(390), len(days)), unit='min'))[:n_bars]
+    times = timestamps.strftime('%Y-%m-%dT%H:%M:%SZ').tolist()
+    bars = {}
+    for symbol in symbols:
+        close = np.round(100 + rng.standard_normal(n_bars).cumsum() * 0.05, 2).tolist()
+        volume = rng.integers(100, 50_000, n_bars).tolist()
+        bars[symbol] = [{'t': t, 'o': c, 'h': c + 0.05, 'l': c - 0.05, 'c': c, 'v': v, 'n': v // 100, 'vw': c}
+                        for t, c, v in zip(times, close, volume)]
+    return bars
+
+def record_bars(symbols, timeframe, start, end, path, key_id, secret_key):
+    """Fetch bars from the real API and save them for the stub server to replay."""
+    from alpaca_bars_client import AlpacaBarsClient
+    client = AlpacaBarsClient(key_id, secret_key)
+    bars = {}
+    for page in client.iter_bar_pages(symbols, timeframe, start, end):
+        for symbol, symbol_bars in page.items():
+            bars.setdefault(symbol, []).extend(symbol_bars)
+    with open(path, 'w') as recording:
+        json.dump({'bars': bars}, recording)
+
+class AlpacaStubServer(ThreadingHTTPServer):
+    """
+    Serve recorded bars like the Alpaca /v2/stocks/bars endpoint.
+
+    Pages follow the API: bars are ordered by symbol then time, a page holds at most `limit` bars across
+    the requested symbols, and `next_page_token` continues where the previous page stopped. Every response
+    is delayed by `latency` seconds to stand in for the round trip to the API. With `max_requests_per_second`,
+    requests over the quota get a 429 response with a Retry-After header, as the API rate limit does.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, bars, latency=0.0, address=('127.0.0.1', 0), max_requests_per_second=None):
+        super().__init__(address, StubRequestHandler)
+        self.bars = bars
+        self.latency = latency
+        self.max_requests_per_second = max_requests_per_second
+        self.requests_served = 0
+        self.requests_throttled = 0
+        self.recent_requests = collections.deque()
+        self.matches = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def over_quota(self):
+        """Count a request against the quota of the last second and return whether it is over; call with the lock held."""
+        if self.max_requests_per_second is None:
+            return False
+        now = time.monotonic()
+        while self.recent_requests and self.recent_requests[0] <= now - 1:
+            self.recent_requests.popleft()
+        if len(self.recent_requests) >= self.max_requests_per_second:
+            self.requests_throttled += 1
+            return True
+        self.recent_requests.append(now)
+        return False
+
+    def page(self, query):
+        """Build the response of one request from its query parameters."""
+        symbols = sorted(query['symbols'][0].split(','))
+        limit = int(query.get('limit', ['1000'])[0])
+        start = query.get('start', [''])[0]
+        end = query.get('end', [''])[0]
+        offset = int(base64.b64decode(query['page_token'][0])) if 'page_token' in query else 0
+        # Dates compare with the ISO timestamps as text; an end date includes the whole day
+        end = f"{end}T23:59:59Z" if len(end) == 10 else end
+        # Later pages of the same request reuse the bars matched for its first page
+        key = (tuple(symbols), start, end)
+        with self.lock:
+            matching = self.matches.get(key)
+        if matching is None:
+            matching = [(symbol, bar) for symbol in symbols for bar in self.bars.get(symbol, [])
+                        if (not start or bar['t'] >= start) and (not end or bar['t'] <= end)]
+            with self.lock:
+                self.matches[key] = matching
+        page_bars = {}
+        for symbol, bar in matching[offset:offset + limit]:
+            page_bars.setdefault(symbol, []).append(bar)
+        more = offset + limit < len(matching)
+        return {'bars': page_bars, 'next_page_token': base64.b64encode(str(offset + limit).encode()).decode() if more else None}
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """Answer bars requests from the recorded bars of the server."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/v2/stocks/bars':
+            self.send_error(404)
+            return
+        with self.server.lock:
+            self.server.requests_served += 1
+            throttled = self.server.over_quota()
+        time.sleep(self.server.latency)
+        if throttled:
+            self.send_response(429)
+            self.send_header('Retry-After', '1')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = json.dumps(self.server.page(parse_qs(url.query))).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub_server(bars, latency=0.0, max_requests_per_second=None):
+    """Start a stub server on a free local port in a background thread and return it."""
+    server = AlpacaStubServer(bars, latency, max_requests_per_second=max_requests_per_second)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# Example usage
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay recorded Alpaca bars on a local port, or record them from the API.")
+    parser.add_argument('--responses', help="JSON file of recorded bars, {'bars': {symbol: [bar, ...]}}; synthetic bars when omitted")
+    parser.add_argument('--record', nargs='+', metavar='SYMBOL',
+                        help="Record the minute bars of these symbols between --start and --end into --responses instead of serving")
+    parser.add_argument('--start', default='2024-01-02')
+    parser.add_argument('--end', default='2024-01-10')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument('--max-requests-per-second', type=int, help="Answer requests over this rate with 429")
+    args = parser.parse_args()
+
+    if args.record:
+        record_bars(args.record, '1Min', args.start, args.end, args.responses,
+                    os.environ["APCA_API_KEY_ID"], os.environ["APCA_API_SECRET_KEY"])
+        print(f"Recorded the bars of {len(args.record)} symbols to {args.responses}")
+    else:
+        if args.responses:
+            with open(args.responses) as recording:
+                bars = json.load(recording)['bars']
+        else:
+            bars = synthetic_bars(pd.read_csv(os.path.join(os.path.dirname(__file__), '..', 'Research', 'alpaca', 'tickers.csv'),
+                                              header=None, skipinitialspace=True).squeeze().tolist())
+        server = AlpacaStubServer(bars, args.latency, ('127.0.0.1', args.port), args.max_requests_per_second)
+        print(f"Serving the bars of {len(bars)} symbols at {server.url}; set APCA_API_DATA_URL to it")
+        server.serve_forever()
@@ -0,0 +1,127 @@
+import asyncio
+import time
+import numpy as np
+import pandas as pd
+from ib_insync import BarData, RequestError
+
+# Regular trading hours in UTC, 390 minute bars a day
+SESSION_OPEN = pd.Timedelta('14:30:00')
+SESSION_MINUTES = 390
+DURATION_UNITS = {'S': pd.Timedelta(seconds=1), 'D': pd.Timedelta(days=1), 'W': pd.Timedelta(weeks=1), 'Y': pd.Timedelta(days=365)}
+
+class FakeGateway:
+    """
+    Stand in for TWS / IB Gateway, serving synthetic historical bars to ib_insync-like connections.
+
+    The gateway keeps IB's historical data pacing rules and records every request that breaks them, the way
+    IB answers it with a pacing violation and no bars. Like IB, it applies the requests per window rule only to
+    the bar sizes in `window_bar_sizes`. Connecting costs `connect_latency` seconds, standing
+    in for the handshake and account download of a real connection, and every request `latency` seconds.
+    """
+
+    def __init__(self, latency=0.0, connect_latency=0.0, requests=60, window_seconds=600.0, contract_requests=6,
+                 contract_window_seconds=2.0, identical_request_seconds=15.0, max_open_requests=50,
+                 window_bar_sizes=('1 secs', '5 secs', '10 secs', '15 secs', '30 secs')):
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.requests = requests
+        self.window_seconds = window_seconds
+        self.contract_requests = contract_requests
+        self.contract_window_seconds = contract_window_seconds
+        self.identical_request_seconds = identical_request_seconds
+        self.max_open_requests = max_open_requests
+        self.window_bar_sizes = set(window_bar_sizes)
+        self.connections = 0
+        self.clients = []
+        self.request_log = []
+        self.violations = []
+        self.open_requests = 0
+        self.max_open_seen = 0
+
+    def IB(self):
+        """Return a new connection object, the way ib_insync.IB() does."""
+        client = FakeIB(self)
+        self.clients.append(client)
+        return client
+
+    def drop_connections(self):
+        """Disconnect every client, as a gateway restart does."""
+        for client in self.clients:
+            client.connected = False
+
+    def check_pacing(self, symbol, request_key, now):
+        """Return the rule a request sent now breaks, or None."""
+        # Request keys end with the bar size
+        recent = [sent for sent, _, key in self.request_log if key[-1] in self.window_bar_sizes and sent > now - self.window_seconds]
+        if request_key[-1] in self.window_bar_sizes and len(recent) >= self.requests:
+            return f"more than {self.requests} requests in {self.window_seconds}s"
+        recent_contract = [sent for sent, sent_symbol, _ in self.request_log
+                           if sent_symbol == symbol and sent > now - self.contract_window_seconds]
+        if len(recent_contract) >= self.contract_requests:
+            return f"more than {self.contract_requests} requests for {symbol} in {self.contract_window_seconds}s"
+        if any(key == request_key and sent > now - self.identical_request_seconds for sent, _, key in self.request_log):
+            return f"identical request within {self.identical_request_seconds}s"
+        if self.open_requests >= self.max_open_requests:
+            return f"more than {self.max_open_requests} open requests"
+        return None
+
+    def bars(self, symbol, end, duration, bar_size):
+        """Build the bars of a request: the regular trading hours bars in the duration before the end."""
+        count, unit = duration.split()
+        end = pd.Timestamp(end).tz_convert('UTC') if pd.Timestamp(end).tzinfo else pd.Timestamp(end).tz_localize('UTC')
+        start = end - int(count) * DURATION_UNITS[unit]
+        days = pd.bdate_range(start.normalize(), end.normalize(), tz='UTC')
+        seed = sum(symbol.encode())
+        if bar_size == '1 day':
+            dates = [day for day in days if start <= day < end]
+            closes = [100 + seed % 50 + (day.toordinal() % 23) * 0.5 for day in dates]
+            return [BarData(date=day.date(), open=c, high=c + 1, low=c - 1, close=c, volume=1_000_000.0, average=c, barCount=5_000)
+                    for day, c in zip(dates, closes)]
+        minutes = (days.repeat(SESSION_MINUTES) + SESSION_OPEN
+                   + pd.to_timedelta(np.tile(np.arange(SESSION_MINUTES), len(days)), unit='min'))
+        minutes = minutes[(minutes >= start) & (minutes < end)]
+        closes = 100 + seed % 50 + (minutes.asi8 // 60_000_000_000 % 97) * 0.01
+        return [BarData(date=minute.to_pydatetime(), open=c, high=c + 0.05, low=c - 0.05, close=c, volume=1_000.0, average=c, barCount=10)
+                for minute, c in zip(minutes, closes)]
+
+class FakeIB:
+    """The part of ib_insync.IB the historical client uses, answered by a FakeGateway."""
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+        self.connected = False
+        self.RaiseRequestErrors = False
+
+    async def connectAsync(self, host='127.0.0.1', port=7497, clientId=1, timeout=4, readonly=False, account=''):
+        await asyncio.sleep(self.gateway.connect_latency)
+        self.connected = True
+        self.gateway.connections += 1
+        return self
+
+    def isConnected(self):
+        return self.connected
+
+    def disconnect(self):
+        self.connected = False
+
+    async def reqHistoricalDataAsync(self, contract, endDateTime, durationStr, barSizeSetting, whatToShow, useRTH,
+                                     formatDate=1, keepUpToDate=False, chartOptions=[], timeout=60):
+        if not self.connected:
+            raise ConnectionError("Not connected")
+        gateway = self.gateway
+        now = time.monotonic()
+        request_key = (contract.symbol, endDateTime, durationStr, barSizeSetting)
+        violation = gateway.check_pacing(contract.symbol, request_key, now)
+        gateway.request_log.append((now, contract.symbol, request_key))
+        if violation:
+            gateway.violations.append((contract.symbol, violation))
+            if self.RaiseRequestErrors:
+                raise RequestError(len(gateway.request_log), 162, f"Historical Market Data Service error message:Historical data request pacing violation ({violation})")
+            return []
+        gateway.open_requests += 1
+        gateway.max_open_seen = max(gateway.max_open_seen, gateway.open_requests)
+        try:
+            await asyncio.sleep(gateway.latency)
+            return gateway.bars(contract.symbol, endDateTime, durationStr, barSizeSetting)
+        finally:
+            gateway.open_requests -= 1
@@ -0,0 +1,115 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+# Make the shared database helpers importable from the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Research')))
+# Like the other test scripts, talk to the database published on localhost unless told otherwise
+os.environ.setdefault("POSTGRES_HOST", "localhost")
+
+from db.bulk import copy_upsert
+from db.connection import transaction
+from db.fetch import bars_query
+from db.schema import ensure_table, ensure_ticker_index
+
+LEGACY_TABLE_NAME = "plan_check_legacy_bars"
+INDEXED_LEGACY_TABLE_NAME = "plan_check_indexed_legacy_bars"
+TICKER_FIRST_TABLE_NAME = "plan_check_ticker_first_bars"
+BAR_COLUMN_TYPES = {
+    'datetime': 'TIMESTAMP',
+    'ticker': 'VARCHAR(10)',
+    'open': 'FLOAT',
+    'high': 'FLOAT',
+    'low': 'FLOAT',
+    'close': 'FLOAT',
+    'volume': 'BIGINT',
+}
+PLAN_CHECK_TICKERS = 500
+PLAN_CHECK_BARS_PER_TICKER = 4_000
+QUERY_TICKER = "T007"
+QUERY_START = pd.Timestamp('2024-01-03 09:30')
+QUERY_END = pd.Timestamp('2024-01-03 16:00')
+
+def make_bars(n_tickers=PLAN_CHECK_TICKERS, n_bars=PLAN_CHECK_BARS_PER_TICKER, seed=0):
+    """Build synthetic minute bars, appended in time order like the ingestion scripts write them."""
+    rng = np.random.default_rng(seed)
+    datetimes = np.repeat(pd.date_range('2024-01-02 09:30', periods=n_bars, freq='min'), n_tickers)
+    tickers = np.tile([f"T{i:03d}" for i in range(n_tickers)], n_bars)
+    close = 100 + rng.standard_normal(len(tickers)) * 0.1
+    return pd.DataFrame({
+        'datetime': datetimes,
+        'ticker': tickers,
+        'open': close,
+        'high': close + 0.2,
+        'low': close - 0.2,
+        'close': close,
+        'volume': rng.integers(100, 10_000, len(close)),
+    })
+
+def create_tables(cursor, bars):
+    """Create the old (datetime, ticker) layout with and without the ticker index, and the ticker-first layout."""
+    for table_name in [LEGACY_TABLE_NAME, INDEXED_LEGACY_TABLE_NAME, TICKER_FIRST_TABLE_NAME]:
+        cursor.execute(f"DROP TABLE IF EXISTS {table_name};")
+    # The old layout, as the ingestion scripts used to create it
+    column_definitions = ",\n        ".join(f"{column} {sql_type}" for column, sql_type in BAR_COLUMN_TYPES.items())
+    cursor.execute(f"""
+    CREATE TABLE {LEGACY_TABLE_NAME} (
+        {column_definitions},
+        PRIMARY KEY (datetime, ticker)
+    );
+    """)
+    cursor.execute(f"CREATE TABLE {INDEXED_LEGACY_TABLE_NAME} (LIKE {LEGACY_TABLE_NAME} INCLUDING ALL);")
+    ensure_ticker_index(cursor, INDEXED_LEGACY_TABLE_NAME)
+    ensure_table(cursor, TICKER_FIRST_TABLE_NAME, BAR_COLUMN_TYPES)
+    for table_name in [LEGACY_TABLE_NAME, INDEXED_LEGACY_TABLE_NAME, TICKER_FIRST_TABLE_NAME]:
+        copy_upsert(cursor, bars, table_name, list(BAR_COLUMN_TYPES))
+        cursor.execute(f"ANALYZE {table_name};")
+
+def explain(cursor, table_name):
+    """Run EXPLAIN ANALYZE on the per-ticker time-range query of a table and return the plan as a dict."""
+    query, params = bars_query(table_name, ['datetime', 'ticker', 'close'], [QUERY_TICKER], QUERY_START, QUERY_END)
+    cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", params)
+    return cursor.fetchone()[0][0]
+
+def plan_nodes(node):
+    """Yield every node of an EXPLAIN JSON plan tree."""
+    yield node
+    for child in node.get('Plans', []):
+        yield from plan_nodes(child)
+
+def check_plan(plan, table_name, expected_index=None):
+    """Print the plan summary of a table and, when an index is expected, check that the query reads only its range."""
+    nodes = list(plan_nodes(plan['Plan']))
+    node_types = [node['Node Type'] for node in nodes]
+    index_names = {node['Index Name'] for node in nodes if 'Index Name' in node}
+    root = plan['Plan']
+    pages = root.get('Shared Hit Blocks', 0) + root.get('Shared Read Blocks', 0)
+    print(f"{table_name}: {' -> '.join(node_types)} on {sorted(index_names) or 'no index'}, "
+          f"{pages:,} pages, {plan['Execution Time']:.2f} ms, {root['Actual Rows']:,} rows")
+    if expected_index is not None:
+        assert 'Seq Scan' not in node_types, f"{table_name} is scanned sequentially"
+        assert expected_index in index_names, f"{table_name} does not use {expected_index}"
+    return pages
+
+# Example usage
+if __name__ == "__main__":
+    bars = make_bars()
+    with transaction() as cursor:
+        create_tables(cursor, bars)
+    try:
+        with transaction() as cursor:
+            expected_rows = ((bars['ticker'] == QUERY_TICKER) & (bars['datetime'] >= QUERY_START) & (bars['datetime'] < QUERY_END)).sum()
+            legacy_pages = check_plan(explain(cursor, LEGACY_TABLE_NAME), LEGACY_TABLE_NAME)
+            indexed_pages = check_plan(explain(cursor, INDEXED_LEGACY_TABLE_NAME), INDEXED_LEGACY_TABLE_NAME, f"{INDEXED_LEGACY_TABLE_NAME}_ticker_datetime_idx")
+            ticker_first_plan = explain(cursor, TICKER_FIRST_TABLE_NAME)
+            ticker_first_pages = check_plan(ticker_first_plan, TICKER_FIRST_TABLE_NAME, f"{TICKER_FIRST_TABLE_NAME}_pkey")
+            assert ticker_first_plan['Plan']['Actual Rows'] == expected_rows, f"Expected {expected_rows} rows"
+            assert ticker_first_pages < legacy_pages, "The ticker-first layout reads more pages than the old layout"
+            print(f"Ticker-first key reads {legacy_pages / ticker_first_pages:.0f}x fewer pages than the (datetime, ticker) key, "
+                  f"the added ticker index {legacy_pages / indexed_pages:.0f}x fewer.")
+        print("Query plan checks passed.")
+    finally:
+        with transaction() as cursor:
+            for table_name in [LEGACY_TABLE_NAME, INDEXED_LEGACY_TABLE_NAME, TICKER_FIRST_TABLE_NAME]:
+                cursor.execute(f"DROP TABLE IF EXISTS {table_name};")
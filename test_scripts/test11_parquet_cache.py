@@ -0,0 +1,101 @@
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+# Make the shared database helpers importable from the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Research')))
+# Like the other test scripts, talk to the database published on localhost unless told otherwise
+os.environ.setdefault("POSTGRES_HOST", "localhost")
+
+from db.bulk import copy_upsert
+from db.connection import transaction
+from db.copy_reader import copy_dataframe
+from db.fetch import bars_query
+from db.schema import ensure_table
+from local_store.parquet_cache import read_cache, sync_cache
+
+CACHE_CHECK_TABLE_NAME = "cache_check_minute_bars"
+BAR_COLUMN_TYPES = {
+    'datetime': 'TIMESTAMP',
+    'ticker': 'VARCHAR(10)',
+    'open': 'FLOAT',
+    'high': 'FLOAT',
+    'low': 'FLOAT',
+    'close': 'FLOAT',
+    'volume': 'BIGINT',
+}
+CACHE_CHECK_TICKERS = 20
+CACHE_CHECK_BARS_PER_TICKER = 20_000
+QUERY_TICKERS = ["T003", "T011"]
+QUERY_START = pd.Timestamp('2024-01-05 09:30')
+QUERY_END = pd.Timestamp('2024-01-09 16:00')
+
+def make_bars(n_tickers=CACHE_CHECK_TICKERS, n_bars=CACHE_CHECK_BARS_PER_TICKER, seed=0):
+    """Build synthetic minute bars for a few days."""
+    rng = np.random.default_rng(seed)
+    datetimes = np.repeat(pd.date_range('2024-01-02 09:30', periods=n_bars, freq='min'), n_tickers)
+    tickers = np.tile([f"T{i:03d}" for i in range(n_tickers)], n_bars)
+    close = 100 + rng.standard_normal(len(tickers)).cumsum() * 0.01
+    return pd.DataFrame({
+        'datetime': datetimes,
+        'ticker': tickers,
+        'open': close,
+        'high': close + 0.2,
+        'low': close - 0.2,
+        'close': close,
+        'volume': rng.integers(100, 10_000, len(close)),
+    })
+
+def load_bars(bars):
+    """Upsert bars into the scratch table."""
+    with transaction() as cursor:
+        ensure_table(cursor, CACHE_CHECK_TABLE_NAME, BAR_COLUMN_TYPES)
+        copy_upsert(cursor, bars, CACHE_CHECK_TABLE_NAME, list(BAR_COLUMN_TYPES))
+
+def check_matches_database(cache_dir, tickers=None, start=None, end=None, columns=None):
+    """Read the same rows from the database and the cache, check they agree and return both read times."""
+    query, params = bars_query(CACHE_CHECK_TABLE_NAME, columns, tickers, start, end)
+    begin = time.perf_counter()
+    from_database = copy_dataframe(query, params, categories=())
+    database_seconds = time.perf_counter() - begin
+    begin = time.perf_counter()
+    from_cache = read_cache(CACHE_CHECK_TABLE_NAME, tickers, start, end, columns, cache_dir=cache_dir)
+    cache_seconds = time.perf_counter() - begin
+    assert list(from_cache.columns) == list(from_database.columns), f"Cache columns {list(from_cache.columns)} differ"
+    pd.testing.assert_frame_equal(from_cache, from_database, check_dtype=False)
+    return len(from_cache), database_seconds, cache_seconds
+
+# Example usage
+if __name__ == "__main__":
+    bars = make_bars()
+    # Load the first half of the bars, ending part way through a day, then the rest as a later ingestion run would
+    cutoff = bars['datetime'].iloc[len(bars) // 2]
+    with transaction() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {CACHE_CHECK_TABLE_NAME};")
+    try:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            load_bars(bars[bars['datetime'] < cutoff])
+            begin = time.perf_counter()
+            rows = sync_cache(CACHE_CHECK_TABLE_NAME, cache_dir=cache_dir)
+            print(f"First sync wrote {rows:,} rows in {time.perf_counter() - begin:.2f}s")
+            load_bars(bars[bars['datetime'] >= cutoff])
+            begin = time.perf_counter()
+            rows = sync_cache(CACHE_CHECK_TABLE_NAME, cache_dir=cache_dir)
+            print(f"Incremental sync wrote {rows:,} rows in {time.perf_counter() - begin:.2f}s")
+            assert rows < len(bars) // 2, "The incremental sync read more than the new days again"
+
+            for description, query_args in [
+                ("whole table", {}),
+                ("two tickers over a week", {'tickers': QUERY_TICKERS, 'start': QUERY_START, 'end': QUERY_END}),
+                ("close of two tickers", {'tickers': QUERY_TICKERS, 'columns': ['datetime', 'ticker', 'close']}),
+            ]:
+                n_rows, database_seconds, cache_seconds = check_matches_database(cache_dir, **query_args)
+                print(f"Reading the {description} ({n_rows:,} rows): database {database_seconds:.2f}s, "
+                      f"cache {cache_seconds:.2f}s ({database_seconds / cache_seconds:.1f}x)")
+        print("Parquet cache checks passed.")
+    finally:
+        with transaction() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {CACHE_CHECK_TABLE_NAME};")
@@ -0,0 +1,113 @@
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Make the shared database helpers and the trend following indicators importable from the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Research')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Research', 'generic_strategies', 'trend_following')))
+# Like the other test scripts, talk to the database published on localhost unless told otherwise
+os.environ.setdefault("POSTGRES_HOST", "localhost")
+
+from db.bulk import copy_upsert
+from db.connection import transaction
+from db.copy_reader import copy_dataframe
+from db.fetch import bars_query
+from db.schema import ensure_table
+from indicators.panel import Panel
+from local_store.bar_store import build_bar_store, iter_bar_store_frames, open_ticker_arrays, read_ticker_frame
+from technical_indicators.EMA import compute_emas_panel
+
+STORE_CHECK_TABLE_NAME = "bar_store_check_indicators"
+INDICATOR_COLUMN_TYPES = {
+    'datetime': 'TIMESTAMP',
+    'ticker': 'VARCHAR(10)',
+    'close': 'FLOAT',
+    'volume': 'BIGINT',
+    'trend': 'VARCHAR(10)',
+}
+STORE_CHECK_TICKERS = 20
+STORE_CHECK_BARS_PER_TICKER = 50_000
+STORE_CHECK_WORKERS = 4
+QUERY_TICKER = "T005"
+QUERY_START = pd.Timestamp('2024-01-10 09:30')
+QUERY_END = pd.Timestamp('2024-01-12 16:00')
+
+def make_indicators(n_tickers=STORE_CHECK_TICKERS, n_bars=STORE_CHECK_BARS_PER_TICKER, seed=0):
+    """Build synthetic minute indicator rows with a text trend column that is sometimes NULL."""
+    rng = np.random.default_rng(seed)
+    datetimes = np.repeat(pd.date_range('2024-01-02 09:30', periods=n_bars, freq='min'), n_tickers)
+    tickers = np.tile([f"T{i:03d}" for i in range(n_tickers)], n_bars)
+    trend = rng.choice(np.array(['uptrend', 'downtrend', 'neutral', None], dtype=object), len(tickers))
+    return pd.DataFrame({
+        'datetime': datetimes,
+        'ticker': tickers,
+        'close': 100 + rng.standard_normal(len(tickers)).cumsum() * 0.01,
+        'volume': rng.integers(100, 10_000, len(tickers)),
+        'trend': trend,
+    })
+
+def mean_close(args):
+    """Worker: average the close of every ticker in the bar store and report the Python heap it needed."""
+    store_dir, tickers = args
+    tracemalloc.start()
+    total = sum(float(open_ticker_arrays(STORE_CHECK_TABLE_NAME, ticker, ['close'], store_dir)['close'].mean()) for ticker in tickers)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return total / len(tickers), peak
+
+# Example usage
+if __name__ == "__main__":
+    indicators = make_indicators()
+    with transaction() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {STORE_CHECK_TABLE_NAME};")
+        ensure_table(cursor, STORE_CHECK_TABLE_NAME, INDICATOR_COLUMN_TYPES)
+        copy_upsert(cursor, indicators, STORE_CHECK_TABLE_NAME, list(INDICATOR_COLUMN_TYPES))
+    try:
+        with tempfile.TemporaryDirectory() as store_dir:
+            begin = time.perf_counter()
+            rows = build_bar_store(STORE_CHECK_TABLE_NAME, store_dir=store_dir)
+            print(f"Exported {rows:,} rows in {time.perf_counter() - begin:.2f}s")
+            assert rows == len(indicators), f"Exported {rows} of {len(indicators)} rows"
+
+            # The store returns the same rows as the database, for the whole table and for a time range
+            query, params = bars_query(STORE_CHECK_TABLE_NAME)
+            from_database = copy_dataframe(query, params, categories=())
+            from_store = pd.concat([ticker_data for _, ticker_data in iter_bar_store_frames(STORE_CHECK_TABLE_NAME, store_dir=store_dir)], ignore_index=True)
+            pd.testing.assert_frame_equal(from_store.astype({'ticker': str, 'trend': object}), from_database.astype({'trend': object}), check_dtype=False)
+            query, params = bars_query(STORE_CHECK_TABLE_NAME, None, [QUERY_TICKER], QUERY_START, QUERY_END)
+            begin = time.perf_counter()
+            from_database = copy_dataframe(query, params, categories=())
+            database_seconds = time.perf_counter() - begin
+            begin = time.perf_counter()
+            from_store = read_ticker_frame(STORE_CHECK_TABLE_NAME, QUERY_TICKER, QUERY_START, QUERY_END, store_dir=store_dir)
+            store_seconds = time.perf_counter() - begin
+            pd.testing.assert_frame_equal(from_store.astype({'ticker': str, 'trend': object}), from_database.astype({'trend': object}), check_dtype=False)
+            assert isinstance(from_store['close'].to_numpy().base, np.memmap), "The close column was copied out of the mapped file"
+            print(f"Reading {len(from_store):,} rows of {QUERY_TICKER}: database {database_seconds * 1000:.1f} ms, bar store {store_seconds * 1000:.1f} ms")
+
+            # The panel built from the mapped files gives the same EMAs as the one pivoted from a DataFrame
+            tickers = sorted(indicators['ticker'].unique())
+            begin = time.perf_counter()
+            panel = Panel.from_ticker_arrays({ticker: open_ticker_arrays(STORE_CHECK_TABLE_NAME, ticker, ['datetime', 'close'], store_dir) for ticker in tickers}, fields=('close',))
+            store_emas = compute_emas_panel(panel)
+            print(f"EMAs of {len(tickers)} tickers from the bar store in {time.perf_counter() - begin:.2f}s")
+            for name, values in compute_emas_panel(Panel.from_long(indicators, fields=('close',))).items():
+                assert np.allclose(store_emas[name], values, equal_nan=True), f"{name} differs"
+
+            # Worker processes read the same pages through the OS cache instead of each holding a copy
+            with ProcessPoolExecutor(STORE_CHECK_WORKERS) as executor:
+                results = list(executor.map(mean_close, [(store_dir, tickers)] * STORE_CHECK_WORKERS))
+            expected = indicators.groupby('ticker')['close'].mean().mean()
+            for mean, peak in results:
+                assert np.isclose(mean, expected), f"A worker averaged {mean}, expected {expected}"
+            print(f"{STORE_CHECK_WORKERS} workers each read {len(indicators) * 8 / 1e6:.0f} MB of close prices "
+                  f"with a Python heap peak of at most {max(peak for _, peak in results) / 1e6:.1f} MB")
+        print("Bar store checks passed.")
+    finally:
+        with transaction() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {STORE_CHECK_TABLE_NAME};")
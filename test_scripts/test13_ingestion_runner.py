@@ -0,0 +1,58 @@
+import os
+import sys
+import threading
+import time
+import pandas as pd
+
+# Make the shared ingestion helpers importable from the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Research')))
+
+from ingestion.runner import SOURCE_CONCURRENCY, run_ingestion_pass
+
+RUNNER_CHECK_TICKERS = [f"T{i:03d}" for i in range(40)]
+FETCH_LATENCY_SECONDS = 0.05
+STORE_LATENCY_SECONDS = 0.01
+FAILING_TICKER = "T013"
+
+class SimulatedSource:
+    """Stand-in for a data source API and the database: fixed latencies, and a count of the requests in flight."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.stored = []
+
+    def fetch(self, ticker):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(FETCH_LATENCY_SECONDS)
+            if ticker == FAILING_TICKER:
+                raise ConnectionError("simulated timeout")
+            return pd.DataFrame({'datetime': pd.date_range('2024-01-02 09:30', periods=390, freq='min'), 'ticker': ticker, 'close': 100.0})
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def store(self, ticker, data):
+        time.sleep(STORE_LATENCY_SECONDS)
+        self.stored.append(ticker)
+
+# Example usage
+if __name__ == "__main__":
+    serial_seconds = len(RUNNER_CHECK_TICKERS) * (FETCH_LATENCY_SECONDS + STORE_LATENCY_SECONDS)
+    for workers in [1, 4, 16]:
+        simulated = SimulatedSource()
+        start = time.perf_counter()
+        report = run_ingestion_pass(RUNNER_CHECK_TICKERS, simulated.fetch, simulated.store, 'alpaca', workers=workers)
+        pass_seconds = time.perf_counter() - start
+        cap = min(workers, SOURCE_CONCURRENCY['alpaca'])
+        assert simulated.max_in_flight <= cap, f"{simulated.max_in_flight} requests in flight with a cap of {cap}"
+        assert sorted(simulated.stored) == sorted(set(RUNNER_CHECK_TICKERS) - {FAILING_TICKER}), "Not every fetched ticker was stored"
+        assert report.set_index('ticker').loc[FAILING_TICKER, 'error'].startswith("fetch failed"), "The failing ticker is not reported"
+        assert report['fetch_seconds'].notna().all(), "A ticker has no fetch latency"
+        print(f"{workers} workers: {pass_seconds:.2f}s for a pass that takes {serial_seconds:.2f}s serially "
+              f"({serial_seconds / pass_seconds:.1f}x), at most {simulated.max_in_flight} requests in flight")
+    print("Ingestion runner checks passed.")
@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+import pandas as pd
+
+# Make the Alpaca ingestion modules and the shared ingestion helpers importable from the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Research')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Research', 'alpaca')))
+# The stub server has no quota, so the checks run without the Alpaca rate limit
+os.environ.setdefault("RATE_LIMIT_ALPACA_PER_MINUTE", "0")
+
+from alpaca_bars_client import AlpacaBarsClient
+from alpaca_stub_server import start_stub_server, synthetic_bars
+from ingestion.runner import run_ingestion_pass
+
+BATCHING_CHECK_SYMBOLS = [f"S{i:03d}" for i in range(24)]
+BATCHING_CHECK_BARS_PER_SYMBOL = 2_730  # A week of minute bars
+STUB_LATENCY_SECONDS = 0.02
+PAGE_LIMIT = 10_000
+
+def fetch_one_by_one(url, symbols):
+    """Request every symbol on its own with a new client, as the ingestion did before batching."""
+    frames = {}
+    for symbol in symbols:
+        client = AlpacaBarsClient('key', 'secret', data_url=url)
+        frames.update(client.get_bars([symbol], '1Min', '2024-01-02', '2024-01-12'))
+    return frames
+
+def fetch_batched(url, symbols, symbols_per_request):
+    """Request the symbols in multi-symbol groups over one client, following the page tokens."""
+    client = AlpacaBarsClient('key', 'secret', data_url=url)
+    frames = {}
+    for i in range(0, len(symbols), symbols_per_request):
+        frames.update(client.get_bars(symbols[i:i + symbols_per_request], '1Min', '2024-01-02', '2024-01-12'))
+    return frames, client.requests_sent
+
+# Example usage
+if __name__ == "__main__":
+    bars = synthetic_bars(BATCHING_CHECK_SYMBOLS + ['EMPTY'], BATCHING_CHECK_BARS_PER_SYMBOL)
+    bars['EMPTY'] = []
+    server = start_stub_server(bars, STUB_LATENCY_SECONDS)
+    try:
+        start = time.perf_counter()
+        one_by_one = fetch_one_by_one(server.url, BATCHING_CHECK_SYMBOLS)
+        one_by_one_seconds = time.perf_counter() - start
+        print(f"One symbol per request: {server.requests_served} requests, {one_by_one_seconds:.2f}s")
+
+        for symbols_per_request in [8, 24]:
+            served_before = server.requests_served
+            start = time.perf_counter()
+            batched, requests_sent = fetch_batched(server.url, BATCHING_CHECK_SYMBOLS + ['EMPTY'], symbols_per_request)
+            batched_seconds = time.perf_counter() - start
+            assert requests_sent == server.requests_served - served_before
+            # Every page holds at most PAGE_LIMIT bars, so a group needs ceil(bars / limit) requests, and at least one
+            expected_requests = sum(max(1, -(-len(BATCHING_CHECK_SYMBOLS[i:i + symbols_per_request]) * BATCHING_CHECK_BARS_PER_SYMBOL // PAGE_LIMIT))
+                                    for i in range(0, len(BATCHING_CHECK_SYMBOLS) + 1, symbols_per_request))
+            assert requests_sent == expected_requests, f"Sent {requests_sent} requests, expected {expected_requests}"
+            assert sorted(batched) == BATCHING_CHECK_SYMBOLS, "The symbol without bars got a frame, or a symbol is missing"
+            for symbol in BATCHING_CHECK_SYMBOLS:
+                pd.testing.assert_frame_equal(batched[symbol], one_by_one[symbol])
+                assert len(batched[symbol]) == BATCHING_CHECK_BARS_PER_SYMBOL, f"{symbol} lost bars across pages"
+                assert (batched[symbol]['ticker'] == symbol).all()
+                assert batched[symbol].index.is_monotonic_increasing
+            print(f"{symbols_per_request} symbols per request: {requests_sent} requests, {batched_seconds:.2f}s "
+                  f"({one_by_one_seconds / batched_seconds:.1f}x faster)")
+
+        # The ingestion pass fetches the groups concurrently over one shared client
+        client = AlpacaBarsClient('key', 'secret', data_url=server.url, max_connections=4)
+        stored = {}
+        report = run_ingestion_pass(BATCHING_CHECK_SYMBOLS, lambda symbols: client.get_bars(symbols, '1Min', '2024-01-02', '2024-01-12'),
+                                    lambda symbol, data: stored.update({symbol: len(data)}), 'alpaca', workers=4, batch_size=6)
+        assert stored == {symbol: BATCHING_CHECK_BARS_PER_SYMBOL for symbol in BATCHING_CHECK_SYMBOLS}, "The pass did not store every symbol"
+        assert report['error'].isna().all()
+        print("Alpaca batching checks passed.")
+    finally:
+        server.shutdown()
@@ -0,0 +1,90 @@
+import os
+import sys
+import tempfile
+import pandas as pd
+
+# Make the Alpaca ingestion modules and the shared helpers importable from the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Research')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Research', 'alpaca')))
+# The stub server has no quota, so the checks run without the Alpaca rate limit
+os.environ.setdefault("RATE_LIMIT_ALPACA_PER_MINUTE", "0")
+# Like the other test scripts, talk to the database published on localhost unless told otherwise
+os.environ.setdefault("POSTGRES_HOST", "localhost")
+# A spool of its own, so bars spooled by other runs do not count as stored
+os.environ["INGESTION_SPOOL_DIR"] = tempfile.mkdtemp(prefix="incremental_check_spool_")
+
+from alpaca_bars_client import AlpacaBarsClient
+from alpaca_minute_data_initialize import fetch_minute_data_from_alpaca, store_data_in_db
+from alpaca_stub_server import start_stub_server, synthetic_bars
+from db.connection import transaction
+from db.fetch import fetch_dataframe
+from db.schema import ensure_table
+from ingestion.incremental import MINUTE_BARS_OVERLAP, fetch_start_times
+from ingestion.spool import get_spool
+
+INCREMENTAL_CHECK_TABLE_NAME = "incremental_check_minute_bars"
+BAR_COLUMN_TYPES = {
+    'datetime': 'TIMESTAMP',
+    'ticker': 'VARCHAR(10)',
+    'open': 'DOUBLE PRECISION',
+    'high': 'DOUBLE PRECISION',
+    'low': 'DOUBLE PRECISION',
+    'close': 'DOUBLE PRECISION',
+    'volume': 'BIGINT',
+}
+INCREMENTAL_CHECK_SYMBOLS = ["AAA", "BBB", "CCC"]
+BARS_PER_DAY = 390
+INITIAL_START = '2024-01-01'
+
+def ingestion_pass(client, symbols):
+    """Run one incremental pass like alpaca_minute_data_initialize.py and return the number of bars fetched."""
+    start_times = fetch_start_times(INCREMENTAL_CHECK_TABLE_NAME, symbols, INITIAL_START, MINUTE_BARS_OVERLAP)
+    frames = fetch_minute_data_from_alpaca(symbols, client, start_times)
+    for data in frames.values():
+        store_data_in_db(data, INCREMENTAL_CHECK_TABLE_NAME)
+    # Load the spooled bars before the next pass reads the table
+    assert get_spool().flush(30), "The spooled bars were not loaded"
+    return sum(len(data) for data in frames.values())
+
+def stored_bars():
+    """Read the scratch table."""
+    return fetch_dataframe(f"SELECT * FROM {INCREMENTAL_CHECK_TABLE_NAME} ORDER BY ticker, datetime;")
+
+# Example usage
+if __name__ == "__main__":
+    # Six trading days of bars, of which the stub serves the first five before the sixth "arrives"
+    all_bars = synthetic_bars(INCREMENTAL_CHECK_SYMBOLS, 6 * BARS_PER_DAY)
+    server = start_stub_server({symbol: bars[:5 * BARS_PER_DAY] for symbol, bars in all_bars.items()})
+    client = AlpacaBarsClient('key', 'secret', data_url=server.url)
+    overlap_bars = int(MINUTE_BARS_OVERLAP / pd.Timedelta(minutes=1))
+    with transaction() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {INCREMENTAL_CHECK_TABLE_NAME};")
+        ensure_table(cursor, INCREMENTAL_CHECK_TABLE_NAME, BAR_COLUMN_TYPES)
+    try:
+        fetched = ingestion_pass(client, INCREMENTAL_CHECK_SYMBOLS)
+        assert fetched == len(INCREMENTAL_CHECK_SYMBOLS) * 5 * BARS_PER_DAY, f"The first pass fetched {fetched} bars"
+        print(f"First pass: {fetched:,} bars")
+
+        # Nothing new: only the overlap is requested again
+        fetched = ingestion_pass(client, INCREMENTAL_CHECK_SYMBOLS)
+        assert fetched == len(INCREMENTAL_CHECK_SYMBOLS) * (overlap_bars + 1), f"A pass without new bars fetched {fetched} bars"
+        print(f"Pass without new bars: {fetched:,} bars, the {MINUTE_BARS_OVERLAP} overlap")
+
+        # A new day arrives and the source corrects a bar inside the overlap
+        corrected = dict(all_bars['BBB'][5 * BARS_PER_DAY - 3], c=1.0)
+        server.bars = {symbol: list(bars) for symbol, bars in all_bars.items()}
+        server.bars['BBB'][5 * BARS_PER_DAY - 3] = corrected
+        server.matches.clear()
+        fetched = ingestion_pass(client, INCREMENTAL_CHECK_SYMBOLS)
+        assert fetched == len(INCREMENTAL_CHECK_SYMBOLS) * (BARS_PER_DAY + overlap_bars + 1), f"The pass after a new day fetched {fetched} bars"
+        print(f"Pass after a new day: {fetched:,} bars")
+
+        stored = stored_bars()
+        assert len(stored) == len(INCREMENTAL_CHECK_SYMBOLS) * 6 * BARS_PER_DAY, f"Stored {len(stored)} bars"
+        corrected_row = stored[(stored['ticker'] == 'BBB') & (stored['datetime'] == pd.Timestamp(corrected['t']).tz_convert(None))]
+        assert corrected_row['close'].iloc[0] == 1.0, "The correction inside the overlap was not applied"
+        print(f"{server.requests_served} requests in total. Incremental ingestion checks passed.")
+    finally:
+        server.shutdown()
+        with transaction() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {INCREMENTAL_CHECK_TABLE_NAME};")
@@ -0,0 +1,120 @@
+import asyncio
+import os
+import sys
+import time
+import pandas as pd
+
+# Make the IBKR ingestion modules and the shared ingestion helpers importable from the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Research')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Research', 'interactive_brokers')))
+
+from ibkr_fake_gateway import FakeGateway
+from ibkr_historical_client import HistoricalPacer, IBKRHistoricalClient, bars_to_frame
+from ingestion.runner import run_ingestion_pass
+
+IBKR_CHECK_TICKERS = [f"T{i:02d}" for i in range(16)]
+# Monday 2024-02-26 to Friday 2024-03-01: five sessions of 390 minute bars
+PASS_START = pd.Timestamp('2024-02-26', tz='UTC')
+PASS_END = pd.Timestamp('2024-03-02', tz='UTC')
+GATEWAY_LATENCY_SECONDS = 0.05
+CONNECT_LATENCY_SECONDS = 0.1
+# IB's pacing rules scaled down from minutes to seconds, so the checks wait on them without taking long; the
+# requests per window rule covers the minute bars of the checks, as it does IB's bars of 30 seconds or less
+PACING = dict(requests=12, window_seconds=1.0, contract_requests=6, contract_window_seconds=0.5,
+              identical_request_seconds=1.0, max_open_requests=50, window_bar_sizes=('1 min',))
+
+async def acquire_requests(pacer, count, bar_size):
+    """Acquire `count` distinct requests for as many contracts, returning the seconds the pacer held them back."""
+    start = time.perf_counter()
+    for i in range(count):
+        await pacer.acquire(f"C{i:03d}", (f"C{i:03d}", bar_size), bar_size)
+        pacer.release()
+    return time.perf_counter() - start
+
+async def acquire_behind_identical(pacer):
+    """Send a request for A, then its identical request and one for B together, returning when each was acquired."""
+    await pacer.acquire('A', ('A', '1 min'), '1 min')
+    pacer.release()
+    start = time.perf_counter()
+    async def acquired_after(contract):
+        await pacer.acquire(contract, (contract, '1 min'), '1 min')
+        pacer.release()
+        return time.perf_counter() - start
+    return await asyncio.gather(acquired_after('A'), acquired_after('B'))
+
+def fetch_connection_per_ticker(gateway, tickers):
+    """Connect, request and disconnect for every ticker, as the ingestion did before the persistent client."""
+    frames = {}
+    for ticker in tickers:
+        with IBKRHistoricalClient(pacer=HistoricalPacer(**PACING), ib_factory=gateway.IB) as client:
+            frames[ticker] = client.fetch_bars(ticker, PASS_START, PASS_END, '1 min')
+    return frames
+
+# Example usage
+if __name__ == "__main__":
+    gateway = FakeGateway(GATEWAY_LATENCY_SECONDS, CONNECT_LATENCY_SECONDS, **PACING)
+    start = time.perf_counter()
+    per_ticker = fetch_connection_per_ticker(gateway, IBKR_CHECK_TICKERS)
+    per_ticker_seconds = time.perf_counter() - start
+    assert gateway.connections == len(IBKR_CHECK_TICKERS)
+    print(f"Connection per ticker: {gateway.connections} connections, {per_ticker_seconds:.2f}s")
+
+    gateway = FakeGateway(GATEWAY_LATENCY_SECONDS, CONNECT_LATENCY_SECONDS, **PACING)
+    with IBKRHistoricalClient(pacer=HistoricalPacer(**PACING), ib_factory=gateway.IB) as client:
+        # The ingestion pass: every ticker fetched concurrently over the one connection
+        stored = {}
+        start = time.perf_counter()
+        report = run_ingestion_pass(IBKR_CHECK_TICKERS, lambda ticker: client.fetch_bars(ticker, PASS_START, PASS_END, '1 min'),
+                                    lambda ticker, data: stored.update({ticker: data}), 'ibkr', workers=8)
+        pass_seconds = time.perf_counter() - start
+        assert report['error'].isna().all()
+        assert gateway.connections == 1, f"The pass opened {gateway.connections} connections"
+        assert not gateway.violations, f"Pacing violations: {gateway.violations}"
+        assert gateway.max_open_seen > 1, "The requests were not sent concurrently"
+        # More requests than the pacing window allows, so the last ones had to wait for the window
+        assert pass_seconds >= PACING['window_seconds']
+        for ticker in IBKR_CHECK_TICKERS:
+            assert len(stored[ticker]) == 5 * 390, f"{ticker} has {len(stored[ticker])} bars"
+            pd.testing.assert_frame_equal(stored[ticker], per_ticker[ticker])
+        print(f"Persistent connection: {gateway.connections} connection, {pass_seconds:.2f}s "
+              f"({per_ticker_seconds / pass_seconds:.1f}x faster), no pacing violations")
+
+        # Backfill: a long range is split into chunks sent concurrently, and stitched back together
+        requests_before = client.requests_sent
+        backfill_start = PASS_END - pd.Timedelta(days=30)
+        backfill = client.fetch_bars('BACKFILL', backfill_start, PASS_END, '1 min')
+        assert client.requests_sent - requests_before == 6, "30 days of minute bars should take six 5-day chunks"
+        expected = bars_to_frame('BACKFILL', gateway.bars('BACKFILL', PASS_END.to_pydatetime(), '30 D', '1 min'))
+        pd.testing.assert_frame_equal(backfill, expected)
+        daily = client.fetch_bars('BACKFILL', PASS_END - pd.Timedelta(days=3 * 365), PASS_END, '1 day')
+        expected = bars_to_frame('BACKFILL', gateway.bars('BACKFILL', PASS_END.to_pydatetime(), '1095 D', '1 day'))
+        pd.testing.assert_frame_equal(daily, expected)
+        assert daily.index.is_unique and daily.index.is_monotonic_increasing
+        print(f"Backfill: {len(backfill):,} minute bars and {len(daily):,} daily bars in chunks")
+
+        # Requesting the same chunk again right away waits out the identical request rule
+        client.fetch_bars('T01', PASS_START, PASS_END, '1 min')
+        start = time.perf_counter()
+        client.fetch_bars('T01', PASS_START, PASS_END, '1 min')
+        assert time.perf_counter() - start >= PACING['identical_request_seconds'] * 0.9
+        assert not gateway.violations, f"Pacing violations: {gateway.violations}"
+
+        # The client reconnects after the gateway drops the connection
+        gateway.drop_connections()
+        client.fetch_bars('T00', PASS_START, PASS_END, '1 min')
+        assert gateway.connections == 2
+
+    # IB's requests per window rule holds back only bars of 30 seconds or less, and old requests are forgotten
+    default_sizes = {name: value for name, value in PACING.items() if name != 'window_bar_sizes'}
+    pacer = HistoricalPacer(**default_sizes)
+    assert asyncio.run(acquire_requests(pacer, 2 * PACING['requests'], '1 min')) < PACING['window_seconds']
+    assert not pacer.sent and len(pacer.identical_sent) == 2 * PACING['requests']
+    pacer = HistoricalPacer(**default_sizes)
+    assert asyncio.run(acquire_requests(pacer, PACING['requests'] + 1, '30 secs')) >= PACING['window_seconds'] * 0.9
+    time.sleep(PACING['identical_request_seconds'])
+    asyncio.run(acquire_requests(pacer, 1, '1 day'))
+    assert len(pacer.identical_sent) == 1, f"{len(pacer.identical_sent)} identical requests remembered"
+    # A request waiting out the identical request rule does not hold back the requests for other contracts
+    identical_seconds, other_seconds = asyncio.run(acquire_behind_identical(HistoricalPacer(**PACING)))
+    assert identical_seconds >= PACING['identical_request_seconds'] * 0.9 and other_seconds < 0.1, (identical_seconds, other_seconds)
+    print("IBKR client checks passed.")
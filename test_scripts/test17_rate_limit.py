@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+import pandas as pd
+
+# Make the ingestion modules of every source and the shared ingestion helpers importable from the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Research')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Research', 'alpaca')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Research', 'interactive_brokers')))
+# Run the clients faster than the stand-ins allow, so they get throttled, with short backoffs to keep the checks quick
+os.environ["RATE_LIMIT_ALPACA_PER_MINUTE"] = "2400"
+os.environ["RATE_LIMIT_BACKOFF_SECONDS"] = "0.05"
+os.environ["RATE_LIMIT_MAX_BACKOFF_SECONDS"] = "0.5"
+# Small pages, for several requests per symbol
+os.environ["ALPACA_PAGE_LIMIT"] = "1000"
+
+from alpaca_bars_client import AlpacaBarsClient
+from alpaca_stub_server import start_stub_server, synthetic_bars
+from ibkr_fake_gateway import FakeGateway
+from ibkr_historical_client import HistoricalPacer, IBKRHistoricalClient
+from ingestion.rate_limit import RateLimiter, TransientError, call_with_retry, quota_usage
+from ingestion.runner import run_ingestion_pass
+
+RATE_LIMIT_CHECK_SYMBOLS = [f"S{i:03d}" for i in range(24)]
+STUB_MAX_REQUESTS_PER_SECOND = 20
+IBKR_CHECK_TICKERS = [f"T{i:02d}" for i in range(16)]
+PASS_START = pd.Timestamp('2024-02-26', tz='UTC')
+PASS_END = pd.Timestamp('2024-03-02', tz='UTC')
+# The gateway keeps half the request rate the client's pacer allows
+GATEWAY_PACING = dict(requests=6, window_seconds=0.5, contract_requests=6, contract_window_seconds=0.5,
+                      identical_request_seconds=0.2, max_open_requests=50, window_bar_sizes=('1 min',))
+CLIENT_PACING = dict(GATEWAY_PACING, requests=12)
+
+class FlakyRequest:
+    """A request failing with a dropped connection a number of times before it succeeds."""
+
+    def __init__(self, failures, error=ConnectionError):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error("connection reset")
+        return "bars"
+
+# Example usage
+if __name__ == "__main__":
+    # The bucket lets a burst through, then one request per token refilled
+    limiter = RateLimiter('check', 'bucket', 1200)
+    start = time.perf_counter()
+    for _ in range(40):
+        limiter.acquire()
+    elapsed = time.perf_counter() - start
+    assert 0.9 <= elapsed < 1.5, f"40 requests at 20/s after a burst of 20 took {elapsed:.2f}s"
+    # A throttled response halves the rate, and successes win it back
+    limiter.throttled(0.0)
+    assert limiter.rate == limiter.limit / 2
+    for _ in range(10):
+        limiter.succeeded()
+    assert limiter.rate == limiter.limit
+    print(f"Token bucket: 40 requests in {elapsed:.2f}s at 20 per second after a burst of 20")
+
+    # Transient failures are retried with backoff, others are raised at once
+    limiter = RateLimiter('check', 'retry', None)
+    assert call_with_retry(limiter, FlakyRequest(2)) == "bars"
+    assert limiter.stats['retries'] == 2 and limiter.stats['failures'] == 0
+    for request, attempts in [(FlakyRequest(100), 4), (FlakyRequest(1, ValueError), 1)]:
+        try:
+            call_with_retry(limiter, request, retries=3)
+        except (ConnectionError, ValueError):
+            assert request.calls == attempts, f"{request.error.__name__} was tried {request.calls} times"
+        else:
+            raise AssertionError("The failing request did not raise")
+    assert call_with_retry(limiter, FlakyRequest(1, TransientError), classify=lambda e: e) == "bars"
+    print("Retries: transient failures retried, the rest raised")
+
+    # Alpaca: the client runs at twice the quota of the stub, gets 429s, backs off and loses no bars
+    bars = synthetic_bars(RATE_LIMIT_CHECK_SYMBOLS)
+    server = start_stub_server(bars, max_requests_per_second=STUB_MAX_REQUESTS_PER_SECOND)
+    try:
+        client = AlpacaBarsClient('key', 'secret', data_url=server.url, max_connections=8)
+        stored = {}
+        report = run_ingestion_pass(RATE_LIMIT_CHECK_SYMBOLS, lambda symbol: client.get_bars([symbol], '1Min', '2024-01-02', '2024-01-12')[symbol],
+                                    lambda symbol, data: stored.update({symbol: len(data)}), 'alpaca', workers=8)
+        assert report['error'].isna().all(), report[report['error'].notna()]
+        assert stored == {symbol: len(bars[symbol]) for symbol in RATE_LIMIT_CHECK_SYMBOLS}, "Bars were lost"
+        usage = quota_usage('alpaca').iloc[0]
+        assert server.requests_throttled > 0, "The stub never throttled, so the check proves nothing"
+        assert usage['throttled'] == server.requests_throttled, f"{usage['throttled']} throttled, the stub sent {server.requests_throttled} 429s"
+        print(f"Alpaca: every bar stored through {server.requests_throttled} throttled responses, "
+              f"rate adapted to {usage['rate_per_minute']:.0f} of {usage['limit_per_minute']:.0f} per minute")
+    finally:
+        server.shutdown()
+
+    # IBKR: pacing violations from a stricter gateway are retried until every ticker has its bars
+    gateway = FakeGateway(0.01, **GATEWAY_PACING)
+    with IBKRHistoricalClient(pacer=HistoricalPacer(**CLIENT_PACING), ib_factory=gateway.IB) as client:
+        stored = {}
+        report = run_ingestion_pass(IBKR_CHECK_TICKERS, lambda ticker: client.fetch_bars(ticker, PASS_START, PASS_END, '1 min'),
+                                    lambda ticker, data: stored.update({ticker: len(data)}), 'ibkr', workers=8)
+    assert report['error'].isna().all(), report[report['error'].notna()]
+    assert stored == {ticker: 5 * 390 for ticker in IBKR_CHECK_TICKERS}, "Bars were lost"
+    usage = quota_usage('ibkr').iloc[0]
+    assert gateway.violations, "The gateway never reported a pacing violation, so the check proves nothing"
+    assert usage['throttled'] == len(gateway.violations)
+    print(f"IBKR: every bar stored through {len(gateway.violations)} pacing violations")
+    print("Rate limit checks passed.")
@@ -0,0 +1,150 @@
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+import pandas as pd
+
+# Make the shared ingestion helpers importable from the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Research')))
+# Restart failed streams quickly, and count them as recovered soon after
+os.environ["RATE_LIMIT_BACKOFF_SECONDS"] = "0.05"
+os.environ["INGESTION_SUPERVISOR_HEALTHY_SECONDS"] = "0.3"
+
+from ingestion.daemon import IngestionDaemon, Job
+
+INTERVAL_SECONDS = 0.2
+OFFSET_SECONDS = 0.05
+RUN_SECONDS = 1.6
+
+class SimulatedPass:
+    """A pass of fixed duration that records when it started and how many of its passes ran at once."""
+
+    def __init__(self, seconds, rows=0, fail=False):
+        self.seconds = seconds
+        self.rows = rows
+        self.fail = fail
+        self.starts = []
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            self.starts.append(time.time())
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            time.sleep(self.seconds)
+            if self.fail:
+                raise RuntimeError("source unavailable")
+            return pd.DataFrame({'ticker': ['T'], 'rows': [self.rows]})
+        finally:
+            with self.lock:
+                self.running -= 1
+
+class FlakyStream:
+    """A stream whose first `failures` runs raise, like a stream refused by its server, and that then runs until stopped."""
+
+    source = 'check'
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.runs = 0
+        self._stopping = None
+
+    async def run(self):
+        self.runs += 1
+        if self.runs <= self.failures:
+            raise ConnectionError("stream refused")
+        self._stopping = asyncio.Event()
+        await self._stopping.wait()
+
+    def stop(self):
+        if self._stopping is not None:
+            self._stopping.set()
+
+    def latency(self):
+        return pd.Series({'bars': 0, 'batches': 0, 'bar_close_to_stored_p50': float('nan'), 'bar_close_to_stored_p99': float('nan')})
+
+def http_get(port, path):
+    """Return the status and body of a GET request to the daemon."""
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}") as response:
+            return response.status, response.read().decode()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read().decode()
+
+async def run_daemon(daemon):
+    """Run the daemon, reading its endpoints at the start and while it runs."""
+    task = asyncio.create_task(daemon.run(duration=RUN_SECONDS))
+    await asyncio.sleep(0.05)
+    startup_health = await asyncio.to_thread(http_get, daemon.metrics_port, '/health')
+    await asyncio.sleep(1.0)
+    health = await asyncio.to_thread(http_get, daemon.metrics_port, '/health')
+    metrics = await asyncio.to_thread(http_get, daemon.metrics_port, '/metrics')
+    await task
+    return startup_health, health, metrics
+
+# Example usage
+if __name__ == "__main__":
+    # Daily jobs fire at their time of day, the next day once it has passed
+    daily = Job('daily', 'check', None, daily_at='03:00')
+    before = datetime(2024, 1, 2, 2, 59, tzinfo=timezone.utc).timestamp()
+    assert daily.next_run(before) == datetime(2024, 1, 2, 3, 0, tzinfo=timezone.utc).timestamp()
+    assert daily.next_run(before + 60) == datetime(2024, 1, 3, 3, 0, tzinfo=timezone.utc).timestamp()
+
+    fast, slow, failing, startup = SimulatedPass(0.02, rows=3), SimulatedPass(0.5), SimulatedPass(0.01, fail=True), SimulatedPass(0.3, rows=7)
+    jobs = [
+        Job('fast', 'check', fast, interval=INTERVAL_SECONDS, offset=OFFSET_SECONDS),
+        Job('slow', 'check', slow, interval=INTERVAL_SECONDS, offset=OFFSET_SECONDS),
+        Job('failing', 'check', failing, interval=INTERVAL_SECONDS, offset=OFFSET_SECONDS),
+        Job('startup', 'check', startup, daily_at='03:00', run_at_start=True),
+    ]
+    flaky = FlakyStream(failures=2)
+    daemon = IngestionDaemon(jobs, metrics_port=0, streams=[flaky])
+    start = time.time()
+    startup_health, health, (metrics_status, metrics) = asyncio.run(run_daemon(daemon))
+    fast_job, slow_job, failing_job, startup_job = jobs
+
+    # The fast job starts on the wall-clock grid every interval
+    assert len(fast.starts) >= int(RUN_SECONDS / INTERVAL_SECONDS) - 1, f"Only {len(fast.starts)} fast passes"
+    phases = [(started - OFFSET_SECONDS) % INTERVAL_SECONDS for started in fast.starts]
+    assert max(phases) < 0.05, f"A fast pass started {max(phases):.3f}s off its grid"
+    assert fast_job.rows == 3 * len(fast.starts)
+    # The slow job never overlaps itself and skips the times its passes ran over
+    assert slow.max_running == 1, "Two passes of the slow job overlapped"
+    assert slow_job.skipped >= 2 * (len(slow.starts) - 1), f"The slow job skipped {slow_job.skipped} runs in {len(slow.starts)} passes"
+    for started in slow.starts:
+        assert (started - OFFSET_SECONDS) % INTERVAL_SECONDS < 0.05, "A slow pass drifted off the grid"
+    # Failures are counted and the job keeps its schedule
+    assert failing_job.failures == failing_job.passes >= int(RUN_SECONDS / INTERVAL_SECONDS) - 1
+    # The startup job runs once at start, and health follows it
+    assert len(startup.starts) == 1 and startup.starts[0] - start < 0.05
+    assert startup_health[0] == 503 and health[0] == 200
+    assert metrics_status == 200
+    for expected in ['ingestion_pass_duration_seconds{job="slow",source="check"}', 'ingestion_pass_lag_seconds{job="fast",source="check"}',
+                     'ingestion_pass_failures_total{job="failing",source="check"}',
+                     'ingestion_rows_total{job="startup",source="check"} 7']:
+        assert expected in metrics, f"{expected} missing from the metrics"
+    # The failing stream is restarted without stopping the jobs, and healthy again once it keeps running
+    assert flaky.runs == 3 and daemon.restarts == {'check_stream': 2} and not daemon.failing
+    assert 'ingestion_component_restarts_total{component="check_stream"} 2' in metrics
+    print(f"{len(fast.starts)} fast passes on the grid (lag at most {max(phases):.3f}s), "
+          f"{len(slow.starts)} slow passes with {slow_job.skipped} skipped runs, {failing_job.failures} failed passes counted")
+
+    # A stream that keeps failing flips /health and removes the ready file, while the jobs keep running
+    ready_file = os.path.join(tempfile.mkdtemp(prefix="daemon_check_"), 'ready')
+    fast = SimulatedPass(0.02, rows=3)
+    daemon = IngestionDaemon([Job('fast', 'check', fast, interval=INTERVAL_SECONDS, offset=OFFSET_SECONDS, run_at_start=True)],
+                             metrics_port=0, ready_file=ready_file, streams=[FlakyStream(failures=1_000)])
+    _, health, _ = asyncio.run(run_daemon(daemon))
+    assert health[0] == 503 and 'failing: check_stream: stream refused' in health[1], health
+    assert not os.path.exists(ready_file) and daemon.restarts['check_stream'] > 2
+    assert len(fast.starts) >= int(RUN_SECONDS / INTERVAL_SECONDS) - 1, f"Only {len(fast.starts)} passes next to the failing stream"
+    print(f"Failing stream restarted {daemon.restarts['check_stream']} times, /health {health[0]}, {len(fast.starts)} passes meanwhile")
+    print("Ingestion daemon checks passed.")
@@ -0,0 +1,143 @@
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+# Make the Alpaca ingestion modules and the shared ingestion helpers importable from the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Research')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Research', 'alpaca')))
+# Reconnect quickly after the replay server drops the stream
+os.environ["RATE_LIMIT_BACKOFF_SECONDS"] = "0.05"
+
+from alpaca_bar_stream import AlpacaBarStream, StreamError
+from alpaca_stream_replay_server import start_stream_replay_server
+from alpaca_stub_server import synthetic_bars
+from ingestion.daemon import IngestionDaemon
+from ingestion.spool import BarSpool
+
+STREAM_CHECK_SYMBOLS = [f"S{i:03d}" for i in range(50)]
+REPLAYED_MINUTES = 12
+REPLAY_INTERVAL_SECONDS = 0.3
+DROP_AFTER_MINUTES = 5
+BATCH_SECONDS = 0.05
+STORE_SECONDS = 0.02
+SPOOL_LOAD_SECONDS = 0.15
+
+class MemoryStore:
+    """Keep the stored batches with the time each store finished, taking a while per batch like a COPY."""
+
+    def __init__(self):
+        self.batches = []
+        self.stored_at = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, data):
+        time.sleep(STORE_SECONDS)
+        stored = time.time()
+        with self.lock:
+            self.batches.append(data)
+            for key in zip(data['ticker'], data.index):
+                assert key not in self.stored_at, f"{key} was stored twice"
+                self.stored_at[key] = stored
+
+async def refused_stream(duration):
+    """Run a stream against a server refusing every handshake with HTTP 503, returning the handshakes it refused."""
+    refused = []
+
+    async def refuse(reader, writer):
+        await reader.readuntil(b'\r\n\r\n')
+        refused.append(time.time())
+        writer.write(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+        await writer.drain()
+        writer.close()
+
+    server = await asyncio.start_server(refuse, '127.0.0.1', 0)
+    url = f"ws://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+    async with server:
+        await AlpacaBarStream('key', 'secret', STREAM_CHECK_SYMBOLS, MemoryStore(), stream_url=url).run(duration=duration)
+    return refused
+
+async def stream_replay(stream, server):
+    """Run the stream until the server has replayed every minute and the last batch had time to be stored."""
+    task = asyncio.create_task(stream.run())
+    await asyncio.to_thread(server.finished.wait, 30)
+    await asyncio.sleep(0.2)
+    stream.stop()
+    await task
+
+# Example usage
+if __name__ == "__main__":
+    bars = synthetic_bars(STREAM_CHECK_SYMBOLS, REPLAYED_MINUTES)
+    server = start_stream_replay_server(bars, REPLAY_INTERVAL_SECONDS, key_id='key', secret_key='secret', restamp=True, drop_after=DROP_AFTER_MINUTES)
+    store = MemoryStore()
+    catch_ups = []
+    stream = AlpacaBarStream('key', 'secret', STREAM_CHECK_SYMBOLS, store, stream_url=server.url,
+                             catch_up=lambda: catch_ups.append(time.time()), batch_seconds=BATCH_SECONDS)
+    try:
+        asyncio.run(stream_replay(stream, server))
+    finally:
+        server.shutdown()
+
+    # Every bar the server sent is stored once, and the burst of each minute in one batch
+    sent = {(symbol, pd.Timestamp(t)): sent_at for (symbol, t), sent_at in server.sent.items()}
+    assert set(store.stored_at) == set(sent), f"{len(sent)} bars sent, {len(store.stored_at)} stored"
+    sent_minutes = len({t for _, t in sent})
+    assert len(store.batches) == stream.batches == sent_minutes, f"{stream.batches} batches for {sent_minutes} minutes"
+    # The dropped connection is reopened and subscribed again, and each subscription starts a catch-up
+    assert stream.connections == 2 and len(catch_ups) == 2, f"{stream.connections} connections, {len(catch_ups)} catch-ups"
+
+    # The end-to-end latency, from the server sending a bar to its batch being stored, stays within the batch wait
+    latencies = np.array([store.stored_at[key] - sent_at for key, sent_at in sent.items()])
+    bound = BATCH_SECONDS + STORE_SECONDS + 0.1
+    assert np.percentile(latencies, 99) < bound, f"p99 latency {np.percentile(latencies, 99):.3f}s"
+    latency = stream.latency()
+    assert latency['bars'] == len(sent) and latency['bar_close_to_stored_max'] < bound + 0.01
+    print(f"{len(sent)} bars in {stream.batches} batches over {stream.connections} connections ({server.missed} missed while reconnecting); "
+          f"bar close to stored p50 {latency['bar_close_to_stored_p50'] * 1000:.0f}ms, p99 {latency['bar_close_to_stored_p99'] * 1000:.0f}ms")
+    # The daemon serves the stream's counts and latency with its metrics
+    metrics = IngestionDaemon([], metrics_port=None, streams=[stream]).metrics()
+    assert f'ingestion_stream_bars_total{{source="alpaca"}} {len(sent)}' in metrics
+    assert 'ingestion_stream_latency_seconds{source="alpaca",quantile="0.99"}' in metrics
+
+    # Wrong credentials fail the stream instead of reconnecting forever
+    server = start_stream_replay_server(bars, REPLAY_INTERVAL_SECONDS, key_id='key', secret_key='secret')
+    try:
+        asyncio.run(AlpacaBarStream('key', 'wrong', STREAM_CHECK_SYMBOLS, store, stream_url=server.url).run(duration=5))
+    except StreamError as e:
+        assert e.code == 402 and server.connections == 1
+    else:
+        raise AssertionError("The stream ran with wrong credentials")
+    finally:
+        server.shutdown()
+
+    # Through the spool, a bar counts as stored once the spool has loaded it into the table, not once it is spooled
+    loaded = []
+
+    def load(table_name, bars):
+        time.sleep(SPOOL_LOAD_SECONDS)
+        loaded.append(bars)
+    spool = BarSpool(tempfile.mkdtemp(prefix="stream_spool_check_"), load=load)
+    server = start_stream_replay_server(synthetic_bars(STREAM_CHECK_SYMBOLS, 3), REPLAY_INTERVAL_SECONDS, restamp=True)
+    stream = AlpacaBarStream('key', 'secret', STREAM_CHECK_SYMBOLS, lambda data, stored: spool.append('check_minute', data.assign(
+                                 datetime=data.index.tz_localize(None))[['datetime', 'ticker', 'open', 'high', 'low', 'close', 'volume']],
+                             stored), stream_url=server.url, batch_seconds=BATCH_SECONDS, deferred=True)
+    try:
+        asyncio.run(stream_replay(stream, server))
+    finally:
+        server.shutdown()
+    assert spool.flush(10)
+    spool.close()
+    latency = stream.latency()
+    assert latency['bars'] == sum(len(bars) for bars in loaded) == len(server.sent), f"{latency['bars']} bars counted as stored"
+    assert latency['received_to_stored_p50'] >= SPOOL_LOAD_SECONDS, f"p50 {latency['received_to_stored_p50']:.3f}s, before the spool loaded the bars"
+    print(f"Spooled stream: bar close to loaded p50 {latency['bar_close_to_stored_p50'] * 1000:.0f}ms")
+
+    # A refused handshake, like HTTP 503 while Alpaca is down, is retried with backoff instead of ending the stream
+    refused = asyncio.run(refused_stream(1.0))
+    assert len(refused) > 2, f"{len(refused)} handshakes refused"
+    print(f"{len(refused)} refused handshakes retried")
+    print("Alpaca stream checks passed.")
@@ -0,0 +1,171 @@
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import pandas as pd
+import psycopg2
+import psycopg2.pool
+
+# Make the shared ingestion helpers importable from the repository root
+RESEARCH_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Research'))
+sys.path.insert(0, RESEARCH_DIR)
+# Retry quickly while the stand-in database is down
+os.environ["RATE_LIMIT_BACKOFF_SECONDS"] = "0.05"
+os.environ["RATE_LIMIT_MAX_BACKOFF_SECONDS"] = "0.2"
+os.environ["INGESTION_SPOOL_MAX_ATTEMPTS"] = "3"
+
+from ingestion.runner import run_ingestion_pass
+from ingestion.spool import REJECTED_DIR, SPOOL_MAX_ATTEMPTS, BarSpool, read_segment, records_to_bars
+
+SPOOL_CHECK_TICKERS = [f"T{i:02d}" for i in range(40)]
+BARS_PER_TICKER = 390
+LOAD_SECONDS = 0.05
+FETCH_SECONDS = 0.005
+
+class StandInDatabase:
+    """Stands in for load_bars: unreachable while `down`, a while per load, refusing the bars of ticker BAD."""
+
+    def __init__(self, down=False, down_error=psycopg2.OperationalError("could not connect to server: Connection refused")):
+        self.down = down
+        self.down_error = down_error
+        self.loaded = {}
+        self.loads = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, table_name, bars):
+        if self.down:
+            raise self.down_error
+        time.sleep(LOAD_SECONDS)
+        if (bars['ticker'] == 'BAD').any():
+            raise psycopg2.errors.NumericValueOutOfRange("value out of range")
+        with self.lock:
+            self.loads += 1
+            self.loaded.setdefault(table_name, []).append(bars)
+
+    def table(self, table_name):
+        return sort_bars(pd.concat(self.loaded.get(table_name, [])))
+
+def make_bars(ticker, n_bars=BARS_PER_TICKER, seed=0):
+    """A day of minute bars of a ticker with BAR_COLUMNS, as the ingestion scripts store them."""
+    rng = np.random.default_rng(seed)
+    close = 100 + rng.standard_normal(n_bars).cumsum() * 0.05
+    return pd.DataFrame({
+        'datetime': pd.date_range('2024-01-02 14:30', periods=n_bars, freq='min'),
+        'ticker': ticker,
+        'open': close, 'high': close + 0.05, 'low': close - 0.05, 'close': close,
+        'volume': rng.integers(100, 50_000, n_bars),
+    })
+
+def sort_bars(bars):
+    return bars.sort_values(['ticker', 'datetime']).reset_index(drop=True)
+
+def fetch(ticker):
+    """A fetch that takes a little while, like a request to the source."""
+    time.sleep(FETCH_SECONDS)
+    return make_bars(ticker, seed=int(ticker[1:]))
+
+# Example usage
+if __name__ == "__main__":
+    expected = sort_bars(pd.concat([make_bars(ticker, seed=int(ticker[1:])) for ticker in SPOOL_CHECK_TICKERS]))
+
+    # Storing straight into a database that takes a while per write holds the pass back
+    database = StandInDatabase()
+    start = time.perf_counter()
+    run_ingestion_pass(SPOOL_CHECK_TICKERS, fetch, lambda ticker, data: database('direct_minute', data), 'check', workers=8)
+    direct_seconds = time.perf_counter() - start
+
+    # Through the spool the pass runs at the speed of the fetches, even with the database down
+    database = StandInDatabase(down=True)
+    spool = BarSpool(tempfile.mkdtemp(prefix="spool_check_"), load=database)
+    start = time.perf_counter()
+    report = run_ingestion_pass(SPOOL_CHECK_TICKERS, fetch, lambda ticker, data: spool.append('check_minute', data), 'check', workers=8)
+    spooled_seconds = time.perf_counter() - start
+    assert report['error'].isna().all(), report[report['error'].notna()]
+    assert spooled_seconds < direct_seconds / 4, f"The spooled pass took {spooled_seconds:.2f}s, the direct one {direct_seconds:.2f}s"
+    assert not spool.flush(0.5), "The spool emptied while the database was down"
+    usage = spool.usage().set_index('table').loc['check_minute']
+    assert usage['spooled_rows'] == len(expected) and usage['loaded_rows'] == 0
+    marks = spool.high_water_marks('check_minute')
+    assert marks == {ticker: expected['datetime'].max() for ticker in SPOOL_CHECK_TICKERS}
+    print(f"Pass of {len(SPOOL_CHECK_TICKERS)} tickers: {direct_seconds:.2f}s storing directly, "
+          f"{spooled_seconds:.2f}s into the spool with the database down")
+
+    # Once the database is back every bar is loaded, in a few large loads, and the segments are gone
+    database.down = False
+    assert spool.flush(10), "The spool was not emptied once the database was back"
+    pd.testing.assert_frame_equal(database.table('check_minute'), expected, check_dtype=False)
+    assert database.loads < len(SPOOL_CHECK_TICKERS) / 4, f"{database.loads} loads for {len(SPOOL_CHECK_TICKERS)} appends"
+    assert not [name for name in os.listdir(os.path.join(spool.spool_dir, 'check_minute')) if name != REJECTED_DIR]
+    print(f"Database back: {len(expected):,} bars loaded in {database.loads} loads")
+
+    # Bars the database refuses are set aside after a few attempts without holding back the others
+    database.down = True
+    for ticker in ['G01', 'BAD', 'G02']:
+        spool.append('check_mixed', make_bars(ticker, 10))
+        spool.flush(0.1)
+    database.down = False
+    assert spool.flush(10), "The refused bars held back the spool"
+    assert sorted(database.table('check_mixed')['ticker'].unique()) == ['G01', 'G02']
+    rejected_dir = os.path.join(spool.spool_dir, 'check_mixed', REJECTED_DIR)
+    rejected = records_to_bars(np.concatenate([read_segment(os.path.join(rejected_dir, name)) for name in os.listdir(rejected_dir)]))
+    pd.testing.assert_frame_equal(rejected, make_bars('BAD', 10), check_dtype=False)
+    assert spool.stats['check_mixed']['rejected_segments'] == 1
+    # The set aside bars are not stored, so the next pass must fetch them again
+    assert 'BAD' not in spool.high_water_marks('check_mixed'), "Set aside bars still count as stored"
+    spool.close()
+    print(f"Refused bars set aside after {SPOOL_MAX_ATTEMPTS} attempts")
+
+    # An exhausted connection pool counts as the database being unavailable, so no segment is set aside for it
+    database = StandInDatabase(down=True, down_error=psycopg2.pool.PoolError("connection pool exhausted"))
+    spool = BarSpool(tempfile.mkdtemp(prefix="spool_pool_check_"), load=database)
+    spool.append('check_minute', make_bars('AAA'))
+    for _ in range(SPOOL_MAX_ATTEMPTS + 1):
+        spool.flush(0.1)
+    assert spool.stats['check_minute']['rejected_segments'] == 0, "Segments were set aside while the pool was exhausted"
+    database.down = False
+    assert spool.flush(10), "The spool was not emptied once connections were free again"
+
+    # The flusher outlives an unexpected error, like a segment it cannot read, and goes on loading
+    flush_once = spool._flush_once
+    failures = []
+
+    def failing_flush_once():
+        if not failures:
+            failures.append(time.time())
+            raise OSError("Input/output error")
+        flush_once()
+    spool._flush_once = failing_flush_once
+    spool.append('check_minute', make_bars('BBB'))
+    assert spool.flush(10) and failures and spool._flusher.is_alive(), "The flusher stopped after an unexpected error"
+    spool.close()
+    print("Exhausted pool waited out, flusher survived an unexpected error")
+
+    # A process that dies mid-write leaves its open segment, with a torn record, to the next spool
+    spool_dir = tempfile.mkdtemp(prefix="spool_crash_check_")
+    crash = f"""
+import os, sys
+sys.path.insert(0, {RESEARCH_DIR!r})
+sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r})
+from ingestion.spool import BarSpool
+from test20_ingestion_spool import make_bars
+spool = BarSpool({spool_dir!r}, load=None)
+# Die before the flusher seals the segment
+spool._start_flusher = lambda: None
+spool.append('check_minute', make_bars('AAA'))
+spool.append('check_minute', make_bars('BBB'))
+segment = next(iter(spool._segments.values()))
+os.write(segment.fd, b'torn')
+os._exit(1)
+"""
+    subprocess.run([sys.executable, '-c', crash], check=False)
+    database = StandInDatabase()
+    spool = BarSpool(spool_dir, load=database)
+    assert spool.high_water_marks('check_minute') == {'AAA': expected['datetime'].max(), 'BBB': expected['datetime'].max()}
+    assert spool.flush(10), "The segment of the dead process was not loaded"
+    pd.testing.assert_frame_equal(database.table('check_minute'), sort_bars(pd.concat([make_bars('AAA'), make_bars('BBB')])), check_dtype=False)
+    spool.close()
+    print("Segment of a crashed process recovered without its torn record")
+    print("Ingestion spool checks passed.")
@@ -0,0 +1,126 @@
+import os
+import sys
+import pandas as pd
+
+# Make the Alpaca ingestion modules and the shared helpers importable from the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Research')))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Research', 'alpaca')))
+# The stub server has no quota, so the checks run without the Alpaca rate limit
+os.environ.setdefault("RATE_LIMIT_ALPACA_PER_MINUTE", "0")
+# Like the other test scripts, talk to the database published on localhost unless told otherwise
+os.environ.setdefault("POSTGRES_HOST", "localhost")
+
+from alpaca_bars_client import AlpacaBarsClient
+from alpaca_stub_server import start_stub_server, synthetic_bars
+from db.connection import transaction
+from db.fetch import fetch_dataframe
+from db.schema import ensure_table
+from ingestion.backfill import BACKFILL_TABLE_NAME, chunk_fetcher, job_progress, run_backfill
+
+BACKFILL_CHECK_TABLE_NAME = "backfill_check_minute_bars"
+BACKFILL_CHECK_JOB = "backfill_check"
+BAR_COLUMN_TYPES = {
+    'datetime': 'TIMESTAMP',
+    'ticker': 'VARCHAR(10)',
+    'open': 'DOUBLE PRECISION',
+    'high': 'DOUBLE PRECISION',
+    'low': 'DOUBLE PRECISION',
+    'close': 'DOUBLE PRECISION',
+    'volume': 'BIGINT',
+}
+BACKFILL_CHECK_SYMBOLS = [f"B{i:02d}" for i in range(8)]
+BARS_PER_DAY = 390
+TRADING_DAYS = 40
+START, END = '2024-01-01', '2024-03-01'
+CHUNK_DAYS = 7
+
+class ChunkSource:
+    """Fetch chunks from the stub server, failing the chunks of `failing` and interrupting like Ctrl-C after `interrupt_after` chunks."""
+
+    def __init__(self, client, failing=(), interrupt_after=None):
+        self.fetch = chunk_fetcher('alpaca', 'minute', client)
+        self.failing = set(failing)
+        self.interrupt_after = interrupt_after
+        self.fetched = []
+
+    def __call__(self, ticker, start, end):
+        self.fetched.append((ticker, start.tz_localize(None)))
+        if self.interrupt_after is not None and len(self.fetched) > self.interrupt_after:
+            raise KeyboardInterrupt
+        if (ticker, start.tz_localize(None)) in self.failing:
+            raise ConnectionError("connection reset by peer")
+        return self.fetch(ticker, start, end)
+
+def backfill(source, workers=4):
+    return run_backfill(BACKFILL_CHECK_JOB, 'alpaca', BACKFILL_CHECK_TABLE_NAME, BACKFILL_CHECK_SYMBOLS, START, END, source, CHUNK_DAYS, workers)
+
+def chunk_status():
+    """Read the recorded status of every chunk of the check job."""
+    return fetch_dataframe(f"SELECT ticker, chunk_start, status, rows, attempts FROM {BACKFILL_TABLE_NAME} WHERE job = %s ORDER BY chunk_start, ticker;",
+                           params=(BACKFILL_CHECK_JOB,))
+
+def clean_up():
+    with transaction() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {BACKFILL_CHECK_TABLE_NAME};")
+        cursor.execute("SELECT to_regclass(%s);", (BACKFILL_TABLE_NAME,))
+        if cursor.fetchone()[0] is not None:
+            cursor.execute(f"DELETE FROM {BACKFILL_TABLE_NAME} WHERE job = %s;", (BACKFILL_CHECK_JOB,))
+
+# Example usage
+if __name__ == "__main__":
+    all_bars = synthetic_bars(BACKFILL_CHECK_SYMBOLS, TRADING_DAYS * BARS_PER_DAY)
+    expected = sum(len(bars) for bars in all_bars.values())
+    server = start_stub_server(all_bars, latency=0.02)
+    client = AlpacaBarsClient('key', 'secret', data_url=server.url)
+    with transaction() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {BACKFILL_CHECK_TABLE_NAME};")
+        ensure_table(cursor, BACKFILL_CHECK_TABLE_NAME, BAR_COLUMN_TYPES)
+    try:
+        # Two chunks fail; the others are loaded and marked done
+        failing = [('B03', pd.Timestamp('2024-01-15')), ('B06', pd.Timestamp('2024-02-19'))]
+        report = backfill(ChunkSource(client, failing))
+        status = chunk_status()
+        assert (status['status'] == 'failed').sum() == len(failing) and report['error'].notna().sum() == len(failing)
+        assert (status['status'] == 'done').sum() == len(status) - len(failing)
+        loaded = int(report['rows'].sum())
+        assert status['rows'].sum() == loaded
+        print(f"First run: {len(status)} chunks, {loaded:,} bars, {len(failing)} failed")
+
+        # Running the job again fetches the failed chunks only, and completes the table
+        source = ChunkSource(client)
+        report = backfill(source)
+        assert sorted(source.fetched) == sorted(failing), f"The second run fetched {source.fetched}"
+        status = chunk_status()
+        assert (status['status'] == 'done').all() and status.set_index(['ticker', 'chunk_start']).loc[failing, 'attempts'].eq(2).all()
+        stored = fetch_dataframe(f"SELECT COUNT(*) AS bars FROM {BACKFILL_CHECK_TABLE_NAME};")['bars'].iloc[0]
+        assert stored == expected, f"Stored {stored} bars of {expected}"
+        print(f"Second run: the {len(failing)} failed chunks, {int(report['rows'].sum()):,} bars; {stored:,} bars stored")
+
+        # An interrupted backfill keeps the chunks it loaded and resumes with the rest
+        clean_up()
+        with transaction() as cursor:
+            ensure_table(cursor, BACKFILL_CHECK_TABLE_NAME, BAR_COLUMN_TYPES)
+        try:
+            backfill(ChunkSource(client, interrupt_after=20), workers=2)
+        except KeyboardInterrupt:
+            pass
+        else:
+            raise AssertionError("The interrupt did not stop the backfill")
+        status = chunk_status()
+        done = int((status['status'] == 'done').sum())
+        assert 0 < done <= 20 and (status['status'] != 'done').sum() == len(status) - done
+        stored = fetch_dataframe(f"SELECT COUNT(*) AS bars FROM {BACKFILL_CHECK_TABLE_NAME};")['bars'].iloc[0]
+        assert stored == status['rows'].sum(), "Bars were loaded without their chunks being marked done"
+        source = ChunkSource(client)
+        report = backfill(source)
+        assert len(source.fetched) == len(status) - done, f"The resumed run fetched {len(source.fetched)} chunks"
+        stored = fetch_dataframe(f"SELECT COUNT(*) AS bars FROM {BACKFILL_CHECK_TABLE_NAME};")['bars'].iloc[0]
+        assert stored == expected, f"Stored {stored} bars of {expected} after resuming"
+        progress = job_progress(BACKFILL_CHECK_JOB).set_index('status')
+        assert list(progress.index) == ['done'] and progress.loc['done', 'rows'] == expected
+        print(f"Interrupted after {done} chunks, resumed with {len(source.fetched)}; "
+              f"{int(report['rows'].sum()) / report['fetch_seconds'].sum():,.0f} bars per fetch second")
+        print("Backfill checks passed.")
+    finally:
+        server.shutdown()
+        clean_up()
@@ -0,0 +1,265 @@
+import importlib.util
+import math
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+# Make the shared panel and the strategy indicator modules importable from the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Research')))
+TREND_FOLLOWING_DIR = os.path.join(os.path.dirname(__file__), '..', 'Research', 'generic_strategies', 'trend_following')
+sys.path.insert(0, os.path.abspath(TREND_FOLLOWING_DIR))
+
+from indicators.panel import Panel
+from technical_indicators.ADX import compute_adx, compute_adx_panel
+from technical_indicators.EMA import compute_ema, compute_emas, compute_emas_panel
+from technical_indicators.incremental import IncrementalIndicatorEngine, _ewm_update
+
+# The mean reversion indicators live in a second 'technical_indicators' folder, so load them by path
+MEAN_REVERSION_INDICATORS_DIR = os.path.join(os.path.dirname(__file__), '..', 'Research', 'generic_strategies', 'mean_reversion', 'technical_indicators')
+
+def load_mean_reversion_indicator(module_name):
+    """Import a module from the mean reversion technical_indicators folder by file path."""
+    spec = importlib.util.spec_from_file_location(f'mean_reversion_{module_name}', os.path.join(MEAN_REVERSION_INDICATORS_DIR, f'{module_name}.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+rolling_z_score = load_mean_reversion_indicator('rolling_z_score')
+
+BENCHMARK_ROWS = 1_000_000
+BENCHMARK_TICKERS = 24
+EMA_BENCHMARK_TICKER_COUNTS = (10, 100, 500)
+EMA_BENCHMARK_BARS_PER_TICKER = 2_000
+Z_SCORE_BENCHMARK_WINDOWS = (5, 10, 15, 20, 30, 45, 60, 90, 120, 240)
+
+def make_synthetic_bars(n_tickers, n_bars, seed=0):
+    """Build a shuffled multi-ticker minute bar frame with random-walk prices."""
+    rng = np.random.default_rng(seed)
+    datetimes = pd.date_range('2024-01-02 09:30', periods=n_bars, freq='min')
+    frames = []
+    for i in range(n_tickers):
+        close = np.round(100 + rng.standard_normal(n_bars).cumsum(), 2)
+        # Flat stretches produce ties in +DM/-DM and zero true ranges
+        close[n_bars // 3:n_bars // 3 + 20] = close[n_bars // 3]
+        spread = np.round(rng.random(n_bars), 2)
+        spread[n_bars // 3:n_bars // 3 + 20] = 0
+        frames.append(pd.DataFrame({
+            'datetime': datetimes,
+            'ticker': f'T{i:03d}',
+            'open': close,
+            'high': close + spread,
+            'low': close - spread,
+            'close': close,
+            'volume': rng.integers(1, 10_000, n_bars),
+        }))
+    return pd.concat(frames, ignore_index=True).sample(frac=1, random_state=seed)
+
+def legacy_compute_ema(df, span=14):
+    """Single-span EMA as originally implemented, kept as the reference for regression checks."""
+    df = df.sort_values(by='datetime')
+    df[f'ema_{span}'] = df.groupby('ticker')['close'].transform(lambda x: x.ewm(span=span, adjust=False).mean())
+    return df
+
+def legacy_compute_adx(df, span=14):
+    """Row-wise ADX as originally implemented, kept as the reference for regression checks."""
+    df = df.sort_values(by='datetime')
+    df['prev_close'] = df.groupby('ticker')['close'].shift(1)
+    df['high_low'] = df['high'] - df['low']
+    df['high_prev_close'] = (df['high'] - df['prev_close']).abs()
+    df['low_prev_close'] = (df['low'] - df['prev_close']).abs()
+    df['tr'] = df[['high_low', 'high_prev_close', 'low_prev_close']].max(axis=1)
+    df['prev_high'] = df.groupby('ticker')['high'].shift(1)
+    df['prev_low'] = df.groupby('ticker')['low'].shift(1)
+    df['+dm'] = df['high'] - df['prev_high']
+    df['-dm'] = df['prev_low'] - df['low']
+    df['+dm'] = df.apply(lambda row: row['+dm'] if row['+dm'] > row['-dm'] and row['+dm'] > 0 else 0, axis=1)
+    df['-dm'] = df.apply(lambda row: row['-dm'] if row['-dm'] > row['+dm'] and row['-dm'] > 0 else 0, axis=1)
+    df['atr'] = df.groupby('ticker')['tr'].transform(lambda x: x.ewm(span=span, adjust=False).mean())
+    df['+di'] = 100 * df.groupby('ticker')['+dm'].transform(lambda x: x.ewm(span=span, adjust=False).mean()) / df['atr']
+    df['-di'] = 100 * df.groupby('ticker')['-dm'].transform(lambda x: x.ewm(span=span, adjust=False).mean()) / df['atr']
+    df['dx'] = (abs(df['+di'] - df['-di']) / (df['+di'] + df['-di'])) * 100
+    df['adx'] = df.groupby('ticker')['dx'].transform(lambda x: x.ewm(span=span, adjust=False).mean())
+    df.drop(['prev_close', 'high_low', 'high_prev_close', 'low_prev_close', 'tr', 'prev_high', 'prev_low', '+dm', '-dm', 'atr', 'dx'], axis=1, inplace=True)
+    return df
+
+def assert_frames_equal(expected, actual, columns):
+    """Check that two indicator frames share row order and hold identical values."""
+    assert list(expected.columns) == list(actual.columns), f"Column mismatch: {list(expected.columns)} != {list(actual.columns)}"
+    assert expected.index.equals(actual.index), "Row order differs"
+    for column in columns:
+        assert np.array_equal(expected[column].to_numpy(dtype=float), actual[column].to_numpy(dtype=float), equal_nan=True), \
+            f"Values differ in column {column}"
+
+def check_adx_equivalence():
+    """Compare the vectorized ADX against the legacy row-wise implementation."""
+    bars = make_synthetic_bars(n_tickers=6, n_bars=2_000)
+    for span in (5, 14):
+        expected = legacy_compute_adx(bars.copy(), span=span)
+        actual = compute_adx(bars.copy(), span=span)
+        assert_frames_equal(expected, actual, ['+di', '-di', 'adx'])
+    print("ADX equivalence check passed.")
+
+def check_ema_equivalence():
+    """Compare the single-pass multi-span EMA against chained legacy single-span calls."""
+    bars = make_synthetic_bars(n_tickers=6, n_bars=2_000)
+    expected = bars.copy()
+    for span in (10, 20, 50):
+        expected = legacy_compute_ema(expected, span=span)
+    actual = compute_emas(bars.copy(), spans=[10, 20, 50])
+    # Each chained call re-sorts, so rows sharing a datetime may come back in a different order
+    actual = actual.loc[expected.index]
+    assert_frames_equal(expected, actual, ['ema_10', 'ema_20', 'ema_50'])
+    assert_frames_equal(legacy_compute_ema(bars.copy(), span=14), compute_ema(bars.copy(), span=14), ['ema_14'])
+    print("EMA equivalence check passed.")
+
+def legacy_grouped_z_score(df, window):
+    """Per-ticker rolling z-score with pandas rolling mean/std, used as the reference for the cumulative-sum version."""
+    df = df.sort_values(by=['ticker', 'datetime'])
+    grouped_close = df.groupby('ticker')['close']
+    rolling_mean = grouped_close.transform(lambda x: x.rolling(window=window).mean())
+    rolling_std = grouped_close.transform(lambda x: x.rolling(window=window).std())
+    # Flat windows leave pandas with a rounding-noise std; treat them as zero variance
+    rolling_std = rolling_std.where(rolling_std > 1e-4)
+    return ((df['close'] - rolling_mean) / rolling_std).replace([np.inf, -np.inf], np.nan)
+
+def check_z_score_equivalence():
+    """Compare the one-pass multi-window z-score against per-ticker pandas rolling statistics."""
+    bars = make_synthetic_bars(n_tickers=5, n_bars=3_000)
+    bars.loc[bars.index[:10], 'close'] = np.nan
+    windows = [5, 20, 60]
+    actual = rolling_z_score.calculate_rolling_z_scores(bars.copy(), windows=windows)
+    for window in windows:
+        expected = legacy_grouped_z_score(bars, window)
+        result = actual.loc[expected.index, f'z_score_{window}']
+        assert (result.isna() == expected.isna()).all(), f"Missing values differ for window {window}"
+        assert np.allclose(result.dropna(), expected.dropna(), rtol=1e-6, atol=1e-6), f"Values differ for window {window}"
+    print("Rolling z-score equivalence check passed.")
+
+def check_panel_kernels():
+    """Compare the panel EMA, ADX and z-score kernels with the long-format functions, including tickers with missing bars."""
+    bars = make_synthetic_bars(n_tickers=5, n_bars=1_500)
+    # Give every ticker its own gaps so the panel has cells without a bar
+    bars = bars.drop(bars.sample(frac=0.1, random_state=3).index)
+    panel = Panel.from_long(bars)
+
+    indicators = compute_emas_panel(panel, spans=[10, 20, 50])
+    indicators.update(compute_adx_panel(panel))
+    indicators.update(rolling_z_score.calculate_rolling_z_scores_panel(panel, windows=[20, 60]))
+    actual = panel.to_long(indicators)
+
+    expected = compute_adx(compute_emas(bars.copy(), spans=[10, 20, 50]))
+    expected = rolling_z_score.calculate_rolling_z_scores(expected, windows=[20, 60])
+    expected = expected.sort_values(by=['datetime', 'ticker']).reset_index(drop=True)
+
+    assert len(actual) == len(expected), "Panel round trip changed the number of bars"
+    assert (actual['ticker'].to_numpy() == expected['ticker'].to_numpy()).all(), "Panel round trip reordered bars"
+    assert actual['volume'].dtype == expected['volume'].dtype, "Panel round trip changed the volume dtype"
+    for column in ['close', 'ema_10', 'ema_20', 'ema_50', '+di', '-di', 'adx']:
+        assert np.array_equal(actual[column].to_numpy(), expected[column].to_numpy(dtype=float), equal_nan=True), \
+            f"Values differ in column {column}"
+    for column in ['z_score_20', 'z_score_60']:
+        assert (actual[column].isna() == expected[column].isna()).all(), f"Missing values differ in column {column}"
+        assert np.allclose(actual[column].dropna(), expected[column].dropna(), rtol=1e-6, atol=1e-6), f"Values differ in column {column}"
+    print("Panel kernel equivalence check passed.")
+
+def check_incremental_engine():
+    """Feed bars to the incremental engine in two runs with a checkpoint in between and compare to the batch functions."""
+    bars = make_synthetic_bars(n_tickers=4, n_bars=1_500)
+    expected = bars.copy()
+    for span in (10, 20, 50):
+        expected = compute_ema(expected, span=span)
+    expected = compute_adx(expected)
+
+    split = bars['datetime'].sort_values().iloc[len(bars) // 2]
+    engine = IncrementalIndicatorEngine()
+    first = engine.update_frame(bars[bars['datetime'] <= split])
+    # Round-trip the state through the checkpoint format, as a restarted process would
+    engine = IncrementalIndicatorEngine.from_records(engine.to_records())
+    second = engine.update_frame(bars)
+    actual = pd.concat([first, second])
+
+    assert len(actual) == len(expected), "Incremental run did not apply every bar exactly once"
+    actual = actual.loc[expected.index]
+    assert_frames_equal(expected, actual, ['ema_10', 'ema_20', 'ema_50', '+di', '-di', 'adx'])
+
+    # Every span, the span 3 whose center of mass is 1 included, follows pandas across gaps of missing values
+    values = np.random.default_rng(1).standard_normal(200)
+    values[[5, 6, 7, 40, 41, 120]] = np.nan
+    for span in (2, 3, 10):
+        state = [math.nan, 1.]
+        stepped = [_ewm_update(state, value, span) for value in values]
+        expected_ema = pd.Series(values).ewm(span=span, adjust=False).mean().to_numpy()
+        np.testing.assert_allclose(stepped, expected_ema, rtol=1e-12, err_msg=f"span {span}")
+    print("Incremental engine equivalence check passed.")
+
+def benchmark_adx(n_rows=BENCHMARK_ROWS, n_tickers=BENCHMARK_TICKERS):
+    """Time the legacy and vectorized ADX on a synthetic frame of roughly n_rows bars."""
+    bars = make_synthetic_bars(n_tickers=n_tickers, n_bars=n_rows // n_tickers)
+    start = time.perf_counter()
+    legacy_compute_adx(bars.copy())
+    legacy_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    compute_adx(bars.copy())
+    vectorized_seconds = time.perf_counter() - start
+    print(f"ADX on {len(bars):,} rows: legacy {legacy_seconds:.2f}s, vectorized {vectorized_seconds:.2f}s "
+          f"({legacy_seconds / vectorized_seconds:.1f}x)")
+
+def benchmark_emas(ticker_counts=EMA_BENCHMARK_TICKER_COUNTS, n_bars=EMA_BENCHMARK_BARS_PER_TICKER):
+    """Time chained legacy compute_ema calls against a single compute_emas call for several universe sizes."""
+    for n_tickers in ticker_counts:
+        bars = make_synthetic_bars(n_tickers=n_tickers, n_bars=n_bars)
+        start = time.perf_counter()
+        chained = bars
+        for span in (10, 20, 50):
+            chained = legacy_compute_ema(chained, span=span)
+        chained_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        compute_emas(bars, spans=[10, 20, 50])
+        single_pass_seconds = time.perf_counter() - start
+        print(f"EMA 10/20/50 for {n_tickers} tickers ({len(bars):,} rows): chained {chained_seconds:.2f}s, "
+              f"single pass {single_pass_seconds:.2f}s ({chained_seconds / single_pass_seconds:.1f}x)")
+
+def benchmark_z_scores(n_rows=BENCHMARK_ROWS, n_tickers=BENCHMARK_TICKERS, windows=Z_SCORE_BENCHMARK_WINDOWS):
+    """Time a window sweep with per-window pandas rolling against a single multi-window call."""
+    bars = make_synthetic_bars(n_tickers=n_tickers, n_bars=n_rows // n_tickers)
+    start = time.perf_counter()
+    for window in windows:
+        legacy_grouped_z_score(bars, window)
+    legacy_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    rolling_z_score.calculate_rolling_z_scores(bars.copy(), windows=windows)
+    single_pass_seconds = time.perf_counter() - start
+    print(f"Z-score sweep of {len(windows)} windows on {len(bars):,} rows: per-window rolling {legacy_seconds:.2f}s, "
+          f"single pass {single_pass_seconds:.2f}s ({legacy_seconds / single_pass_seconds:.1f}x)")
+
+def benchmark_panel(n_tickers=500, n_bars=EMA_BENCHMARK_BARS_PER_TICKER):
+    """Time EMA, ADX and z-score on the long format against the panel kernels, including the pivots."""
+    bars = make_synthetic_bars(n_tickers=n_tickers, n_bars=n_bars)
+    start = time.perf_counter()
+    long_result = compute_adx(compute_emas(bars, spans=[10, 20, 50]))
+    rolling_z_score.calculate_rolling_z_scores(long_result, windows=[20])
+    long_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    panel = Panel.from_long(bars)
+    indicators = compute_emas_panel(panel, spans=[10, 20, 50])
+    indicators.update(compute_adx_panel(panel))
+    indicators.update(rolling_z_score.calculate_rolling_z_scores_panel(panel, windows=[20]))
+    panel.to_long(indicators)
+    panel_seconds = time.perf_counter() - start
+    print(f"EMA/ADX/z-score for {n_tickers} tickers ({len(bars):,} rows): long format {long_seconds:.2f}s, "
+          f"panel {panel_seconds:.2f}s ({long_seconds / panel_seconds:.1f}x)")
+
+# Example usage
+if __name__ == "__main__":
+    check_adx_equivalence()
+    check_ema_equivalence()
+    check_z_score_equivalence()
+    check_panel_kernels()
+    check_incremental_engine()
+    if '--benchmark' in sys.argv:
+        benchmark_adx()
+        benchmark_emas()
+        benchmark_z_scores()
+        benchmark_panel()
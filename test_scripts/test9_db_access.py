@@ -0,0 +1,254 @@
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import psycopg2
+
+# Make the shared database helpers importable from the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'Research')))
+# Like the other test scripts, talk to the database published on localhost unless told otherwise
+os.environ.setdefault("POSTGRES_HOST", "localhost")
+
+from db.bulk import copy_upsert
+from db.copy_reader import copy_dataframe
+from db.connection import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
+from db.fetch import fetch_dataframe, fetch_value, iter_ticker_frames
+from db.schema import PRICE_COLUMNS, ensure_float_columns
+
+BENCHMARK_TABLE_NAME = "benchmark_ticker_indicators"
+BARS_BENCHMARK_TABLE_NAME = "benchmark_alpaca_minute"
+INDICATOR_COLUMNS = ['datetime', 'ticker', 'open', 'high', 'low', 'close', 'volume',
+                     'ema_10', 'ema_20', 'ema_50', 'adx', 'plus_di', 'minus_di', 'trend']
+LOOP_BENCHMARK_ROWS = 20_000
+COPY_BENCHMARK_ROWS = (20_000, 500_000)
+BENCHMARK_TICKERS = 50
+CONNECTION_BENCHMARK_QUERIES = 200
+STREAM_CHUNK_SIZE = 20_000
+COPY_READ_BENCHMARK_ROWS = 2_000_000
+BAR_COLUMNS = ['datetime', 'ticker', 'open', 'high', 'low', 'close', 'volume']
+
+def connect():
+    """Open a connection to the research database."""
+    return psycopg2.connect(
+        host=DB_HOST,
+        port=DB_PORT,
+        database=DB_NAME,
+        user=DB_USER,
+        password=DB_PASSWORD
+    )
+
+def make_indicator_rows(n_rows, n_tickers=BENCHMARK_TICKERS, seed=0):
+    """Build a synthetic ticker_*_indicators frame with NaN warm-up values."""
+    rng = np.random.default_rng(seed)
+    n_bars = n_rows // n_tickers
+    datetimes = np.tile(pd.date_range('2024-01-02 09:30', periods=n_bars, freq='min'), n_tickers)
+    tickers = np.repeat([f"T{i:03d}" for i in range(n_tickers)], n_bars)
+    close = 100 + rng.standard_normal(len(tickers)).cumsum() * 0.1
+    df = pd.DataFrame({
+        'datetime': datetimes,
+        'ticker': tickers,
+        'open': close + rng.normal(0, 0.05, len(close)),
+        'high': close + 0.2,
+        'low': close - 0.2,
+        'close': close,
+        'volume': rng.integers(100, 10_000, len(close)),
+    })
+    for name in ['ema_10', 'ema_20', 'ema_50', 'adx', 'plus_di', 'minus_di']:
+        df[name] = close + rng.normal(0, 1, len(close))
+    df.loc[df.groupby('ticker').cumcount() < 14, ['adx', 'plus_di', 'minus_di']] = np.nan
+    df['trend'] = rng.choice(['uptrend', 'downtrend', 'neutral'], len(close))
+    return df
+
+def reset_benchmark_table(cursor):
+    """Recreate the scratch table with the trend following indicators schema."""
+    cursor.execute(f"DROP TABLE IF EXISTS {BENCHMARK_TABLE_NAME};")
+    cursor.execute(f"""
+    CREATE TABLE {BENCHMARK_TABLE_NAME} (
+        datetime TIMESTAMP,
+        ticker VARCHAR(10),
+        open FLOAT,
+        high FLOAT,
+        low FLOAT,
+        close FLOAT,
+        volume BIGINT,
+        ema_10 FLOAT,
+        ema_20 FLOAT,
+        ema_50 FLOAT,
+        adx FLOAT,
+        plus_di FLOAT,
+        minus_di FLOAT,
+        trend VARCHAR(10),
+        PRIMARY KEY (ticker, datetime)
+    );
+    """)
+
+def write_rows_with_loop(cursor, df):
+    """The per-row INSERT ... ON CONFLICT loop that write_data_to_db used before the COPY path."""
+    insert_query = f"""
+    INSERT INTO {BENCHMARK_TABLE_NAME} ({", ".join(INDICATOR_COLUMNS)})
+    VALUES ({", ".join(['%s'] * len(INDICATOR_COLUMNS))})
+    ON CONFLICT (datetime, ticker) DO UPDATE SET
+    {", ".join(f"{column} = EXCLUDED.{column}" for column in INDICATOR_COLUMNS[2:])};
+    """
+    for _, row in df.iterrows():
+        values = [None if pd.isna(row[column]) else row[column] for column in INDICATOR_COLUMNS]
+        values[6] = int(values[6])
+        cursor.execute(insert_query, values)
+
+def time_write(connection, write, df, label):
+    """Time a write of df into an empty scratch table and then an upsert of the same rows over it."""
+    cursor = connection.cursor()
+    reset_benchmark_table(cursor)
+    connection.commit()
+    for phase in ('insert', 'upsert'):
+        start = time.perf_counter()
+        write(cursor, df)
+        connection.commit()
+        seconds = time.perf_counter() - start
+        print(f"{label} {phase} of {len(df):,} rows: {seconds:.2f}s ({len(df) / seconds:,.0f} rows/sec)")
+    cursor.close()
+    return seconds
+
+def check_round_trip(connection, df):
+    """Check that the rows written through COPY read back unchanged, including NULLs."""
+    cursor = connection.cursor()
+    cursor.execute(f"SELECT {', '.join(INDICATOR_COLUMNS)} FROM {BENCHMARK_TABLE_NAME} ORDER BY ticker, datetime;")
+    stored = pd.DataFrame(cursor.fetchall(), columns=INDICATOR_COLUMNS)
+    cursor.close()
+    expected = df.sort_values(['ticker', 'datetime']).reset_index(drop=True)
+    assert len(stored) == len(expected), f"Expected {len(expected)} rows, found {len(stored)}"
+    for column in INDICATOR_COLUMNS[2:]:
+        if column == 'trend':
+            assert (stored[column] == expected[column]).all(), "trend values differ"
+        else:
+            assert np.allclose(stored[column].astype(float), expected[column].astype(float), rtol=0, atol=1e-9, equal_nan=True), f"{column} values differ"
+    print("COPY round trip check passed.")
+
+def benchmark_connection_setup(n_queries=CONNECTION_BENCHMARK_QUERIES):
+    """Time small queries that each open a new connection against the same queries on the shared pool."""
+    start = time.perf_counter()
+    for _ in range(n_queries):
+        connection = connect()
+        cursor = connection.cursor()
+        cursor.execute("SELECT 1;")
+        cursor.fetchall()
+        cursor.close()
+        connection.close()
+    connect_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(n_queries):
+        fetch_value("SELECT 1;")
+    pooled_seconds = time.perf_counter() - start
+    print(f"{n_queries} queries: new connection each {connect_seconds / n_queries * 1000:.2f} ms/query, "
+          f"pooled {pooled_seconds / n_queries * 1000:.2f} ms/query ({connect_seconds / pooled_seconds:.1f}x)")
+
+def peak_memory(read):
+    """Run read() and return its result together with the peak Python heap allocation in MB."""
+    tracemalloc.start()
+    try:
+        result = read()
+        return result, tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+def benchmark_streaming_read():
+    """Compare a full fetchall read of the scratch table with streaming it one ticker at a time."""
+    query = f"SELECT * FROM {BENCHMARK_TABLE_NAME} ORDER BY ticker, datetime;"
+    full, full_mb = peak_memory(lambda: len(fetch_dataframe(query)))
+    streamed, streamed_mb = peak_memory(lambda: sum(len(frame) for _, frame in iter_ticker_frames(query, chunk_size=STREAM_CHUNK_SIZE)))
+    assert streamed == full, f"Streaming read {streamed} rows, the full read {full}"
+    print(f"Reading {full:,} rows: fetchall peak {full_mb:,.0f} MB, streamed per ticker peak {streamed_mb:,.0f} MB")
+
+def load_bars_benchmark_table(connection, n_rows=COPY_READ_BENCHMARK_ROWS, price_type='DOUBLE PRECISION'):
+    """Fill a scratch table shaped like alpaca_minute with synthetic bars."""
+    cursor = connection.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {BARS_BENCHMARK_TABLE_NAME};")
+    cursor.execute(f"""
+    CREATE TABLE {BARS_BENCHMARK_TABLE_NAME} (
+        datetime TIMESTAMP,
+        ticker VARCHAR(10),
+        open {price_type},
+        high {price_type},
+        low {price_type},
+        close {price_type},
+        volume BIGINT,
+        PRIMARY KEY (ticker, datetime)
+    );
+    """)
+    bars = make_indicator_rows(n_rows)[BAR_COLUMNS].round({'open': 4, 'high': 4, 'low': 4, 'close': 4})
+    copy_upsert(cursor, bars, BARS_BENCHMARK_TABLE_NAME, BAR_COLUMNS)
+    connection.commit()
+    cursor.close()
+
+def benchmark_copy_read(table_name):
+    """Time reading a bars table with fetchall against decoding it from COPY output, and check both agree."""
+    query = f"SELECT {', '.join(BAR_COLUMNS)} FROM {table_name} ORDER BY ticker, datetime;"
+    start = time.perf_counter()
+    fetched = fetch_dataframe(query)
+    fetch_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    copied = copy_dataframe(query)
+    copy_seconds = time.perf_counter() - start
+    assert len(copied) == len(fetched), f"COPY read {len(copied)} rows, fetchall {len(fetched)}"
+    assert (copied['datetime'] == fetched['datetime']).all(), "datetime values differ"
+    assert (copied['ticker'].astype(str) == fetched['ticker']).all(), "ticker values differ"
+    for column in ['open', 'high', 'low', 'close', 'volume']:
+        assert np.allclose(copied[column].astype(float), fetched[column].astype(float), equal_nan=True), f"{column} values differ"
+    print(f"Reading {len(fetched):,} rows of {table_name}: fetchall {fetch_seconds:.2f}s, "
+          f"COPY {copy_seconds:.2f}s ({fetch_seconds / copy_seconds:.1f}x), "
+          f"COPY dtypes {', '.join(f'{column}={dtype}' for column, dtype in copied.dtypes.items())}")
+
+def benchmark_float_migration(connection):
+    """Time a fetchall read of NUMERIC prices, migrate them to DOUBLE PRECISION and time the same read again."""
+    load_bars_benchmark_table(connection, price_type='NUMERIC')
+    query = f"SELECT {', '.join(BAR_COLUMNS)} FROM {BARS_BENCHMARK_TABLE_NAME};"
+    start = time.perf_counter()
+    numeric_bars = fetch_dataframe(query)
+    numeric_seconds = time.perf_counter() - start
+    assert numeric_bars['close'].dtype == np.float64, f"NUMERIC decoded to {numeric_bars['close'].dtype}, not float64"
+
+    cursor = connection.cursor()
+    ensure_float_columns(cursor, BARS_BENCHMARK_TABLE_NAME, PRICE_COLUMNS)
+    connection.commit()
+    cursor.execute("SELECT DISTINCT data_type FROM information_schema.columns WHERE table_name = %s AND column_name = ANY(%s);",
+                   (BARS_BENCHMARK_TABLE_NAME, PRICE_COLUMNS))
+    assert cursor.fetchall() == [('double precision',)], "The price columns were not migrated"
+    cursor.close()
+
+    start = time.perf_counter()
+    float_bars = fetch_dataframe(query)
+    float_seconds = time.perf_counter() - start
+    assert np.allclose(float_bars['close'], numeric_bars['close']), "close values changed in the migration"
+    print(f"Reading {len(float_bars):,} bars with fetchall: NUMERIC {numeric_seconds:.2f}s, "
+          f"DOUBLE PRECISION {float_seconds:.2f}s ({numeric_seconds / float_seconds:.1f}x)")
+
+# Example usage
+if __name__ == "__main__":
+    benchmark_connection_setup()
+    connection = connect()
+    try:
+        loop_rows = make_indicator_rows(LOOP_BENCHMARK_ROWS)
+        loop_seconds = time_write(connection, write_rows_with_loop, loop_rows, "Row-by-row INSERT")
+        for n_rows in COPY_BENCHMARK_ROWS:
+            rows = make_indicator_rows(n_rows)
+            copy_seconds = time_write(connection, lambda cursor, df: copy_upsert(cursor, df, BENCHMARK_TABLE_NAME, INDICATOR_COLUMNS), rows, "COPY upsert")
+            check_round_trip(connection, rows)
+            if n_rows == LOOP_BENCHMARK_ROWS:
+                print(f"COPY upsert is {loop_seconds / copy_seconds:.1f}x faster than the row-by-row loop on {n_rows:,} rows")
+        benchmark_streaming_read()
+        # Read an existing bars table such as alpaca_minute when one is named, a synthetic one otherwise
+        if len(sys.argv) > 1:
+            benchmark_copy_read(sys.argv[1])
+        else:
+            load_bars_benchmark_table(connection)
+            benchmark_copy_read(BARS_BENCHMARK_TABLE_NAME)
+        benchmark_float_migration(connection)
+    finally:
+        cursor = connection.cursor()
+        cursor.execute(f"DROP TABLE IF EXISTS {BENCHMARK_TABLE_NAME};")
+        cursor.execute(f"DROP TABLE IF EXISTS {BARS_BENCHMARK_TABLE_NAME};")
+        connection.commit()
+        cursor.close()
+        connection.close()